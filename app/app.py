@@ -6,7 +6,7 @@ import optuna
 
 from stravart.utils import simplify_coordinates
 from stravart.polygone import Polygon
-from stravart.search.optimization import generate_route, diff_area, Rotation, Projection
+from stravart.search.optimization import generate_route, generate_grid, diff_area, Rotation, Projection
 
 if 'study_running' not in st.session_state:
     st.session_state.study_running = False
@@ -39,19 +39,6 @@ def generate_fg(final_contour):
     fg.add_child(folium.PolyLine(polyline_coords, color="blue", weight=2.5, opacity=1))
     return fg
 
-def generate_grid(lat_start, lat_end, lon_start, lon_end, lat_points, lon_points):
-    lat_step = (lat_end - lat_start) / (lat_points - 1)
-    lon_step = (lon_end - lon_start) / (lon_points - 1)
-
-    grid = []
-    for i in range(lat_points):
-        for j in range(lon_points):
-            lat = lat_start + i * lat_step
-            lon = lon_start + j * lon_step
-            grid.append((lat, lon))
-    
-    return grid
-
 st.title("StravArt")
 n_trials = st.sidebar.number_input('Number of Trials', min_value=3, max_value=50, value=3)
 grid_size = st.sidebar.slider('City Grid Size', min_value=3, max_value=10, value=5)
@@ -0,0 +1,101 @@
+"""
+Benchmark of the working resolution mode of contour extraction against the full resolution extraction.
+
+Each bundled drawing is upscaled so that its largest side is --size pixels, then its best contour is extracted
+at full resolution, with working_size and with working_size and refine. Each mode reports its median duration,
+its number of points and the Hausdorff distance (in pixels and in % of the image diagonal) of its outline,
+resampled every pixel, to:
+
+- the full resolution polygon of the upscaled image ("vs full"),
+- the polygon of the drawing at its original size, scaled up ("vs native"), as the full resolution pass
+  can pick another contour once the fixed blur of the edge detection is too small for the image.
+
+    python benchmarks/contours.py --size 4000 --working-size 1000 --output contours.json
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from stravart.contours.extraction import ContourExtractor
+from stravart.search.metrics import hausdorff_distance
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "img")
+IMAGES = ["dino.jpg", "dino3.jpeg", "dog.jpg", "shark.png"]
+
+
+def resample(polygon, step=1.):
+    """Points every step pixels along the closed polygon, so that distances compare outlines and not vertices."""
+    closed = np.vstack([polygon, polygon[:1]])
+    lengths = np.hypot(*np.diff(closed, axis=0).T)
+    distances = np.concatenate([[0], np.cumsum(lengths)])
+    samples = np.arange(0, distances[-1], step)
+    return np.column_stack([np.interp(samples, distances, closed[:, k]) for k in range(2)])
+
+
+def extract(image, repeat, **kwargs):
+    """Best contour of image extracted repeat times, returns (raw contour, list of durations in seconds)."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        contour = ContourExtractor(image_path=None, image=image, **kwargs).get_best_contour()
+        durations.append(time.perf_counter() - start)
+    return np.asarray(contour.raw_contour, dtype=np.float64), durations
+
+
+def run(images, size, working_size, repeat):
+    results = []
+    for name in images:
+        native = cv2.imread(os.path.join(IMAGE_DIR, name))
+        factor = size / max(native.shape[:2])
+        image = cv2.resize(native, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC)
+        diagonal = float(np.hypot(*image.shape[:2]))
+        # The native polygon in the pixel grid of the upscaled image, y being flipped by get_best_contour
+        native_polygon, _ = extract(native, 1)
+        native_polygon *= [image.shape[1] / native.shape[1], image.shape[0] / native.shape[0]]
+
+        modes = {
+            "full": {},
+            "working": {"working_size": working_size},
+            "refined": {"working_size": working_size, "refine": True},
+        }
+        native_outline = resample(native_polygon)
+        outlines = {}
+        for mode, kwargs in modes.items():
+            polygon, durations = extract(image, repeat, **kwargs)
+            outlines[mode] = resample(polygon)
+            full_distance = hausdorff_distance(outlines[mode], outlines["full"])
+            native_distance = hausdorff_distance(outlines[mode], native_outline)
+            results.append({
+                "image": name, "size": size, "mode": mode, "working_size": kwargs.get("working_size"),
+                "median": float(np.median(durations)), "points": len(polygon),
+                "hausdorff_full": float(full_distance), "hausdorff_full_pct": 100 * float(full_distance) / diagonal,
+                "hausdorff_native": float(native_distance), "hausdorff_native_pct": 100 * float(native_distance) / diagonal,
+            })
+            result = results[-1]
+            print(f"{name:>12} {mode:>8} median {result['median'] * 1000:>9.1f}ms {result['points']:>5} points  "
+                  f"vs full {result['hausdorff_full']:>7.1f}px ({result['hausdorff_full_pct']:.2f}%)  "
+                  f"vs native {result['hausdorff_native']:>7.1f}px ({result['hausdorff_native_pct']:.2f}%)")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", nargs="+", choices=IMAGES, default=IMAGES)
+    parser.add_argument("--size", type=int, default=4000, help="Largest side in pixels of the upscaled drawings.")
+    parser.add_argument("--working-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Json file the results are written to.")
+    args = parser.parse_args(argv)
+
+    results = run(args.images, args.size, args.working_size, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
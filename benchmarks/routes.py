@@ -0,0 +1,252 @@
+"""
+Benchmarks of the route generation hot path: projection, routing, loss, contour extraction and whole trials.
+
+Routing goes through FakeRoutingClient, a RoutingClient answering OSRM requests with deterministic
+paths after a configurable latency, so that runs need no network and are comparable across commits.
+diff_area_legacy times the implementation of diff_area before the ragged buffer on the same routes, after
+checking that it gives the same loss. Results are written as json, and compared with a previous run with --compare:
+
+    python benchmarks/routes.py --output bench.json
+    git checkout other-branch && python benchmarks/routes.py --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+import zlib
+
+import cv2
+import numpy as np
+import optuna
+
+from stravart import profiling
+from stravart.client import DEFAULT_RATE_LIMITS, RoutingClient
+from stravart.contours.extraction import ContourExtractor
+from stravart.directions import OSRM_ROUTE_URL
+from stravart.polygone import Polygon
+from stravart.search.metrics import diff_area
+from stravart.search.operations import Projection, Rotation, compose
+from stravart.search.optimization import generate_grid, objective
+
+MAP_CENTER = (48.8675, 2.3638)
+RADIUS = 0.03
+
+
+class FakeRoutingClient(RoutingClient):
+    """
+    RoutingClient answering every OSRM request locally, after latency seconds, with a path of path_points
+    points wiggling around the straight segment. The wiggle is seeded by the endpoints, so the same segment
+    always gets the same path.
+    """
+
+    def __init__(self, latency=0., path_points=8, **kwargs):
+        super().__init__(rate_limits={provider: None for provider in DEFAULT_RATE_LIMITS}, **kwargs)
+        self.latency = latency
+        self.path_points = path_points
+
+    def _path(self, start, end):
+        seed = zlib.crc32(np.array([start, end]).tobytes())
+        t = np.linspace(0, 1, self.path_points)[:, None]
+        (lon0, lat0), (lon1, lat1) = start, end
+        offset = np.random.default_rng(seed).uniform(-1, 1, self.path_points) * np.sin(np.pi * t[:, 0]) * 0.1
+        # Perpendicular wiggle, null at both endpoints
+        points = np.array(start) + t * (np.array(end) - np.array(start))
+        points += offset[:, None] * np.array([lat0 - lat1, lon1 - lon0])
+        return points.tolist()
+
+    async def get_json(self, provider, url, params=None, semaphore=None):
+        if provider != "osrm":
+            raise ValueError("FakeRoutingClient only answers osrm requests.")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.request_count += 1
+        profiling.count("http_requests")
+        waypoints = [tuple(map(float, point.split(","))) for point in url[len(OSRM_ROUTE_URL):].split("/")[-1].split(";")]
+        legs = [self._path(start, end) for start, end in zip(waypoints[:-1], waypoints[1:])]
+        return {"code": "Ok", "routes": [{
+            "geometry": {"coordinates": [point for leg in legs for point in leg]},
+            "legs": [{"steps": [{"geometry": {"coordinates": leg}}]} for leg in legs],
+        }]}
+
+
+def synthetic_polygon(n_vertices, seed=0):
+    """Closed cartesian star-like polygon of n_vertices distinct vertices."""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    radius = 100 * (1 + 0.3 * np.sin(5 * angles) + 0.05 * rng.uniform(-1, 1, n_vertices))
+    points = np.column_stack([radius * np.cos(angles), radius * np.sin(angles)])
+    return Polygon.from_list(np.vstack([points, points[:1]]).tolist(), system="cartesian")
+
+
+def synthetic_image(size):
+    """size x size drawing of a filled star-like shape."""
+    polygon = synthetic_polygon(64).array
+    image = np.full((size, size, 3), 255, dtype=np.uint8)
+    points = (size / 2 + polygon * size / 300).astype(np.int32)
+    cv2.fillPoly(image, [points], (0, 0, 0))
+    return image
+
+
+def timed(function, repeat):
+    """Run function repeat times, returns the list of durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def bench_projection(size, repeat, **_):
+    poly = synthetic_polygon(size)
+    operation = compose(Rotation(10), Projection(center=MAP_CENTER, radius=RADIUS, map_type="GPS"))
+    return timed(lambda: operation.apply(poly), repeat)
+
+
+def bench_fill_paths(size, repeat, client, **_):
+    gps_poly = Projection(center=MAP_CENTER, radius=RADIUS, map_type="GPS").apply(synthetic_polygon(size))
+    return timed(lambda: gps_poly.fill_paths_between_points(provider="osrm", client=client), repeat)
+
+
+def bench_diff_area(size, repeat, client, **_):
+    gps_poly = Projection(center=MAP_CENTER, radius=RADIUS, map_type="GPS").apply(synthetic_polygon(size))
+    final_contour, path_mapping = gps_poly.fill_paths_between_points(provider="osrm", client=client)
+    return timed(lambda: diff_area(final_contour, path_mapping), repeat)
+
+
+def legacy_diff_area(actual_bicycle_contour, path_mapping):
+    """
+    diff_area as implemented before the ragged buffer: one MinMaxScaler transform and one Python shoelace
+    loop per segment (without mutating path_mapping), kept as the reference of bench_diff_area_legacy.
+    """
+    from sklearn.preprocessing import MinMaxScaler
+
+    scaler = MinMaxScaler()
+    scaler.fit(actual_bicycle_contour.to_folium_tuples())
+    total_area = 0.
+    for route in path_mapping.values():
+        points = route.to_folium_tuples()
+        if not points:
+            continue
+        coordinates = scaler.transform(points + [points[0]]).tolist()
+        if len(coordinates) < 4:
+            continue
+        area = 0
+        for (x1, y1), (x2, y2) in zip(coordinates[:-1], coordinates[1:]):
+            area += (x1 * y2) - (x2 * y1)
+        total_area += abs(area) / 2
+    return total_area
+
+
+def bench_diff_area_legacy(size, repeat, client, **_):
+    """Times legacy_diff_area on the routes of bench_diff_area, after checking that both losses match."""
+    gps_poly = Projection(center=MAP_CENTER, radius=RADIUS, map_type="GPS").apply(synthetic_polygon(size))
+    final_contour, path_mapping = gps_poly.fill_paths_between_points(provider="osrm", client=client)
+    legacy, loss = legacy_diff_area(final_contour, path_mapping), diff_area(final_contour, path_mapping)
+    if not np.isclose(legacy, loss, rtol=1e-9, atol=1e-12):
+        raise AssertionError(f"diff_area {loss} differs from the legacy implementation {legacy}")
+    return timed(lambda: legacy_diff_area(final_contour, path_mapping), repeat)
+
+
+def bench_contours(size, repeat, **_):
+    image = synthetic_image(size)
+    return timed(lambda: ContourExtractor(image_path=None, image=image).get_best_contour(), repeat)
+
+
+def bench_trial(size, repeat, client, **_):
+    """One whole objective call per repetition: search space, projection, routing and loss."""
+    poly = synthetic_polygon(size)
+    city_grid = generate_grid(48.8156, 48.9022, 2.2241, 2.4699, 10, 10)
+    study = optuna.create_study(direction="minimize", sampler=optuna.samplers.RandomSampler(seed=0))
+    return timed(lambda: study.optimize(
+        lambda trial: objective(trial, poly=poly, city_grid=city_grid, provider="osrm", client=client), n_trials=1
+    ), repeat)
+
+
+# Benchmark name to (function, sizes): polygon vertices, or image side for contours
+BENCHMARKS = {
+    "projection": (bench_projection, [10, 100, 1000, 10000]),
+    "fill_paths": (bench_fill_paths, [10, 100, 1000, 10000]),
+    "diff_area": (bench_diff_area, [10, 100, 1000, 10000]),
+    "diff_area_legacy": (bench_diff_area_legacy, [10, 100, 1000]),
+    "contours": (bench_contours, [256, 1024, 2048]),
+    "trial": (bench_trial, [10, 100, 1000]),
+}
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, repeat, latency, path_points):
+    results = []
+    with FakeRoutingClient(latency=latency, path_points=path_points) as client:
+        for name in names:
+            function, sizes = BENCHMARKS[name]
+            for size in sizes:
+                durations = function(size, repeat, client=client)
+                results.append({
+                    "name": name, "size": size, "repeat": repeat,
+                    "median": float(np.median(durations)), "min": float(np.min(durations)), "mean": float(np.mean(durations)),
+                })
+                print(f"{name:>16} {size:>6} median {results[-1]['median'] * 1000:>10.2f}ms min {results[-1]['min'] * 1000:>10.2f}ms")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the median ratio of each benchmark to the baseline, returns the keys slower than 1 + tolerance."""
+    previous = {(result["name"], result["size"]): result for result in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit')}:")
+    for result in results:
+        key = (result["name"], result["size"])
+        if key not in previous:
+            continue
+        ratio = result["median"] / previous[key]["median"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key[0]:>16} {key[1]:>6} x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0., help="Latency in seconds of each fake routing request.")
+    parser.add_argument("--path-points", type=int, default=8, help="Number of points of each fake routed path.")
+    parser.add_argument("--output", help="Json file the results are written to.")
+    parser.add_argument("--compare", help="Json results of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown ratio reported as a regression.")
+    args = parser.parse_args(argv)
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "latency": args.latency,
+        "path_points": args.path_points,
+        "results": run(args.benchmarks, args.repeat, args.latency, args.path_points),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report["results"], json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -51,5 +51,12 @@ setup(
         exclude=["*.tests", "*.tests.*", "tests.*", "tests"],
     ),
     install_requires=read_requirements("requirements.txt"),
+    entry_points={
+        "console_scripts": [
+            "stravart-study=stravart.search.runner:main",
+            "stravart-contours=stravart.contours.batch:main",
+            "stravart-export=stravart.export:main",
+        ],
+    },
     python_requires=">=3.7",
 )
\ No newline at end of file
@@ -0,0 +1,221 @@
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SegmentCache:
+    """
+    Two-tier cache of routed segments: an in-memory LRU in front of an optional SQLite file.
+
+    Entries are keyed on the rounded start/end coordinates of a Direction, the provider and the mode,
+    so that nearly identical segments requested by successive trials share the same routed path.
+
+    :param path: Location of the SQLite database. If None, only the in-memory tier is used.
+    :param max_memory_entries: Maximum number of segments kept in memory (least recently used are evicted).
+    :param max_disk_entries: Maximum number of segments kept on disk (least recently accessed are evicted).
+    :param ttl: Time to live of an entry in seconds. None means entries never expire.
+    :param decimals: Number of decimals used to round coordinates when building keys.
+    :param access_batch: Number of disk hits whose access times are kept in memory before being written,
+        so that reads do not take the write lock of the database. See flush.
+    """
+
+    def __init__(self, path=None, max_memory_entries=4096, max_disk_entries=100000, ttl=30 * 24 * 3600, decimals=5,
+                 access_batch=256):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.decimals = decimals
+        self.access_batch = access_batch
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+        self._memory = OrderedDict()
+        self._pending_writes = 0
+        self._accessed = {}
+        self._buffered_hits = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        if self.path is not None:
+            self._connect()
+
+    def _connect(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Several processes may share the same file: wait for locks and let readers run alongside the writer
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS segments_accessed ON segments (accessed)")
+        self._connection.commit()
+
+    def __getstate__(self):
+        # SQLite connections and locks cannot be pickled, each process reopens its own.
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_lock"] = None
+        state["_accessed"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self._connect()
+
+    def key(self, direction, provider, mode):
+        """Build the cache key of a direction routed with a given provider and mode."""
+        start = direction.start
+        end = direction.end
+        d = self.decimals
+        return (
+            f"{round(start.latitude, d)},{round(start.longitude, d)};"
+            f"{round(end.latitude, d)},{round(end.longitude, d)}|{provider}|{mode}"
+        )
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, direction, provider, mode):
+        """Return the cached Route of a direction, or None if it is missing or expired."""
+        from .directions import Route
+
+        key = self.key(direction, provider, mode)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, path = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return Route.from_list(path)
+                del self._memory[key]
+
+            if self._connection is not None:
+                row = self._connection.execute("SELECT path, created FROM segments WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    path, created = json.loads(row[0]), row[1]
+                    if not self._expired(created, now):
+                        self._accessed[key] = now
+                        self._buffered_hits += 1
+                        if self._buffered_hits >= self.access_batch:
+                            self._flush_accessed()
+                            self._connection.commit()
+                        self._remember(key, created, path)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return Route.from_list(path)
+                    self._connection.execute("DELETE FROM segments WHERE key = ?", (key,))
+                    self._connection.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, direction, provider, mode, route):
+        """Store the Route of a direction in both tiers."""
+        if route is None:
+            return
+        key = self.key(direction, provider, mode)
+        path = [list(coord) for coord in route.to_folium_tuples()]
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, path)
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO segments (key, path, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(path), now, now),
+                )
+                self._pending_writes += 1
+                self._flush_accessed()
+                # Counting rows is not free, so eviction only runs every few writes
+                if self._pending_writes >= 128:
+                    self._evict_disk()
+                    self._pending_writes = 0
+                self._connection.commit()
+
+    def _flush_accessed(self):
+        """Write the buffered access times, within the current transaction."""
+        if self._accessed:
+            self._connection.executemany(
+                "UPDATE segments SET accessed = ? WHERE key = ?", [(now, key) for key, now in self._accessed.items()]
+            )
+            self._accessed.clear()
+        self._buffered_hits = 0
+
+    def flush(self):
+        """Write the buffered access times of the disk hits."""
+        with self._lock:
+            if self._connection is not None and self._accessed:
+                self._flush_accessed()
+                self._connection.commit()
+
+    def close(self):
+        """Flush the buffered access times and close the database."""
+        self.flush()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _remember(self, key, created, path):
+        self._memory[key] = (created, path)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM segments").fetchone()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM segments WHERE key IN (SELECT key FROM segments ORDER BY accessed ASC LIMIT ?)",
+                (excess,),
+            )
+        if self.ttl is not None:
+            self._connection.execute("DELETE FROM segments WHERE created < ?", (time.time() - self.ttl,))
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._memory.clear()
+            self._accessed.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM segments")
+                self._connection.commit()
+            self.hits = self.misses = self.memory_hits = self.disk_hits = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats(self):
+        """Return hit/miss counters as a dict."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hit_rate,
+            "memory_entries": len(self._memory),
+        }
+
+    def __len__(self):
+        return len(self._memory)
@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import profiling
+from .coordinates import OVERPASS_URL
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Requests per second allowed for each provider, None means unlimited
+DEFAULT_RATE_LIMITS = {
+    "google": 50,
+    "mapbox": 5,
+    "osrm": None,
+    "overpass": 2,
+}
+
+
+class RoutingError(Exception):
+    pass
+
+
+class _RateLimiter:
+    """
+    Space out requests so that at most rate of them start per second.
+    Slots are reserved under a thread lock, so one limiter is shared by every event loop using the client.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1. / rate
+        self._next = 0.
+        self._lock = threading.Lock()
+
+    async def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class RoutingClient:
+    """
+    Asynchronous routing client sharing one pool of keep-alive connections across all requests.
+
+    Requests run on a thread pool through a single requests.Session, are bounded by a concurrency
+    semaphore, spaced out by a per-provider rate limit, and retried with exponential backoff on 429/5xx.
+
+    :param max_concurrency: Maximum number of requests in flight.
+    :param rate_limits: Requests per second allowed for each provider, merged with DEFAULT_RATE_LIMITS.
+    :param max_retries: Number of retries after a 429/5xx answer or a connection error.
+    :param backoff: Base delay in seconds of the exponential backoff.
+    :param timeout: Timeout in seconds of a single request.
+    :param urls: Override of the provider base urls (e.g. to point at a local stub server),
+        keys are "google", "mapbox", "osrm" and "overpass".
+    """
+
+    def __init__(self, max_concurrency=16, rate_limits=None, max_retries=4, backoff=0.5, timeout=30, urls=None):
+        self.max_concurrency = max_concurrency
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.urls = urls or {}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.rate_limits), pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._limiters = {
+            provider: _RateLimiter(rate) for provider, rate in self.rate_limits.items() if rate
+        }
+
+        self.request_count = 0
+        self.bytes_received = 0
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _url(self, provider, url):
+        # Swap the default base url of a provider for the overridden one
+        from . import directions
+
+        defaults = {
+            "google": directions.GOOGLE_DIRECTIONS_URL,
+            "mapbox": directions.MAPBOX_DIRECTIONS_URL,
+            "osrm": directions.OSRM_ROUTE_URL,
+            "overpass": OVERPASS_URL,
+        }
+        if provider in self.urls and url.startswith(defaults[provider]):
+            return self.urls[provider] + url[len(defaults[provider]):]
+        return url
+
+    async def get_json(self, provider, url, params=None, semaphore=None):
+        """
+        GET a json document, retrying on 429/5xx and connection errors.
+        :param semaphore: asyncio.Semaphore bounding the requests in flight, shared by the callers of one batch.
+        :raise RoutingError: if the request keeps failing or returns another error status.
+        """
+        url = self._url(provider, url)
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        limiter = self._limiters.get(provider)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                if limiter is not None:
+                    await limiter.wait()
+                try:
+                    response = await loop.run_in_executor(
+                        self._executor, lambda: self.session.get(url, params=params, timeout=self.timeout)
+                    )
+                except requests.RequestException as e:
+                    response, error = None, e
+            if response is not None:
+                self.request_count += 1
+                self.bytes_received += len(response.content)
+                profiling.count("http_requests")
+                profiling.count("http_bytes", len(response.content))
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in RETRY_STATUSES:
+                    raise RoutingError(f"{provider} request failed with status {response.status_code}: {response.text[:200]}")
+                error = RoutingError(f"{provider} request failed with status {response.status_code}")
+            if attempt == self.max_retries:
+                break
+            profiling.count("http_retries")
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            await asyncio.sleep(delay)
+        raise RoutingError(f"{provider} request to {url} failed after {self.max_retries + 1} attempts") from error
+
+    async def route(self, direction, provider="google", mode="walking", semaphore=None):
+        """Route one Direction, returns a Route."""
+        url, params = direction.request(provider, mode)
+        data = await self.get_json(provider, url, params=params, semaphore=semaphore)
+        return direction.parse_response(provider, data)
+
+    async def route_many(self, directions, provider="google", mode="walking", return_exceptions=False):
+        """
+        Route many Directions concurrently, returns the Routes in the same order.
+        A failing segment does not cancel the others, every request runs to completion.
+        :param return_exceptions: Return the exception of a failing segment in place of its Route,
+            instead of raising a RoutingError once all segments are done.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(
+            *(self.route(direction, provider, mode, semaphore=semaphore) for direction in directions),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors and not return_exceptions:
+            raise RoutingError(f"{len(errors)} of {len(results)} segments failed, first: {errors[0]}") from errors[0]
+        return results
+
+    async def route_waypoints(self, waypoints, provider="osrm", mode="walking", semaphore=None):
+        """Route through a list of Coordinates in a single request, returns one Route per leg."""
+        from .directions import waypoints_request, parse_legs
+
+        url, params = waypoints_request(waypoints, provider, mode)
+        data = await self.get_json(provider, url, params=params, semaphore=semaphore)
+        return parse_legs(provider, data)
+
+    async def route_waypoints_many(self, waypoints_list, provider="osrm", mode="walking"):
+        """
+        Route many lists of waypoints concurrently.
+        A failing request yields its exception in place of the legs, so that callers can fall back on it.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(
+            *(self.route_waypoints(waypoints, provider, mode, semaphore=semaphore) for waypoints in waypoints_list),
+            return_exceptions=True,
+        )
+
+    async def nearest_bicycle_road_points(self, coordinates, dist=1000):
+        """Nearest bicycle road point of each Coordinates, None where it could not be found."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def nearest(coord):
+            try:
+                data = await self.get_json(
+                    "overpass", OVERPASS_URL, params=coord.overpass_request(dist), semaphore=semaphore
+                )
+                return coord.parse_nearest_bicycle_road_point(data)
+            except Exception as e:
+                print(f"Error getting closest bicycle coordinate for {coord.to_tuple()}: {e}")
+                return None
+
+        return await asyncio.gather(*(nearest(coord) for coord in coordinates))
+
+    def run(self, coroutine):
+        """Run a coroutine to completion from synchronous code, including from inside a running event loop (e.g. Jupyter)."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        result = {}
+        # Keep the context variables (e.g. the active Profiler) of the caller in the new thread
+        context = contextvars.copy_context()
+
+        def target():
+            try:
+                result["value"] = context.run(asyncio.run, coroutine)
+            except BaseException as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def route_many_sync(self, directions, provider="google", mode="walking", return_exceptions=False):
+        """Synchronous wrapper of route_many."""
+        return self.run(self.route_many(directions, provider=provider, mode=mode, return_exceptions=return_exceptions))
+
+    def route_waypoints_many_sync(self, waypoints_list, provider="osrm", mode="walking"):
+        """Synchronous wrapper of route_waypoints_many."""
+        return self.run(self.route_waypoints_many(waypoints_list, provider=provider, mode=mode))
+
+    def nearest_bicycle_road_points_sync(self, coordinates, dist=1000):
+        """Synchronous wrapper of nearest_bicycle_road_points."""
+        return self.run(self.nearest_bicycle_road_points(coordinates, dist=dist))
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """Client shared by all callers that do not provide their own, so connections are reused across trials."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = RoutingClient()
+        return _default_client
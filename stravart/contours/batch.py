@@ -0,0 +1,207 @@
+"""
+Batch image-to-polygon extraction.
+
+Images from directories, glob patterns, urls or text files listing them are streamed through the
+ContourExtractor stages (decode, edges, contours, merge, approximate, filter) on a process pool, and
+the resulting polygons are written to a single compressed .npz file:
+
+    stravart-contours drawings/ "uploads/*.png" urls.txt --output polygons.npz --n-workers 8
+
+A failing image is reported with its error and does not abort the batch.
+"""
+import argparse
+import glob
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import requests
+
+from stravart.contours.extraction import ContourExtractor
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+STAGES = ("fetch", "read", "decode", "edges", "contours", "merge", "merge_largest", "refine", "approximate", "filter")
+
+
+def iter_sources(inputs):
+    """
+    Expand inputs into image sources: urls are kept as is, directories give their image files,
+    .txt files give the sources they list (one per line) and anything else is a glob pattern.
+    """
+    for entry in inputs:
+        if entry.startswith(("http://", "https://")):
+            yield entry
+        elif os.path.isdir(entry):
+            for name in sorted(os.listdir(entry)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(entry, name)
+        elif entry.endswith(".txt") and os.path.isfile(entry):
+            with open(entry) as f:
+                yield from iter_sources([line.strip() for line in f if line.strip() and not line.startswith("#")])
+        else:
+            matches = sorted(glob.glob(entry))
+            # Unmatched paths are still yielded, so that they are reported as failures
+            yield from matches or [entry]
+
+
+def extract_polygon(source, data=None, merge_threshold=0.05, eps=0.0001, filter_threshold=15, working_size=None,
+                    refine=False):
+    """
+    Extract the best contour of one image, see ContourExtractor.get_best_contour.
+    :param source: Path of the image, or its url when data is given.
+    :param data: Encoded image bytes, read from source if None.
+    :param working_size: Largest side of the downscaled image the contours are extracted from, see ContourExtractor.
+    :param refine: Refine the selected contour at full resolution, see ContourExtractor.
+    :return: Dict with the source, the (N, 2) polygon (None on failure), the duration of each stage
+        in seconds and the error message (None on success).
+    """
+    timings = {}
+    try:
+        if data is None:
+            start = time.perf_counter()
+            with open(source, "rb") as f:
+                data = f.read()
+            timings["read"] = time.perf_counter() - start
+        start = time.perf_counter()
+        image = ContourExtractor.decode_image(data)
+        timings["decode"] = time.perf_counter() - start
+        if image is None:
+            raise ValueError("Could not decode the image")
+        extractor = ContourExtractor(image_path=source, image=image, working_size=working_size, refine=refine)
+        contour = extractor.get_best_contour(
+            merge_threshold=merge_threshold, eps=eps, filter_threshold=filter_threshold, timings=timings
+        )
+        return {"source": source, "polygon": contour.raw_contour, "timings": timings, "error": None}
+    except Exception as e:
+        return {"source": source, "polygon": None, "timings": timings, "error": f"{type(e).__name__}: {e}"}
+
+
+def _fetch(session, url, timeout):
+    start = time.perf_counter()
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content, time.perf_counter() - start
+
+
+def run_batch(inputs, output=None, n_workers=None, fetch_workers=8, timeout=30, max_pending=None, **params):
+    """
+    Extract the polygons of many images on a process pool.
+
+    Urls are downloaded concurrently on fetch_workers threads sharing one connection pool while
+    local files are read by the workers themselves. At most max_pending images are in flight, downloading
+    or extracting, so that folders and url lists of any size stream through the pools.
+
+    :param inputs: Directories, glob patterns, urls or .txt files listing them, see iter_sources.
+    :param output: Optional .npz path the results are written to, see save_polygons.
+    :param n_workers: Number of worker processes, os.cpu_count() if None.
+    :param params: merge_threshold, eps, filter_threshold, working_size and refine passed to extract_polygon.
+    :return: List of the extract_polygon results, in input order.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    max_pending = max_pending or 4 * n_workers
+    sources = list(iter_sources(inputs))
+    results = [None] * len(sources)
+
+    with requests.Session() as session, \
+            ThreadPoolExecutor(max_workers=fetch_workers) as fetcher, \
+            ProcessPoolExecutor(max_workers=n_workers) as pool:
+        queue = deque(range(len(sources)))
+        downloads = {}
+        fetch_times = {}
+        pending = {}
+
+        def submit(index, data=None):
+            pending[pool.submit(extract_polygon, sources[index], data, **params)] = index
+
+        while queue or downloads or pending:
+            # A downloaded image stays in flight until extracted, so that its bytes count against max_pending
+            while queue and len(pending) + len(downloads) < max_pending:
+                index = queue.popleft()
+                if sources[index].startswith(("http://", "https://")):
+                    downloads[fetcher.submit(_fetch, session, sources[index], timeout)] = index
+                else:
+                    submit(index)
+            done, _ = wait(list(pending) + list(downloads), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    index = downloads.pop(future)
+                    try:
+                        data, fetch_times[index] = future.result()
+                        submit(index, data)
+                    except Exception as e:
+                        results[index] = {"source": sources[index], "polygon": None, "timings": {},
+                                          "error": f"{type(e).__name__}: {e}"}
+                else:
+                    index = pending.pop(future)
+                    results[index] = future.result()
+                    if index in fetch_times:
+                        results[index]["timings"]["fetch"] = fetch_times.pop(index)
+
+    if output is not None:
+        save_polygons(output, results)
+    return results
+
+
+def save_polygons(path, results):
+    """
+    Write extraction results to a compressed .npz file: the points of every polygon in one int32 array
+    with the offsets of each polygon, the sources, the errors ("" on success) and a timings matrix
+    (one column per stage of STAGES, NaN for stages not run).
+    """
+    polygons = [result["polygon"] if result["polygon"] is not None else np.empty((0, 2)) for result in results]
+    lengths = np.array([len(polygon) for polygon in polygons], dtype=np.int64)
+    np.savez_compressed(
+        path,
+        points=np.vstack(polygons).astype(np.int32) if polygons else np.empty((0, 2), dtype=np.int32),
+        offsets=np.concatenate([[0], np.cumsum(lengths)]),
+        sources=np.array([result["source"] for result in results], dtype=str),
+        errors=np.array([result["error"] or "" for result in results], dtype=str),
+        stages=np.array(STAGES),
+        timings=np.array([[result["timings"].get(stage, np.nan) for stage in STAGES] for result in results],
+                         dtype=np.float64).reshape(-1, len(STAGES)),
+    )
+
+
+def load_polygons(path):
+    """Read a file written by save_polygons, returns a dict from source to its (N, 2) polygon (successes only)."""
+    with np.load(path) as data:
+        points, offsets = data["points"], data["offsets"]
+        return {
+            str(source): points[offsets[i]:offsets[i + 1]]
+            for i, (source, error) in enumerate(zip(data["sources"], data["errors"])) if not error
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract the polygons of a batch of images.")
+    parser.add_argument("inputs", nargs="+", help="Directories, glob patterns, urls or .txt files listing them.")
+    parser.add_argument("--output", default="polygons.npz")
+    parser.add_argument("--n-workers", type=int)
+    parser.add_argument("--merge-threshold", type=float, default=0.05)
+    parser.add_argument("--eps", type=float, default=0.0001)
+    parser.add_argument("--filter-threshold", type=float, default=15)
+    parser.add_argument("--working-size", type=int, help="Extract contours on images downscaled to this largest side.")
+    parser.add_argument("--refine", action="store_true", help="Refine the selected contour at full resolution.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = run_batch(
+        args.inputs, output=args.output, n_workers=args.n_workers,
+        merge_threshold=args.merge_threshold, eps=args.eps, filter_threshold=args.filter_threshold,
+        working_size=args.working_size, refine=args.refine,
+    )
+    failures = [result for result in results if result["error"]]
+    for result in failures:
+        print(f"FAILED {result['source']}: {result['error']}")
+
+    totals = {stage: sum(result["timings"].get(stage, 0.) for result in results) for stage in STAGES}
+    print(f"{len(results) - len(failures)}/{len(results)} images extracted to {args.output} "
+          f"in {time.perf_counter() - start:.2f}s")
+    print("Time per stage (summed over workers): " +
+          ", ".join(f"{stage} {total:.3f}s" for stage, total in totals.items() if total))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import threading
+
+
+class ContourCache:
+    """
+    Content-addressed cache of the intermediate results of ContourExtractor.
+
+    The key of a stage hashes the key of the stage it is computed from together with its own name and
+    parameters, starting from the hash of the image bytes. Changing a parameter therefore only misses
+    the stages from the one using it onward: with a new eps, the grayscale image, edges, contours and
+    merged contours are reused and only the approximation and filtering run again.
+
+    :param path: Optional directory where entries are also pickled, so that they survive restarts.
+    :param max_entries: Maximum number of entries kept in memory (least recently used are evicted).
+    """
+
+    def __init__(self, path=None, max_entries=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def hash_bytes(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def key(parent, stage, **params):
+        """Key of a stage computed from the result keyed by parent with the given parameters."""
+        description = repr((parent, stage, sorted(params.items())))
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached value of a key, or None if it is missing."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+        if self.path is not None and os.path.exists(self._file(key)):
+            with open(self._file(key), "rb") as f:
+                value = pickle.load(f)
+            with self._lock:
+                self._remember(key, value)
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        if self.path is not None:
+            # Write then rename, so that concurrent readers never load a partial file
+            temporary = f"{self._file(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._file(key))
+
+    def memoize(self, key, compute):
+        """Return the cached value of a key, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.misses = 0
+        if self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.path, name))
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats(self):
+        """Return hit/miss counters as a dict."""
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "memory_entries": len(self._memory)}
+
+    def __len__(self):
+        return len(self._memory)
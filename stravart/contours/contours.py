@@ -10,45 +10,75 @@ class Contour:
         self.merged_contour = self.raw_contour.reshape(-1, 2)
         epsilon = eps * cv2.arcLength(self.merged_contour, True)
         self.simplified_contour = cv2.approxPolyDP(self.merged_contour, epsilon, True)
+        return self.simplified_contour
 
     def filter_close_points(self, threshold):
+        """
+        Greedily keep the points farther than threshold from every point kept before them.
+        Kept points are bucketed in a grid of threshold sized cells, so each point is only
+        compared to the kept points of its 3x3 neighboring cells.
+        """
         contour = self.simplified_contour.reshape(-1, 2)
         if len(contour) == 0:
             return np.array([])
+        if threshold <= 0:
+            return Contour(raw_contour=contour.copy())
 
-        filtered_contour = [contour[0]]
-        for point in contour[1:]:
-            if all(np.linalg.norm(point - other_point) >= threshold for other_point in filtered_contour):
-                filtered_contour.append(point)
+        cells = np.floor(contour / threshold).astype(np.int64).tolist()
+        points = contour.astype(np.float64).tolist()
+        threshold2 = threshold * threshold
+        grid = {}
+        keep = []
+        for index, ((cx, cy), (x, y)) in enumerate(zip(cells, points)):
+            if not any(
+                (x - ox) ** 2 + (y - oy) ** 2 < threshold2
+                for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                for ox, oy in grid.get((cx + dx, cy + dy), ())
+            ):
+                grid.setdefault((cx, cy), []).append((x, y))
+                keep.append(index)
 
-        return Contour(raw_contour=np.array(filtered_contour))
+        return Contour(raw_contour=contour[keep])
 
     def replace_with_longest_sublist(self, contour):
-        contour_tuples = [tuple(point) for point in contour]
-        longest_sublists = {}
-
-        for i in range(len(contour_tuples)):
-            for j in range(i + 1, len(contour_tuples)):
-                start_point = contour_tuples[i]
-                end_point = contour_tuples[j]
-                sublist = contour_tuples[i:j + 1]
+        """
+        Rewrite the contour with the longest sublists between its points.
+        The longest sublist between two points runs from the first occurrence of the start to the last
+        occurrence of the end, so a single pass over the first/last occurrence of each point is enough.
+        """
+        contour = np.asarray(contour)
+        n = len(contour)
+        if n == 0:
+            return np.array([])
 
-                if (start_point, end_point) not in longest_sublists or len(sublist) > len(longest_sublists[(start_point, end_point)]):
-                    longest_sublists[(start_point, end_point)] = sublist
+        _, ids, counts = np.unique(contour.reshape(n, -1), axis=0, return_inverse=True, return_counts=True)
+        ids = ids.ravel()
+        first = np.full(len(counts), n)
+        np.minimum.at(first, ids, np.arange(n))
+        last = np.full(len(counts), -1)
+        np.maximum.at(last, ids, np.arange(n))
 
-        new_contour = []
+        starts, ends = [], []
         i = 0
-        while i < len(contour_tuples):
-            for j in range(i + 1, len(contour_tuples) + 1):
-                start_point = contour_tuples[i]
-                end_point = contour_tuples[j - 1]
-                if (start_point, end_point) in longest_sublists:
-                    new_contour.extend(longest_sublists[(start_point, end_point)])
-                    i = j - 1
-                    break
-            i += 1
+        while i < n:
+            if counts[ids[i]] > 1:
+                starts.append(first[ids[i]])
+                ends.append(last[ids[i]])
+                i += 1
+            elif i + 1 < n:
+                starts.append(first[ids[i]])
+                ends.append(last[ids[i + 1]])
+                i += 2
+            else:
+                i += 1
+        if not starts:
+            return np.array([])
 
-        return np.array(new_contour)
+        # Concatenate the spans starts[k]..ends[k] (inclusive) as one index array
+        starts, lengths = np.array(starts), np.array(ends) - np.array(starts) + 1
+        offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        indices = np.repeat(starts, lengths) + np.arange(lengths.sum()) - offsets
+        return contour[indices]
     
     def slice_contour(self, step: int):
         """Returns a new Contour instance with raw_contour sliced by the given step."""
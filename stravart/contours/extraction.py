@@ -1,43 +1,174 @@
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
 import cv2
 import numpy as np
 import urllib.request
 import matplotlib.pyplot as plt
+from scipy.spatial import cKDTree
 
+from stravart import profiling
 from stravart.contours.contours import Contour
 @dataclass
 class ContourExtractor():
+    """
+    :param cache: Optional ContourCache. Stages are then keyed on the image bytes and their parameters,
+        so calling get_best_contour again with other parameters only recomputes the stages they affect.
+    :param working_size: If set, edges and contours are extracted on the image downscaled (by a pyramid)
+        so that its largest side is at most working_size pixels, contours being scaled back to the image size.
+    :param refine: With working_size, get_best_contour moves the points of the selected contour to the
+        nearest full resolution edges, only detected within its bounding box.
+    """
     image_path: str
     image: np.ndarray = None
     merged_contour: bool = False
     contours: list = None
+    cache: "ContourCache" = None
+    working_size: int = None
+    refine: bool = False
 
-    def _read_image(self):
+    def __post_init__(self):
+        self._data = None
+        self._gray = None
+        self._key = None
+        self._scale = (1., 1.)
+
+    def _read_bytes(self):
         if self.image_path.startswith("http"):
             response = urllib.request.urlopen(self.image_path)
-            image_array = np.asarray(bytearray(response.read()), dtype=np.uint8)
-            self.image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        else:
-            self.image = cv2.imread(self.image_path)
+            return response.read()
+        with open(self.image_path, "rb") as f:
+            return f.read()
+
+    def _read_image(self):
+        try:
+            data = self._data if self._data is not None else self._read_bytes()
+        except OSError:
+            data = None
+        self.image = self.decode_image(data) if data is not None else None
+        self._data = None
 
         if self.image is None:
             raise ValueError("Could not open or find the image")
-    
-    def get_all_contours(self, show=False, merge=True):
-        """Extract contours from an image and merge them if they share points"""
-        self._read_image()
 
-        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+    def image_key(self):
+        """Content hash of the image: of its bytes when read from image_path, of its pixels when given."""
+        from stravart.contours.cache import ContourCache
+
+        if self.image is not None:
+            return ContourCache.hash_bytes(repr(self.image.shape).encode() + np.ascontiguousarray(self.image).tobytes())
+        if self._data is None:
+            self._data = self._read_bytes()
+        return ContourCache.hash_bytes(self._data)
+
+    def _stage(self, stage, compute, **params):
+        """Result of a stage, from the cache if any, chained on the key of the previous stage."""
+        if self.cache is None:
+            return compute()
+        self._key = self.cache.key(self._key, stage, **params)
+        return self.cache.memoize(self._key, compute)
+
+    def _grayscale(self):
+        if self.image is None:
+            self._read_image()
+        return cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+
+    @staticmethod
+    def decode_image(data):
+        """Decode the bytes of an encoded image (png, jpeg...) to a BGR array, None if they cannot be decoded."""
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    @staticmethod
+    def detect_edges(image):
+        """Canny edges of a BGR or grayscale image."""
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         #inch'allah those params works generically
         blurred = cv2.GaussianBlur(gray, (9, 9), 0)
-        edged = cv2.Canny(blurred, 10, 100)
+        return cv2.Canny(blurred, 10, 100)
 
+    @staticmethod
+    def find_contours(edged):
         # Find contours using full hierarchy
         contours, _ = cv2.findContours(edged, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        return contours
+
+    @staticmethod
+    def downscale(image, working_size):
+        """
+        Downscale an image so that its largest side is at most working_size, halving it with a
+        Gaussian pyramid first and resizing by area for the last step.
+        :return: Tuple of the downscaled image and the (x, y) scale factors back to the input size.
+        """
+        height, width = image.shape[:2]
+        small = image
+        while max(small.shape[:2]) >= 2 * working_size:
+            small = cv2.pyrDown(small)
+        if max(small.shape[:2]) > working_size:
+            factor = working_size / max(small.shape[:2])
+            size = (max(1, round(small.shape[1] * factor)), max(1, round(small.shape[0] * factor)))
+            small = cv2.resize(small, size, interpolation=cv2.INTER_AREA)
+        return small, (width / small.shape[1], height / small.shape[0])
+
+    @staticmethod
+    def rescale_contours(contours, scale):
+        """Scale contour points by the (x, y) factors of scale."""
+        if scale == (1., 1.):
+            return contours
+        factors = np.array(scale)
+        return [np.round(contour * factors).astype(np.int32) for contour in contours]
+
+    @staticmethod
+    def refine_contour(gray, contour, margin):
+        """
+        Move the points of a contour found on a downscaled image to the nearest full resolution edge pixel
+        within margin pixels. Edges are only detected in the bounding box of the contour grown by margin.
+        :return: The refined contour points, with the shape and dtype of contour.
+        """
+        height, width = gray.shape[:2]
+        points = contour.reshape(-1, 2)
+        x, y, w, h = cv2.boundingRect(points.reshape(-1, 1, 2).astype(np.int32))
+        x0, y0 = max(x - margin, 0), max(y - margin, 0)
+        x1, y1 = min(x + w + margin, width), min(y + h + margin, height)
+        edges = np.argwhere(ContourExtractor.detect_edges(gray[y0:y1, x0:x1]))
+        if not len(edges):
+            return contour
+        # argwhere gives (row, column), contours are (x, y)
+        edges = edges[:, ::-1] + np.array([x0, y0])
+        distances, nearest = cKDTree(edges).query(points, distance_upper_bound=margin)
+        found = np.isfinite(distances)
+        refined = points.copy()
+        refined[found] = edges[nearest[found]]
+        return refined.reshape(contour.shape)
+
+    def get_all_contours(self, show=False, merge=True, timings=None):
+        """
+        Extract contours from an image and merge them if they share points.
+        The image is only read if it was not given or read before.
+        :param timings: Optional dict receiving the duration in seconds of each stage.
+        """
+        timings = {} if timings is None else timings
+        if self.cache is not None:
+            with _timed(timings, "read"):
+                self._key = self.image_key()
+        elif self.image is None:
+            with _timed(timings, "read"):
+                self._read_image()
+
+        with _timed(timings, "edges"):
+            self._gray = self._stage("gray", self._grayscale)
+            working = self._gray
+            if self.working_size is not None:
+                working, self._scale = self._stage(
+                    "downscale", lambda: self.downscale(self._gray, self.working_size), working_size=self.working_size
+                )
+            edged = self._stage("edges", lambda: self.detect_edges(working))
+        with _timed(timings, "contours"):
+            contours = self._stage("contours", lambda: self.rescale_contours(self.find_contours(edged), self._scale))
 
         if merge:
             self.merged_contour = True
-            self.contours = self.merge_contours(contours)
+            with _timed(timings, "merge"):
+                self.contours = self._stage("merge", lambda: self.merge_contours(contours))
         else:
             self.merged_contour = False
             self.contours = contours
@@ -58,40 +189,64 @@ class ContourExtractor():
         if contour_ix not in range(len(self.contours)):
             raise ValueError("Contour_ix is higher than the number of contours.")
 
-        img_threshold = threshold * min(self.image.shape[:2])
+        # The grayscale image has the same size and may be cached when the image was not decoded
+        shape = self.image.shape if self.image is not None else self._gray.shape
+        img_threshold = threshold * min(shape[:2])
 
         contour = self.merge_contours_from_specific(self.contours, contour_ix, threshold=img_threshold)
 
         return contour
 
     def plot_contours(self):
-        cv2.drawContours(self.image, self.contours, -1, (0, 255, 0), 2)
-        image_rgb = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
+        if self.image is None:
+            self._read_image()
+        # Draw on a copy, the image is reused by later extractions
+        image = self.image.copy()
+        cv2.drawContours(image, self.contours, -1, (0, 255, 0), 2)
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         plt.imshow(image_rgb)
         plt.show()
 
     @staticmethod
     def contours_share_point(contour1, contour2):
-        return any(np.any(np.all(point == contour2, axis=2)) for point in contour1)
+        points1 = contour1.reshape(-1, 2)
+        points2 = contour2.reshape(-1, 2)
+        shared = set(map(tuple, points1.tolist()))
+        return any(point in shared for point in map(tuple, points2.tolist()))
 
     @staticmethod
     def min_distance(contour1, contour2):
         c1 = contour1.reshape(-1, 2)
         c2 = contour2.reshape(-1, 2)
-        return np.min([np.linalg.norm(x - y) for x in c1 for y in c2])
+        distances, _ = cKDTree(c1).query(c2)
+        return distances.min()
+
+    @staticmethod
+    def _stack_points(contours):
+        """All points of contours as one (N, 2) array, with the index of the contour of each point."""
+        points = [contour.reshape(-1, 2) for contour in contours]
+        labels = np.repeat(np.arange(len(points)), [len(p) for p in points])
+        return np.vstack(points), labels
 
     @staticmethod
     def merge_contours(contours):
         """Merge contours that share elements."""
         n = len(contours)
+        if n == 0:
+            return []
         parent = [i for i in range(n)]
         rank = [0] * n
 
-        # Merge contours with shared points
-        for i in range(n):
-            for j in range(i + 1, n):
-                if ContourExtractor.contours_share_point(contours[i], contours[j]):
-                    ContourExtractor.union(parent, rank, i, j)
+        # Merge contours with shared points: hash every point, contours hitting the same point are joined
+        points, labels = ContourExtractor._stack_points(contours)
+        _, point_ids = np.unique(points, axis=0, return_inverse=True)
+        point_ids = point_ids.ravel()
+        order = np.lexsort((labels, point_ids))
+        point_ids, labels = point_ids[order], labels[order]
+        shared = (point_ids[1:] == point_ids[:-1]) & (labels[1:] != labels[:-1])
+        pairs = np.unique(np.column_stack([labels[:-1][shared], labels[1:][shared]]), axis=0)
+        for i, j in pairs.tolist():
+            ContourExtractor.union(parent, rank, i, j)
 
         # Merge contours in the same set
         merged_contours = {}
@@ -105,30 +260,39 @@ class ContourExtractor():
     def get_contours_distance(contours):
         num_contours = len(contours)
         contour_distances = np.zeros((num_contours, num_contours))
-        for i in range(num_contours):
-            for j in range(i + 1, num_contours):  # Start from i+1 to avoid self-comparison
-                distance = ContourExtractor.min_distance(contours[i], contours[j])
-                contour_distances[i, j] = distance
-                contour_distances[j, i] = distance
+        if num_contours < 2:
+            return contour_distances
+        # One query of every point against each contour tree gives a whole row of minimum distances
+        points, labels = ContourExtractor._stack_points(contours)
+        starts = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=num_contours))[:-1]])
+        for i in range(num_contours - 1):
+            others = labels > i
+            distances, _ = cKDTree(contours[i].reshape(-1, 2)).query(points[others])
+            row = np.minimum.reduceat(distances, starts[i + 1:] - starts[i + 1])
+            contour_distances[i, i + 1:] = row
+            contour_distances[i + 1:, i] = row
         return contour_distances
 
     @staticmethod
     def merge_contours_from_specific(contours, contour_ix, threshold=0.05):
         n = len(contours)
+        if n == 1 and contour_ix == 0:
+            return Contour(contours[0])
         if n <= 1 or contour_ix >= n:
             return contours
 
         start_contour = contours[contour_ix]
         merged_contours = [start_contour]
 
-        # Function to merge contours based on distance to the start contour
-        def should_merge_with_start(contour):
-            return ContourExtractor.min_distance(start_contour, contour) < threshold
-
-        # Merge contours that are close to the start contour
-        for i, contour in enumerate(contours):
-            if i != contour_ix and should_merge_with_start(contour):
-                merged_contours.append(contour)
+        # Merge contours that are close to the start contour: a contour is merged as soon as one of
+        # its points is closer than threshold to the start contour
+        points, labels = ContourExtractor._stack_points(contours)
+        distances, _ = cKDTree(start_contour.reshape(-1, 2)).query(points, distance_upper_bound=threshold)
+        close = np.zeros(n, dtype=bool)
+        close[labels[distances < threshold]] = True
+        for i in np.flatnonzero(close):
+            if i != contour_ix:
+                merged_contours.append(contours[i])
 
         # Combine all merged contours into one
         final_contour = np.vstack(merged_contours)
@@ -137,14 +301,20 @@ class ContourExtractor():
 
     @staticmethod
     def find(parent, i):
-        if parent[i] == i:
-            return i
-        return ContourExtractor.find(parent, parent[i])
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression: every node on the way now points to the root
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
 
     @staticmethod
     def union(parent, rank, x, y):
         xroot = ContourExtractor.find(parent, x)
         yroot = ContourExtractor.find(parent, y)
+        if xroot == yroot:
+            return
 
         if rank[xroot] < rank[yroot]:
             parent[xroot] = yroot
@@ -162,15 +332,47 @@ class ContourExtractor():
             contour_ix  = max(range(len(self.contours)), key=lambda i: len(self.contours[i]))
             return self.merge_contour(contour_ix=contour_ix, threshold=threshold)
     
-    def get_best_contour(self, merge_threshold=0.05, eps=0.0001, filter_threshold=15):
-        '''Entry point with some heuristic-based params'''
-        self.get_all_contours(show=False, merge=True)
-        largest_contour = self.merge_largest_contour(threshold=merge_threshold)
-        largest_contour.approximate(eps=eps)
-        filtered_contour = largest_contour.filter_close_points(threshold=filter_threshold)
+    def get_best_contour(self, merge_threshold=0.05, eps=0.0001, filter_threshold=15, timings=None):
+        '''
+        Entry point with some heuristic-based params
+        :param timings: Optional dict receiving the duration in seconds of each stage.
+        '''
+        timings = {} if timings is None else timings
+        self.get_all_contours(show=False, merge=True, timings=timings)
+        with _timed(timings, "merge_largest"):
+            largest_contour = Contour(raw_contour=self._stage(
+                "merge_largest", lambda: self.merge_largest_contour(threshold=merge_threshold).raw_contour,
+                threshold=merge_threshold,
+            ))
+        if self.refine and self._scale != (1., 1.):
+            # A few working pixels around the contour cover the localization error of the downscaled edges
+            margin = int(np.ceil(2 * max(self._scale)))
+            with _timed(timings, "refine"):
+                largest_contour = Contour(raw_contour=self._stage(
+                    "refine", lambda: self.refine_contour(self._gray, largest_contour.raw_contour, margin),
+                    margin=margin,
+                ))
+        with _timed(timings, "approximate"):
+            largest_contour.simplified_contour = self._stage(
+                "approximate", lambda: largest_contour.approximate(eps=eps), eps=eps
+            )
+        with _timed(timings, "filter"):
+            filtered_contour = Contour(raw_contour=self._stage(
+                "filter", lambda: largest_contour.filter_close_points(threshold=filter_threshold).raw_contour,
+                threshold=filter_threshold,
+            ))
         
         #Flip the contour
-        flipped_contour =  np.array([(x, -y) for x, y in filtered_contour.raw_contour])
+        flipped_contour = filtered_contour.raw_contour.copy()
+        flipped_contour[:, 1] *= -1
         return Contour(raw_contour=flipped_contour)
-        
-    
\ No newline at end of file
+
+
+@contextmanager
+def _timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        with profiling.span(f"contours.{stage}"):
+            yield
+    finally:
+        timings[stage] = timings.get(stage, 0.) + time.perf_counter() - start
@@ -4,6 +4,8 @@ import numpy as np
 import requests
 from geopy.distance import great_circle
 
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+
 
 @dataclass(frozen=True)
 class Coordinates:
@@ -70,7 +72,11 @@ class Coordinates:
             raise ValueError("Coordinates must have only two values.")
         return cls(latitude=coordinates[0], longitude=coordinates[1])
 
-    def get_nearest_bicycle_road_point(self, dist=1000):
+    def get_nearest_bicycle_road_point(self, dist=1000, index=None):
+        if index is not None:
+            # Nearest point of a road segment of a prebuilt RoadIndex, without any request
+            snapped, distance = index.snap([self.to_tuple()], max_distance=dist)
+            return None if distance[0] > dist else Coordinates.from_tuple(tuple(snapped[0].tolist()))
         '''
         try:
             import os
@@ -109,39 +115,45 @@ class Coordinates:
             return None
 '''
         try:
-            overpass_url = "http://overpass-api.de/api/interpreter"
-            lat, lon  = self.latitude, self.longitude
-            overpass_query = f"""
-            [out:json];
-                          (
-            way(around:{dist},{lat},{lon})["highway"="cycleway"];
-            way(around:{dist},{lat},{lon})["bicycle"="designated"];
-            way(around:{dist},{lat},{lon})["bicycle"="yes"];
-            way(around:{dist},{lat},{lon})["highway"="path"]["bicycle"!="no"];
-            way(around:{dist},{lat},{lon})["highway"="footway"]["bicycle"="yes"];
-            way(around:{dist},{lat},{lon})["highway"="service"]["bicycle"!="no"];
-            way(around:{dist},{lat},{lon})["highway"="residential"]["bicycle"!="no"];
-            );
-        
-            (._;>;);
-            out center;
-            """
-            response = requests.get(overpass_url, params={'data': overpass_query})
-            data = response.json()
-            
-            nearest_point = None
-            min_distance = float('inf')
-        
-            for element in data['elements']:
-                if 'center' in element:
-                    center = element['center']
-                    road_point = (center['lat'], center['lon'])
-                    distance = great_circle((lat, lon), road_point).meters
-                    if distance < min_distance:
-                        nearest_point = road_point
-                        min_distance = distance
-            
-            return Coordinates.from_tuple(nearest_point)
+            response = requests.get(OVERPASS_URL, params=self.overpass_request(dist))
+            return self.parse_nearest_bicycle_road_point(response.json())
         except Exception as e:
-            print(f"Error getting closest bicycle coordinate for {(lat, lon)}: {e}")
+            print(f"Error getting closest bicycle coordinate for {(self.latitude, self.longitude)}: {e}")
             return None
+
+    def overpass_request(self, dist=1000):
+        """Overpass query parameters of the bicycle friendly ways around this point."""
+        lat, lon = self.latitude, self.longitude
+        overpass_query = f"""
+        [out:json];
+                      (
+        way(around:{dist},{lat},{lon})["highway"="cycleway"];
+        way(around:{dist},{lat},{lon})["bicycle"="designated"];
+        way(around:{dist},{lat},{lon})["bicycle"="yes"];
+        way(around:{dist},{lat},{lon})["highway"="path"]["bicycle"!="no"];
+        way(around:{dist},{lat},{lon})["highway"="footway"]["bicycle"="yes"];
+        way(around:{dist},{lat},{lon})["highway"="service"]["bicycle"!="no"];
+        way(around:{dist},{lat},{lon})["highway"="residential"]["bicycle"!="no"];
+        );
+    
+        (._;>;);
+        out center;
+        """
+        return {'data': overpass_query}
+
+    def parse_nearest_bicycle_road_point(self, data):
+        """Pick the way center of an Overpass answer closest to this point."""
+        lat, lon = self.latitude, self.longitude
+        nearest_point = None
+        min_distance = float('inf')
+
+        for element in data['elements']:
+            if 'center' in element:
+                center = element['center']
+                road_point = (center['lat'], center['lon'])
+                distance = great_circle((lat, lon), road_point).meters
+                if distance < min_distance:
+                    nearest_point = road_point
+                    min_distance = distance
+
+        return Coordinates.from_tuple(nearest_point)
@@ -1,13 +1,71 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from typing import List
-from joblib import Parallel, delayed
+import numpy as np
 import requests
 import json
 import os
 import googlemaps
-from geopy.distance import great_circle
 
+from . import profiling
 from .coordinates import Coordinates
+from .client import RoutingError, get_default_client
+from .utils import close_points_mask
+
+GOOGLE_DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+MAPBOX_DIRECTIONS_URL = "https://api.mapbox.com/directions/v5/mapbox"
+OSRM_ROUTE_URL = "http://router.project-osrm.org/route/v1"
+
+# Maximum number of waypoints accepted in a single directions request
+MAX_WAYPOINTS = {
+    "osrm": 100,
+    "mapbox": 25,
+}
+
+
+def waypoints_request(waypoints, provider, mode):
+    """
+    Build the multi-waypoint HTTP request of a provider, asking for the geometry of each step.
+    :return: Tuple of (url, params).
+    """
+    coordinates = ";".join(f"{point.longitude},{point.latitude}" for point in waypoints)
+    if provider == "mapbox":
+        url = f"{MAPBOX_DIRECTIONS_URL}/{mode}/{coordinates}"
+        params = {
+            'geometries': 'geojson',
+            'steps': 'true',
+            'overview': 'false',
+            'access_token': os.getenv('MAPBOX_ACCESS_TOKEN'),
+        }
+        return url, params
+    elif provider == "osrm":
+        url = f"{OSRM_ROUTE_URL}/bicycle/{coordinates}"
+        return url, {'geometries': 'geojson', 'steps': 'true', 'overview': 'false'}
+    raise ValueError(f"Provider {provider} does not support multi-waypoint requests.")
+
+
+def check_status(provider, data):
+    """Raise a RoutingError if the json answer of a provider reports an error (e.g. no route) instead of routes."""
+    key, ok = ("status", "OK") if provider == "google" else ("code", "Ok")
+    status = data.get(key)
+    if status != ok:
+        message = data.get("error_message") or data.get("message") or ""
+        raise RoutingError(f"{provider} answered {key} {status} {message}".strip())
+
+
+def parse_legs(provider, data, decimals=4):
+    """Split the answer of a multi-waypoint request into one Route per leg."""
+    check_status(provider, data)
+    legs = []
+    for leg in data['routes'][0]['legs']:
+        points = []
+        for step in leg['steps']:
+            for lon, lat in step['geometry']['coordinates']:
+                point = (round(lat, decimals), round(lon, decimals)) if provider == "mapbox" else (lat, lon)
+                # Successive steps share their boundary point
+                if not points or points[-1] != point:
+                    points.append(point)
+        legs.append(Route.from_list(points))
+    return legs
 
 @dataclass(frozen=True)
 class Direction:
@@ -26,6 +84,125 @@ class Direction:
     def from_coordinates(cls, start: Coordinates, end: Coordinates):
         return cls(start=start, end=end)
 
+    def get_path(self, provider="google", mode="walking", cache=None, graph=None):
+        """
+        Get the path of this direction from a provider, consulting the segment cache first.
+        :param provider: Map service provider, one of "google", "mapbox", "osrm" or "local".
+        :param mode: Mode of transportation.
+        :param cache: Optional SegmentCache.
+        :param graph: StreetGraph used by the "local" provider.
+        :return: Route of the path, or None if the provider did not return one.
+        """
+        if provider == "local":
+            return self.get_shortest_path_local(graph)
+
+        if cache is not None:
+            path = cache.get(self, provider, mode)
+            if path is not None:
+                return path
+
+        if provider == "google":
+            path = self.get_shortest_path_google_maps(mode)
+        elif provider == "mapbox":
+            path = self.get_mapbox_routes(mode)
+        elif provider == "osrm":
+            path = self.get_shortest_path_osrm()
+        else:
+            raise ValueError(f"Unknown provider {provider}")
+
+        if cache is not None:
+            cache.set(self, provider, mode, path)
+        return path
+
+    def request(self, provider, mode, alternatives=True):
+        """
+        Build the HTTP request of this direction for a provider.
+        :return: Tuple of (url, params).
+        """
+        start, end = self.start, self.end
+        if provider == "google":
+            params = {
+                'origin': f"{start.latitude},{start.longitude}",
+                'destination': f"{end.latitude},{end.longitude}",
+                'mode': mode,
+                'alternatives': str(alternatives).lower(),
+                'key': os.getenv('GMAPS_KEY'),
+            }
+            return GOOGLE_DIRECTIONS_URL, params
+        elif provider == "mapbox":
+            url = f"{MAPBOX_DIRECTIONS_URL}/{mode}/{start.longitude},{start.latitude};{end.longitude},{end.latitude}"
+            params = {
+                'alternatives': str(alternatives).lower(),
+                'geometries': 'geojson',
+                'access_token': os.getenv('MAPBOX_ACCESS_TOKEN'),
+            }
+            return url, params
+        elif provider == "osrm":
+            url = f"{OSRM_ROUTE_URL}/bicycle/{start.longitude},{start.latitude};{end.longitude},{end.latitude}"
+            return url, {'overview': 'full', 'geometries': 'geojson'}
+        raise ValueError(f"Unknown provider {provider}")
+
+    def parse_response(self, provider, data, decimals=4):
+        """
+        Turn the json answer of a provider into a Route.
+        :raises RoutingError: If the answer reports an error status instead of routes.
+        """
+        if provider in ("google", "mapbox", "osrm"):
+            check_status(provider, data)
+        if provider == "google":
+            return self._best_google_route(data.get('routes', []), decimals)
+        elif provider == "mapbox":
+            return self._best_mapbox_route(data.get('routes', []), decimals)
+        elif provider == "osrm":
+            # Convert coordinates to (latitude, longitude) format
+            geometry = data['routes'][0]['geometry']['coordinates']
+            return Route.from_list([(lat, lon) for lon, lat in geometry])
+        raise ValueError(f"Unknown provider {provider}")
+
+    @staticmethod
+    def _least_area_path(candidates):
+        """Among candidate paths, pick the one enclosing the smallest normalized area with its chord."""
+        from .polygone import Polygon
+
+        min_area = float('inf')
+        best_path = None
+        for path_points in candidates:
+            poly_list = path_points + [path_points[0]]
+            polygon = Polygon.from_list(poly_list, system="GPS")
+            normed_polygon = polygon.scale_coordinates()
+            area = normed_polygon.area
+            if area < min_area:
+                min_area = area
+                best_path = path_points
+        return best_path
+
+    def _best_google_route(self, routes, decimals=4):
+        if not routes:
+            return None
+        candidates = []
+        for route in routes:
+            # Extract coordinates from the route
+            steps = route['legs'][0]['steps']
+            path_points = [(round(self.start.latitude, decimals), round(self.start.longitude, decimals))]
+            for step in steps:
+                start_location = step['start_location']
+                path_points.append((round(start_location['lat'], decimals), round(start_location['lng'], decimals)))
+
+            # Add the end point and remove duplicates
+            path_points[-1] = (round(self.end.latitude, decimals), round(self.end.longitude, decimals))
+            candidates.append(list(dict.fromkeys(path_points)))
+        return Route.from_list(self._least_area_path(candidates))
+
+    def _best_mapbox_route(self, routes, decimals=4):
+        if not routes:
+            return None
+        # Swap coordinates from [lon, lat] to [lat, lon] + rounding
+        candidates = [
+            [(round(lat, decimals), round(lon, decimals)) for lon, lat in route['geometry']['coordinates']]
+            for route in routes
+        ]
+        return Route.from_list(self._least_area_path(candidates))
+
     def get_shortest_path_google_maps(self, mode="walking", alternatives=True, decimals=4):
         GMAPS_KEY = os.getenv('GMAPS_KEY')
         gmaps = googlemaps.Client(key=GMAPS_KEY)
@@ -33,183 +210,329 @@ class Direction:
         end_tuple = tuple(self.end)
         # Get directions
         directions_result = gmaps.directions(start_tuple, end_tuple, mode=mode, alternatives=alternatives)
-
-        if directions_result:
-            min_area = float('inf')
-            best_route = None
-            for route in directions_result:
-                # Extract coordinates from the route
-                steps = route['legs'][0]['steps']
-                path_points = [(round(self.start.latitude, decimals), round(self.start.longitude, decimals))]
-                for step in steps:
-                    start_location = step['start_location']
-                    #end_location = step['end_location']
-                    path_points.append((round(start_location['lat'], decimals), round(start_location['lng'], decimals)))
-                    #path_points.append((round(end_location['lat'], decimals), round(end_location['lng'], decimals)))
-            
-                # Add the end point and remove duplicates
-                path_points[-1] = (round(self.end.latitude, decimals), round(self.end.longitude, decimals))
-                #path_points.append((round(self.end.latitude, decimals), round(self.end.longitude, decimals)))
-                unique_path_points = list(dict.fromkeys(path_points))
-
-                # Calculate area
-                from .polygone import Polygon
-                poly_list = unique_path_points + [unique_path_points[0]]
-                polygon = Polygon.from_list(poly_list, system="GPS")
-                normed_polygon = polygon.scale_coordinates()
-                area = normed_polygon.area
-                if area < min_area:
-                    min_area = area
-                    best_route = unique_path_points
-            return Route.from_list(best_route)
-        
-        '''
-        steps = directions_result[0]['legs'][0]['steps']
-        path_points = [(round(self.start.latitude, decimals), round(self.start.longitude, decimals))]
-        for step in steps:
-            start_location = step['start_location']
-            end_location = step['end_location']
-            path_points.append((round(start_location['lat'], decimals), round(start_location['lng'], decimals)))
-            path_points.append((round(end_location['lat'], decimals), round(end_location['lng'], decimals)))
-    
-        # Add the end point and remove duplicates
-        path_points.append((round(self.end.latitude, decimals), round(self.end.longitude, decimals)))
-        unique_path_points = list(dict.fromkeys(path_points))
-        return Route.from_list(unique_path_points)'''
+        return self._best_google_route(directions_result, decimals)
 
     def get_mapbox_routes(self, mode="cycling", alternatives=True, decimals=4):
-        MAPBOX_ACCESS_TOKEN = os.getenv('MAPBOX_ACCESS_TOKEN')
-        access_token = MAPBOX_ACCESS_TOKEN
-        url = f"https://api.mapbox.com/directions/v5/mapbox/{mode}/{self.start.longitude},{self.start.latitude};{self.end.longitude},{self.end.latitude}"
-        params = {
-            'alternatives': str(alternatives).lower(),
-            'geometries': 'geojson',
-            'access_token': access_token
-        }
+        url, params = self.request("mapbox", mode, alternatives=alternatives)
         response = requests.get(url, params=params)
-        
+
         if response.status_code == 200:
-            routes = response.json()['routes']
-            min_area = float('inf')
-            best_route = None
-            for route in routes:
-                # Swap coordinates from [lon, lat] to [lat, lon] + rounding
-                route['geometry']['coordinates'] = [[round(lat,decimals), round(lon,decimals)] for lon, lat in route['geometry']['coordinates']]
-                coordinates = route['geometry']['coordinates']
-                
-                # Calculate area
-                from .polygone import Polygon
-                from sklearn.preprocessing import MinMaxScaler
-                poly_list = coordinates + [coordinates[0]]
-                polygon = Polygon.from_list(poly_list, system="GPS")
-                normed_polygon = polygon.scale_coordinates()
-                area = normed_polygon.area
-                if area < min_area:
-                    min_area = area
-                    best_route = coordinates
-            return Route.from_list(best_route['geometry']['coordinates'])
+            return self._best_mapbox_route(response.json()['routes'], decimals)
         else:
             return None
 
+    def get_shortest_path_local(self, graph):
+        """
+        Get the shortest path between start and end on a local StreetGraph, without any network call.
+        Start and end are snapped to their nearest graph nodes.
+        """
+        if graph is None:
+            raise ValueError("The local provider needs a StreetGraph.")
+        path = graph.shortest_path(self.start.to_tuple(), self.end.to_tuple())
+        return None if path is None else Route.from_list(path)
+
     def get_shortest_path_osrm(self):
         """
         Get the shortest path between start_point and end_point using OSRM.
-        :param start_point: Tuple of (latitude, longitude) for the start point.
-        :param end_point: Tuple of (latitude, longitude) for the end point.
-        :return: List of (latitude, longitude) tuples representing the path.
+        :return: Route of (latitude, longitude) points representing the path.
         """
-        # Construct the OSRM API request URL
-        osrm_route_url = f"http://router.project-osrm.org/route/v1/bicycle/{self.start.longitude},{self.start.latitude};{self.end.longitude},{self.end.latitude}?overview=full&geometries=geojson"
         # Make the request to the OSRM API
-        response = requests.get(osrm_route_url)
+        url, params = self.request("osrm", mode="bicycle")
+        response = requests.get(url, params=params)
         if response.status_code != 200:
             raise Exception("OSRM API request failed")
-    
+
         # Parse the response JSON
-        route_data = json.loads(response.text)
-    
-        # Extract the route geometry from the response
-        geometry = route_data['routes'][0]['geometry']['coordinates']
-    
-        # Convert coordinates to (latitude, longitude) format
-        path = [(lat, lon) for lon, lat in geometry]
-    
-        return Route.from_list(path)
-
-@dataclass
+        return self.parse_response("osrm", json.loads(response.text))
+
+def coordinates_to_array(coordinates) -> np.ndarray:
+    """Convert a Route, a (N, 2) array, or a sequence of Coordinates / (latitude, longitude) pairs to a (N, 2) float64 array."""
+    if coordinates is None:
+        return np.empty((0, 2))
+    if isinstance(coordinates, Route):
+        return coordinates.array
+    if isinstance(coordinates, np.ndarray):
+        array = coordinates.astype(np.float64, copy=False)
+    else:
+        coordinates = list(coordinates)
+        if len(coordinates) == 0:
+            return np.empty((0, 2))
+        if isinstance(coordinates[0], Coordinates):
+            array = np.array([(coord.latitude, coord.longitude) for coord in coordinates], dtype=np.float64)
+        else:
+            array = np.array(coordinates, dtype=np.float64)
+    if array.size == 0:
+        return np.empty((0, 2))
+    if array.ndim != 2 or array.shape[1] != 2:
+        raise ValueError("Coordinates must have only two values.")
+    return array
+
+
+def route_directions(directions, provider="google", mode="walking", cache=None, graph=None, client=None):
+    """
+    Route many directions at once, consulting the segment cache first.
+    :param directions: Iterable of Direction, duplicates are only routed once.
+    :param provider: Map service provider, "local" routes on graph without any network call.
+    :param mode: Mode of transportation.
+    :param cache: Optional SegmentCache.
+    :param graph: StreetGraph used by the "local" provider.
+    :param client: RoutingClient used for HTTP providers, defaults to the shared client.
+    :return: Dict from Direction to its routed path.
+    """
+    directions = list(directions)
+    # Only the segments missing from the cache are sent to the provider
+    paths = {}
+    if cache is not None:
+        with profiling.span("route.cache_lookup"):
+            for direction in directions:
+                path_segment = cache.get(direction, provider, mode)
+                if path_segment is not None:
+                    paths[direction] = path_segment
+        profiling.count("cache_hits", len(paths))
+    missing = list(dict.fromkeys(direction for direction in directions if direction not in paths))
+    if cache is not None:
+        profiling.count("cache_misses", len(missing))
+    profiling.count("segments_routed", len(missing))
+
+    if provider == "local":
+        if graph is None:
+            raise ValueError("The local provider needs a StreetGraph.")
+        # All segments are solved in process: the graph is already in memory
+        with profiling.span("route.local", segments=len(missing)):
+            local_paths = graph.shortest_paths(
+                [direction.start.to_tuple() for direction in missing],
+                [direction.end.to_tuple() for direction in missing],
+            )
+        results = [(direction, None if path is None else Route.from_list(path)) for direction, path in zip(missing, local_paths)]
+    else:
+        client = client if client is not None else get_default_client()
+        with profiling.span("route.http", provider=provider, segments=len(missing)):
+            results = list(zip(missing, client.route_many_sync(missing, provider=provider, mode=mode, return_exceptions=True)))
+    _store_paths(paths, results, provider, mode, cache)
+    return paths
+
+
+def _store_paths(paths, results, provider, mode, cache=None):
+    """
+    Add routed (direction, path) pairs to paths and to the cache.
+    :raises RoutingError: Once the successful paths are stored, if some paths are exceptions.
+    """
+    errors = []
+    for direction, path_segment in results:
+        if isinstance(path_segment, BaseException):
+            errors.append(path_segment)
+            continue
+        paths[direction] = path_segment
+        if cache is not None:
+            cache.set(direction, provider, mode, path_segment)
+    if errors:
+        raise RoutingError(f"{len(errors)} of {len(results)} segments failed, first: {errors[0]}") from errors[0]
+
+
 class Route:
-    coordinates: List[Coordinates] = field(default_factory=list)
+    """
+    Sequence of coordinates backed by a contiguous (N, 2) float64 array of (latitude, longitude).
+    Coordinates objects are only materialized when iterating or indexing.
+    """
+
+    def __init__(self, coordinates=None):
+        self._array = coordinates_to_array(coordinates)
+        self._pending = []
+        self._coordinates = None
+
+    @property
+    def array(self) -> np.ndarray:
+        """The (N, 2) array of points. It is shared, do not modify it in place."""
+        if self._pending:
+            self._array = np.vstack([self._array, np.array(self._pending, dtype=np.float64)])
+            self._pending = []
+        return self._array
+
+    @property
+    def coordinates(self) -> List[Coordinates]:
+        if self._coordinates is None:
+            self._coordinates = [Coordinates(lat, lon) for lat, lon in self.array.tolist()]
+        return self._coordinates
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        self._array = coordinates_to_array(coordinates)
+        self._pending = []
+        self._coordinates = None
 
     def __iter__(self):
         return iter(self.coordinates)
-    
+
     def __len__(self):
-        return len(self.coordinates)
+        return len(self._array) + len(self._pending)
 
     def __getitem__(self, key):
-        return self.coordinates[key]
-        
+        if isinstance(key, slice):
+            return self.coordinates[key]
+        lat, lon = self.array[key]
+        return Coordinates(float(lat), float(lon))
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return np.array_equal(self.array, other.array)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(coordinates={self.coordinates})"
+
+    def __getstate__(self):
+        # Pending points are flushed and materialized Coordinates are not pickled
+        self.array
+        state = self.__dict__.copy()
+        state["_coordinates"] = None
+        return state
+
     def add_coordinate(self, coordinates: Coordinates):
-        self.coordinates.append(coordinates)
-    
+        self._pending.append((coordinates[0], coordinates[1]))
+        self._coordinates = None
+
     @classmethod
     def from_list(cls, coordinates_list: List[List[float]]) -> 'Route':
-        coordinates = [Coordinates.from_list(coord) for coord in coordinates_list]
-        return cls(coordinates)
-        
+        return cls(coordinates_to_array(coordinates_list))
+
+    def to_numpy(self) -> np.ndarray:
+        return self.array.copy()
+
     def to_folium_tuples(self):
-        return [coord.to_tuple() for coord in self.coordinates]
-        
-    def fill_paths_between_points(self, mode="walking", provider="google", apply_filter=True, min_distance=15):
+        return list(map(tuple, self.array.tolist()))
+
+    def fill_paths_between_points(self, mode="walking", provider="google", apply_filter=True, min_distance=15, cache=None, graph=None, client=None):
         """
         Fill the shortest paths between all successive points in a list.
         :param mode: Mode of transportation.
-        :param provider: Map service provider.
+        :param provider: Map service provider, "local" routes on graph without any network call.
         :param apply_filter: Boolean to apply filtering of close points.
         :param min_distance: Minimum distance (in meters) for filtering.
+        :param cache: Optional SegmentCache consulted before querying the provider.
+        :param graph: StreetGraph used by the "local" provider.
+        :param client: RoutingClient used for HTTP providers, defaults to the shared client.
         """
-        full_path = Route()
-        temp_mapping = {}  # Temporary mapping to store unfiltered paths
-
-        def process_segment(start, end):
-            direction = Direction(start, end)
-            if provider == "google":
-                path_segment = direction.get_shortest_path_google_maps(mode)
-            elif provider == "mapbox":
-                path_segment = direction.get_mapbox_routes(mode)
-            return Direction.from_coordinates(start, end), path_segment
-
-        results = Parallel(n_jobs=-1)(delayed(process_segment)(self.coordinates[i], self.coordinates[i + 1]) for i in range(len(self.coordinates) - 1))
-
-        for direction_key, path_segment in results:
-            temp_mapping[direction_key] = Route()
-            for point in path_segment:
-                full_path.add_coordinate(point)
-                temp_mapping[direction_key].add_coordinate(point)
-
-        if apply_filter:
-            filtered_full_path = Route()
-            for i in range(len(full_path.coordinates)):
-                if i == 0 or great_circle(full_path.coordinates[i - 1], full_path.coordinates[i]).meters >= min_distance:
-                    filtered_full_path.add_coordinate(full_path.coordinates[i])
-
-            # Update path_mapping based on filtered_full_path
-            path_mapping = {}
-            for direction, route in temp_mapping.items():
-                filtered_route = Route()
-                for point in route.coordinates:
-                    if point in filtered_full_path.coordinates:
-                        filtered_route.add_coordinate(point)
-                path_mapping[direction] = filtered_route
-
-            full_path = filtered_full_path
-        else:
-            path_mapping = temp_mapping
+        directions = [Direction(self.coordinates[i], self.coordinates[i + 1]) for i in range(len(self.coordinates) - 1)]
+
+        paths = route_directions(directions, provider=provider, mode=mode, cache=cache, graph=graph, client=client)
+        return self._assemble_paths(directions, paths, apply_filter=apply_filter, min_distance=min_distance)
+
+    def fill_paths_batched(self, mode="walking", provider="osrm", apply_filter=True, min_distance=15, cache=None, client=None, max_waypoints=None):
+        """
+        Fill the shortest paths between all successive points using multi-waypoint requests.
+        The polygon is cut into chunks of at most max_waypoints points, each routed in a single request,
+        and the returned legs are split back into one path per Direction. Chunks that fail are routed segment by segment.
+        :param mode: Mode of transportation.
+        :param provider: Map service provider, "osrm" or "mapbox".
+        :param apply_filter: Boolean to apply filtering of close points.
+        :param min_distance: Minimum distance (in meters) for filtering.
+        :param cache: Optional SegmentCache consulted before querying the provider.
+        :param client: RoutingClient, defaults to the shared client.
+        :param max_waypoints: Maximum number of waypoints per request, defaults to the provider limit.
+        """
+        if provider not in MAX_WAYPOINTS:
+            raise ValueError(f"Provider {provider} does not support multi-waypoint requests.")
+        max_waypoints = min(max_waypoints or MAX_WAYPOINTS[provider], MAX_WAYPOINTS[provider])
+        if max_waypoints < 2:
+            raise ValueError("At least two waypoints are needed per request.")
+        client = client if client is not None else get_default_client()
+
+        directions = [Direction(self.coordinates[i], self.coordinates[i + 1]) for i in range(len(self.coordinates) - 1)]
+        paths = {}
+        if cache is not None:
+            for direction in directions:
+                path_segment = cache.get(direction, provider, mode)
+                if path_segment is not None:
+                    paths[direction] = path_segment
+
+        # Cut the runs of consecutive uncached directions into chunks of max_waypoints - 1 legs
+        runs, run = [], []
+        for direction in directions:
+            if direction in paths:
+                if run:
+                    runs.append(run)
+                run = []
+            else:
+                run.append(direction)
+        if run:
+            runs.append(run)
+        chunks = [run[i:i + max_waypoints - 1] for run in runs for i in range(0, len(run), max_waypoints - 1)]
 
-        return full_path, path_mapping
+        waypoints = [[direction.start for direction in chunk] + [chunk[-1].end] for chunk in chunks]
+        results = client.route_waypoints_many_sync(waypoints, provider=provider, mode=mode)
 
-    def get_nearest_bicycle_road_points(self, dist=1000):
-        nearest_points= Parallel(n_jobs=-1)(delayed(coord.get_nearest_bicycle_road_point)(dist=dist) for coord in self.coordinates)
+        fallback = []
+        for chunk, legs in zip(chunks, results):
+            if isinstance(legs, Exception) or len(legs) != len(chunk):
+                fallback.extend(chunk)
+                continue
+            for direction, path_segment in zip(chunk, legs):
+                paths[direction] = path_segment
+                if cache is not None:
+                    cache.set(direction, provider, mode, path_segment)
+
+        if fallback:
+            fallback = list(dict.fromkeys(fallback))
+            results = client.route_many_sync(fallback, provider=provider, mode=mode, return_exceptions=True)
+            _store_paths(paths, list(zip(fallback, results)), provider, mode, cache)
+
+        return self._assemble_paths(directions, paths, apply_filter=apply_filter, min_distance=min_distance)
+
+    @staticmethod
+    @profiling.profiled("route.assemble")
+    def _assemble_paths(directions, paths, apply_filter=True, min_distance=15):
+        """
+        Concatenate the paths of successive directions into the full route.
+        :param directions: Directions in route order.
+        :param paths: Dict from Direction to its routed path.
+        :return: Tuple of (full route, dict from Direction to its route).
+        :raises RoutingError: If a direction has no path, e.g. its ends are not connected in a local graph.
+        """
+        unrouted = [direction for direction in directions if paths.get(direction) is None]
+        if unrouted:
+            raise RoutingError(
+                f"No path found for {len(unrouted)} of {len(directions)} segments, "
+                f"first from {unrouted[0].start.to_tuple()} to {unrouted[0].end.to_tuple()}"
+            )
+        # One buffer for the whole route, each direction owning the slice offsets[k]:offsets[k + 1]
+        arrays = [paths[direction].array for direction in directions]
+        lengths = np.array([len(array) for array in arrays], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        points = np.concatenate(arrays) if arrays else np.empty((0, 2))
+
+        if not apply_filter:
+            path_mapping = {
+                direction: Route(points[offsets[k]:offsets[k + 1]]) for k, direction in enumerate(directions)
+            }
+            return Route(points), path_mapping
+
+        keep = close_points_mask(points, min_distance)
+        # A segment keeps every point whose coordinates are kept somewhere in the filtered route
+        _, inverse = np.unique(points, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        kept_values = np.zeros(inverse.max() + 1 if len(inverse) else 0, dtype=bool)
+        kept_values[inverse[keep]] = True
+        segment_keep = kept_values[inverse]
+
+        path_mapping = {}
+        for k, direction in enumerate(directions):
+            start, end = offsets[k], offsets[k + 1]
+            path_mapping[direction] = Route(points[start:end][segment_keep[start:end]])
+        return Route(points[keep]), path_mapping
+
+    def get_nearest_bicycle_road_points(self, dist=1000, client=None, index=None):
+        """
+        Snap every point of the route to its nearest bicycle road point, dropping the ones that cannot be snapped.
+        :param dist: Search distance in meters.
+        :param client: RoutingClient querying Overpass for each point, when no index is given.
+        :param index: RoadIndex of the area, snapping all points in a single query to the nearest
+            point of a road segment.
+        """
+        if index is not None:
+            snapped, _ = index.snap(self.array, max_distance=dist)
+            return Route(snapped[~np.isnan(snapped).any(axis=1)])
+        client = client if client is not None else get_default_client()
+        nearest_points = client.nearest_bicycle_road_points_sync(self.coordinates, dist=dist)
         #TODO: Could better handle or log this if there is None
         nearest_points = [point for point in nearest_points if point is not None]
         return Route(coordinates = nearest_points)
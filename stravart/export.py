@@ -0,0 +1,248 @@
+"""
+Streaming export of routes to GPX, GeoJSON and a binary columnar format.
+
+Writers append each route to the file as it comes, without building a document tree, so that
+hundreds of routes (e.g. the best trials of a study) are exported in a single pass:
+
+    stravart-export --storage studies/dog.db --study-name dog --top-k 50 --output dog.geojson --simplify 5
+"""
+import argparse
+import json
+import os
+import struct
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from stravart.simplification import simplify
+
+# Binary format: magic, then the float64 (latitude, longitude) points of every route one after the other,
+# then a json footer (offsets of each route in points, names and properties) and the uint64 size of the footer
+BINARY_MAGIC = b"STRAVART\x01"
+FORMATS = {".gpx": "gpx", ".geojson": "geojson", ".json": "geojson", ".routes": "binary"}
+
+
+def _as_points(route):
+    """(N, 2) float array of (latitude, longitude) of a Route, Polygon, array or list of pairs."""
+    points = route.array if hasattr(route, "array") else route
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+class RouteWriter:
+    """
+    Base of the streaming writers, used as context managers:
+
+        with GeoJSONWriter("routes.geojson", simplify_tolerance=5) as writer:
+            for route in routes:
+                writer.write(route, name="...", properties={...})
+
+    :param path: Output file.
+    :param simplify_tolerance: If set, routes are simplified (tolerance in meters) as they are written.
+    :param simplify_method: "douglas_peucker" or "visvalingam_whyatt", see stravart.simplification.
+    :param decimals: Number of decimals of the written coordinates (text formats).
+    """
+    mode = "w"
+
+    def __init__(self, path, simplify_tolerance=None, simplify_method="douglas_peucker", decimals=7):
+        self.path = path
+        self.simplify_tolerance = simplify_tolerance
+        self.simplify_method = simplify_method
+        self.decimals = decimals
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, self.mode)
+        self._begin()
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self._end()
+        finally:
+            self._file.close()
+
+    def write(self, route, name=None, properties=None):
+        points = _as_points(route)
+        if self.simplify_tolerance:
+            points = simplify(points, self.simplify_tolerance, self.simplify_method)
+        self._write(points, name if name is not None else f"route_{self.count}", properties or {})
+        self.count += 1
+
+    def _begin(self):
+        pass
+
+    def _write(self, points, name, properties):
+        raise NotImplementedError
+
+    def _end(self):
+        pass
+
+
+class GPXWriter(RouteWriter):
+    """One GPX track per route, properties are written as the track description."""
+
+    def _begin(self):
+        self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                         '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="stravart">\n')
+        self._point = f'<trkpt lat="%.{self.decimals}f" lon="%.{self.decimals}f"/>'
+
+    def _write(self, points, name, properties):
+        self._file.write(f"<trk><name>{escape(str(name))}</name>")
+        if properties:
+            self._file.write(f"<desc>{escape(json.dumps(properties))}</desc>")
+        self._file.write("<trkseg>\n")
+        np.savetxt(self._file, points, fmt=self._point)
+        self._file.write("</trkseg></trk>\n")
+
+    def _end(self):
+        self._file.write("</gpx>\n")
+
+
+class GeoJSONWriter(RouteWriter):
+    """FeatureCollection of one LineString feature per route."""
+
+    def _begin(self):
+        self._file.write('{"type": "FeatureCollection", "features": [\n')
+        self._point = f"[%.{self.decimals}f,%.{self.decimals}f]"
+
+    def _write(self, points, name, properties):
+        if self.count:
+            self._file.write(",\n")
+        # GeoJSON positions are [longitude, latitude]
+        coordinates = ",".join(self._point % tuple(point) for point in points[:, ::-1].tolist())
+        self._file.write(f'{{"type": "Feature", "properties": {json.dumps({"name": name, **properties})}, '
+                         f'"geometry": {{"type": "LineString", "coordinates": [{coordinates}]}}}}')
+
+    def _end(self):
+        self._file.write("\n]}\n")
+
+
+class BinaryWriter(RouteWriter):
+    """
+    Binary columnar file of routes (.routes): all points in one float64 buffer, read back at once
+    by read_binary without any parsing.
+    """
+    mode = "wb"
+
+    def _begin(self):
+        self._file.write(BINARY_MAGIC)
+        self._offsets = [0]
+        self._names = []
+        self._properties = []
+
+    def _write(self, points, name, properties):
+        self._file.write(np.ascontiguousarray(points, dtype="<f8").tobytes())
+        self._offsets.append(self._offsets[-1] + len(points))
+        self._names.append(str(name))
+        self._properties.append(properties)
+
+    def _end(self):
+        footer = json.dumps({"offsets": self._offsets, "names": self._names, "properties": self._properties}).encode()
+        self._file.write(footer)
+        self._file.write(struct.pack("<Q", len(footer)))
+
+
+def read_binary(path):
+    """
+    Read a file written by BinaryWriter.
+    :return: List of (name, (N, 2) points, properties).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError(f"{path} is not a stravart routes file")
+    (footer_size,) = struct.unpack("<Q", data[-8:])
+    footer = json.loads(data[-8 - footer_size:-8])
+    offsets = footer["offsets"]
+    points = np.frombuffer(data, dtype="<f8", count=2 * offsets[-1], offset=len(BINARY_MAGIC)).reshape(-1, 2)
+    return [
+        (name, points[offsets[k]:offsets[k + 1]], properties)
+        for k, (name, properties) in enumerate(zip(footer["names"], footer["properties"]))
+    ]
+
+
+WRITERS = {"gpx": GPXWriter, "geojson": GeoJSONWriter, "binary": BinaryWriter}
+
+
+def open_writer(path, format=None, **kwargs):
+    """Writer of a format ("gpx", "geojson" or "binary"), guessed from the extension of path if None."""
+    if format is None:
+        format = FORMATS.get(os.path.splitext(path)[1].lower())
+        if format is None:
+            raise ValueError(f"Cannot guess the export format of {path}, expected one of {sorted(FORMATS)}")
+    return WRITERS[format](path, **kwargs)
+
+
+def export_routes(routes, path, format=None, names=None, properties=None, simplify_tolerance=None,
+                  simplify_method="douglas_peucker", decimals=7):
+    """
+    Stream routes to a single file.
+    :param routes: Iterable of Route, Polygon or (N, 2) arrays of (latitude, longitude).
+    :param names: Optional iterable of the names of the routes.
+    :param properties: Optional iterable of dicts of json-friendly properties of the routes.
+    :return: Number of routes written.
+    """
+    names = iter(names) if names is not None else None
+    properties = iter(properties) if properties is not None else None
+    with open_writer(path, format, simplify_tolerance=simplify_tolerance, simplify_method=simplify_method,
+                     decimals=decimals) as writer:
+        for route in routes:
+            writer.write(route, name=next(names) if names else None, properties=next(properties) if properties else None)
+    return writer.count
+
+
+def _trial_route(trial, artifacts=None):
+    if "artifact" in trial.user_attrs:
+        if artifacts is None:
+            raise ValueError(f"Trial {trial.number} stores its route as an artifact, an ArtifactStore is needed.")
+        return artifacts.get(trial).final_contour
+    return trial.user_attrs.get("final_contour")
+
+
+def export_study(study, path, top_k=10, artifacts=None, format=None, simplify_tolerance=None,
+                 simplify_method="douglas_peucker", decimals=7):
+    """
+    Stream the routes of the top_k best completed trials of a study to a single file, best first.
+    The number, loss and parameters of each trial are written as route properties.
+    :param artifacts: ArtifactStore of the routes, for trials storing an artifact key (see objective).
+    :return: Number of routes written.
+    """
+    from optuna.trial import TrialState
+
+    trials = sorted(study.get_trials(deepcopy=False, states=(TrialState.COMPLETE,)), key=lambda trial: trial.value)
+    trials = [trial for trial in trials if "artifact" in trial.user_attrs or "final_contour" in trial.user_attrs][:top_k]
+    # Routes are decoded one at a time, as they are written
+    return export_routes(
+        (_trial_route(trial, artifacts) for trial in trials), path, format=format,
+        names=(f"trial_{trial.number}" for trial in trials),
+        properties=({"trial": trial.number, "loss": trial.value, **trial.params} for trial in trials),
+        simplify_tolerance=simplify_tolerance, simplify_method=simplify_method, decimals=decimals,
+    )
+
+
+def main(argv=None):
+    import optuna
+
+    from stravart.search.artifacts import ArtifactStore
+    from stravart.search.runner import create_storage
+
+    parser = argparse.ArgumentParser(description="Export the best routes of a study.")
+    parser.add_argument("--storage", required=True, help="Storage file (sqlite .db or journal) or database url.")
+    parser.add_argument("--study-name", default="stravart")
+    parser.add_argument("--artifacts", default="studies/artifacts", help="Directory of the artifacts of the trials.")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--output", required=True, help="Output file, .gpx, .geojson or .routes (binary).")
+    parser.add_argument("--simplify", type=float, help="Simplification tolerance in meters.")
+    parser.add_argument("--simplify-method", choices=["douglas_peucker", "visvalingam_whyatt"], default="douglas_peucker")
+    args = parser.parse_args(argv)
+
+    study = optuna.load_study(study_name=args.study_name, storage=create_storage(args.storage))
+    artifacts = ArtifactStore(args.artifacts) if os.path.isdir(args.artifacts) else None
+    count = export_study(study, args.output, top_k=args.top_k, artifacts=artifacts, simplify_tolerance=args.simplify,
+                         simplify_method=args.simplify_method)
+    print(f"{count} routes exported to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
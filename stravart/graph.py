@@ -0,0 +1,282 @@
+import heapq
+import json
+import math
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from .utils import to_unit_xyz
+
+EARTH_RADIUS = 6371000  # meters
+
+# Highways usable by bike, same spirit as the Overpass query of Coordinates.get_nearest_bicycle_road_point
+CYCLABLE_HIGHWAYS = (
+    "primary", "primary_link", "secondary", "secondary_link", "tertiary", "tertiary_link",
+    "unclassified", "residential", "living_street", "service", "cycleway", "path", "track", "pedestrian",
+)
+
+
+def _haversine_meters(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+@dataclass
+class StreetGraph:
+    """
+    Street graph stored as a CSR adjacency.
+
+    Neighbors of node i are indices[indptr[i]:indptr[i + 1]] with edge lengths (meters) in weights.
+
+    :param latitudes: Latitude of each node.
+    :param longitudes: Longitude of each node.
+    :param indptr: CSR row pointer, of size number of nodes + 1.
+    :param indices: CSR column indices.
+    :param weights: CSR edge lengths in meters.
+    """
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+
+    def __post_init__(self):
+        self._tree = cKDTree(to_unit_xyz(self.latitudes, self.longitudes))
+        self._latitudes_rad = np.radians(self.latitudes)
+        self._longitudes_rad = np.radians(self.longitudes)
+        self._matrix = csr_matrix((self.weights, self.indices, self.indptr), shape=(len(self), len(self)))
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_polylines(cls, polylines: List[List[List[float]]], decimals=7):
+        """
+        Build a graph from polylines of (latitude, longitude) points. Polylines sharing a point are connected there.
+        Every edge is added in both directions.
+        """
+        polylines = [np.round(np.asarray(line, dtype=np.float64), decimals) for line in polylines if len(line) > 1]
+        if not polylines:
+            raise ValueError("No polyline with at least two points to build the graph from.")
+        points = np.vstack(polylines)
+        nodes, inverse = np.unique(points, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+
+        # Consecutive points of the same polyline are connected
+        lengths = np.array([len(line) for line in polylines])
+        is_last = np.zeros(len(points), dtype=bool)
+        is_last[np.cumsum(lengths) - 1] = True
+        src = inverse[:-1][~is_last[:-1]]
+        dst = inverse[1:][~is_last[:-1]]
+        keep = src != dst
+        src, dst = src[keep], dst[keep]
+        src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+        weights = _haversine_meters(nodes[src, 0], nodes[src, 1], nodes[dst, 0], nodes[dst, 1])
+
+        # Duplicated edges keep their shortest length
+        order = np.lexsort((weights, dst, src))
+        src, dst, weights = src[order], dst[order], weights[order]
+        first = np.ones(len(src), dtype=bool)
+        first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        src, dst, weights = src[first], dst[first], weights[first]
+
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.add.at(indptr, src + 1, 1)
+        indptr = np.cumsum(indptr)
+        return cls(
+            latitudes=nodes[:, 0],
+            longitudes=nodes[:, 1],
+            indptr=indptr,
+            indices=dst.astype(np.int32),
+            weights=weights,
+        )
+
+    @classmethod
+    def from_geojson(cls, path):
+        """Build a graph from the LineString / MultiLineString features of a GeoJSON file."""
+        with open(path) as f:
+            data = json.load(f)
+        polylines = []
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") == "LineString":
+                lines = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiLineString":
+                lines = geometry["coordinates"]
+            else:
+                continue
+            # GeoJSON stores [longitude, latitude]
+            polylines.extend([[(lat, lon) for lon, lat, *_ in line] for line in lines])
+        return cls.from_polylines(polylines)
+
+    @classmethod
+    def from_overpass_json(cls, path, highways=CYCLABLE_HIGHWAYS):
+        """
+        Build a graph from an Overpass API json export, either with way geometries ("out geom")
+        or with separate nodes and ways ("(._;>;); out;").
+        """
+        with open(path) as f:
+            data = json.load(f)
+        elements = data.get("elements", [])
+        nodes = {e["id"]: (e["lat"], e["lon"]) for e in elements if e.get("type") == "node"}
+        polylines = []
+        for element in elements:
+            if element.get("type") != "way":
+                continue
+            if highways is not None and element.get("tags", {}).get("highway") not in highways:
+                continue
+            if "geometry" in element:
+                polylines.append([(p["lat"], p["lon"]) for p in element["geometry"]])
+            else:
+                polylines.append([nodes[n] for n in element.get("nodes", []) if n in nodes])
+        return cls.from_polylines(polylines)
+
+    @classmethod
+    def grid(cls, center, size=1000, spacing=100):
+        """
+        Build a synthetic square street grid around center, useful to run the optimizer offline.
+        :param center: Tuple of (latitude, longitude) of the grid center.
+        :param size: Side of the grid in meters.
+        :param spacing: Distance between parallel streets in meters.
+        """
+        lat0, lon0 = center
+        offsets = np.arange(-size / 2, size / 2 + spacing / 2, spacing)
+        dlat = np.degrees(offsets / EARTH_RADIUS)
+        dlon = np.degrees(offsets / (EARTH_RADIUS * math.cos(math.radians(lat0))))
+        lats = lat0 + dlat
+        lons = lon0 + dlon
+        polylines = [[(lat, lon) for lon in lons] for lat in lats]
+        polylines += [[(lat, lon) for lat in lats] for lon in lons]
+        return cls.from_polylines(polylines)
+
+    @classmethod
+    def load(cls, path):
+        """Load a graph saved with StreetGraph.save, or build it from a .geojson or Overpass .json file."""
+        path = str(path)
+        if path.endswith(".geojson"):
+            return cls.from_geojson(path)
+        if path.endswith(".json"):
+            return cls.from_overpass_json(path)
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in ("latitudes", "longitudes", "indptr", "indices", "weights")})
+
+    def save(self, path):
+        """Save the CSR arrays to a compressed .npz file."""
+        np.savez_compressed(
+            path,
+            latitudes=self.latitudes,
+            longitudes=self.longitudes,
+            indptr=self.indptr,
+            indices=self.indices,
+            weights=self.weights,
+        )
+
+    def nearest_nodes(self, points):
+        """Return the index of the nearest node of each (latitude, longitude) point."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        _, idx = self._tree.query(to_unit_xyz(points[:, 0], points[:, 1]))
+        return idx
+
+    def _path_to_points(self, nodes):
+        return [(self.latitudes[n], self.longitudes[n]) for n in nodes]
+
+    def astar(self, source: int, target: int):
+        """
+        A* between two nodes with a great circle heuristic.
+        :return: List of node indices from source to target, or None if target is unreachable.
+        """
+        source, target = int(source), int(target)
+        lat, lon = self._latitudes_rad, self._longitudes_rad
+        target_lat, target_lon = lat[target], lon[target]
+        cos_target = math.cos(target_lat)
+
+        def heuristic(node):
+            a = math.sin((target_lat - lat[node]) / 2) ** 2 + \
+                math.cos(lat[node]) * cos_target * math.sin((target_lon - lon[node]) / 2) ** 2
+            return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(1., a)))
+
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        best = {source: 0.}
+        previous = {source: -1}
+        queue = [(heuristic(source), 0., source)]
+        closed = set()
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if node == target:
+                path = [node]
+                while previous[path[-1]] != -1:
+                    path.append(previous[path[-1]])
+                return path[::-1]
+            if node in closed:
+                continue
+            closed.add(node)
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbor = int(indices[k])
+                new_cost = cost + weights[k]
+                if new_cost < best.get(neighbor, math.inf):
+                    best[neighbor] = new_cost
+                    previous[neighbor] = node
+                    heapq.heappush(queue, (new_cost + heuristic(neighbor), new_cost, neighbor))
+        return None
+
+    def shortest_path(self, start, end):
+        """
+        Shortest path between two (latitude, longitude) points, snapped to their nearest nodes.
+        :return: List of (latitude, longitude) tuples, or None if the points are not connected.
+        """
+        source, target = self.nearest_nodes([start, end])
+        nodes = self.astar(source, target)
+        return None if nodes is None else self._path_to_points(nodes)
+
+    def shortest_paths(self, starts, ends, limit_factor=4., chunk_size=16):
+        """
+        Shortest paths between each start and its end, computed with multi-source Dijkstra calls.
+        :param starts: Sequence of (latitude, longitude) start points.
+        :param ends: Sequence of (latitude, longitude) end points, same length as starts.
+        :param limit_factor: The search around each source stops beyond limit_factor times the largest
+            straight distance between a start and its end, which keeps the search local on big graphs.
+            Pairs not reached within that limit are searched again with astar, without limit.
+        :param chunk_size: Number of sources solved per Dijkstra call, bounding the size of the dense results.
+        :return: List of paths, each a list of (latitude, longitude) tuples or None if unreachable.
+        """
+        if len(starts) == 0:
+            return []
+        sources = self.nearest_nodes(starts)
+        targets = self.nearest_nodes(ends)
+        straight = _haversine_meters(
+            self.latitudes[sources], self.longitudes[sources], self.latitudes[targets], self.longitudes[targets]
+        )
+        limit = limit_factor * max(straight.max(), 1.)
+
+        paths = []
+        for start in range(0, len(sources), chunk_size):
+            chunk_sources = sources[start:start + chunk_size]
+            chunk_targets = targets[start:start + chunk_size]
+            distances, predecessors = dijkstra(
+                self._matrix, directed=True, indices=chunk_sources, return_predecessors=True, limit=limit
+            )
+            for row, (source, target) in enumerate(zip(chunk_sources, chunk_targets)):
+                if not np.isfinite(distances[row, target]):
+                    # Beyond the limit (e.g. a long detour) or unreachable: search again without limit
+                    nodes = self.astar(source, target)
+                    paths.append(None if nodes is None else self._path_to_points(nodes))
+                    continue
+                path = [target]
+                while path[-1] != source:
+                    path.append(predecessors[row, path[-1]])
+                paths.append(self._path_to_points(path[::-1]))
+        return paths
+
+    def shortest_paths_along(self, points, **kwargs):
+        """Shortest paths between all consecutive (latitude, longitude) points, see shortest_paths."""
+        points = list(points)
+        return self.shortest_paths(points[:-1], points[1:], **kwargs)
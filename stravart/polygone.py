@@ -1,79 +1,71 @@
-from dataclasses import dataclass, field
 from typing import List
-import math
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
 
-from .utils import haversine
+from .utils import haversine_array
 from .coordinates import Coordinates
-from .directions import Route
+from .directions import Route, coordinates_to_array
+
 
-@dataclass
 class Polygon(Route):
-    coordinates: List[Coordinates]
-    system: str = "unknown"
-    
-    def __post_init__(self):
-        if self.coordinates[0] != self.coordinates[-1]:
-            raise ValueError("Start {self.coordinates[0]} and end {self.coordinates[-1]} points should be the same")
-    
+    """Closed Route, whose first and last points are the same, in a given coordinate system ("GPS" or "cartesian")."""
+
+    def __init__(self, coordinates, system: str = "unknown"):
+        super().__init__(coordinates)
+        self.system = system
+        if len(self._array) == 0:
+            raise ValueError("A polygon needs at least one point.")
+        if not np.array_equal(self._array[0], self._array[-1]):
+            raise ValueError(f"Start {self[0]} and end {self[-1]} points should be the same")
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self.system == other.system and np.array_equal(self.array, other.array)
+
+    def __repr__(self):
+        return f"Polygon(coordinates={self.coordinates}, system={self.system!r})"
+
     @classmethod
     def from_list(cls, coordinates_list: List[List[float]], system: str) -> 'Polygon':
-        coordinates = [Coordinates.from_list(coord) for coord in coordinates_list]
-        return cls(coordinates, system)
-        
+        return cls(coordinates_to_array(coordinates_list), system)
+
     @classmethod
     def from_route(cls, route: Route, system: str) -> 'Polygon':
-        return cls(coordinates=route.coordinates, system=system)
-    
+        return cls(coordinates=route.array, system=system)
+
     def scale_coordinates(self):
-        coordinates_array = np.array([coord.to_tuple() for coord in self.coordinates])
-        scaler = MinMaxScaler()
-        scaled_coordinates = scaler.fit_transform(coordinates_array)
+        """Min-max scale each axis to [0, 1], as sklearn's MinMaxScaler does."""
+        coordinates_array = self.array
+        low = coordinates_array.min(axis=0)
+        extent = coordinates_array.max(axis=0) - low
+        extent[extent == 0] = 1.
+        return Polygon(coordinates=(coordinates_array - low) / extent, system="cartesian")
 
-        scaled_polygon = Polygon(coordinates=[Coordinates.from_tuple(tuple(coord)) for coord in scaled_coordinates], system="cartesian")
-        return scaled_polygon
-    
     @property
     def centroid(self):
         if self.system == "GPS":
             raise NotImplementedError
-        else:    
-            x_coords = [p.latitude for p in self.coordinates]
-            y_coords = [p.longitude for p in self.coordinates]
-            _centroid = Coordinates(sum(x_coords) / len(self.coordinates), sum(y_coords) / len(self.coordinates))
-            return _centroid
-    
+        else:
+            x, y = self.array.mean(axis=0)
+            return Coordinates(float(x), float(y))
+
     @property
     def area(self) -> float:
         if self.system == "GPS":
             raise NotImplementedError
         else:
-            n = len(self.coordinates)
-            if n < 4: 
+            if len(self) < 4:
                 return 0
-        
-            area = 0
-            for i in range(n - 1):
-                x1, y1 = self.coordinates[i].latitude, self.coordinates[i].longitude
-                x2, y2 = self.coordinates[i + 1].latitude, self.coordinates[i + 1].longitude
-                area += (x1 * y2) - (x2 * y1)
-            area = abs(area) /2
-            return area
-            
+            # Shoelace formula on coordinates centered for numerical stability
+            points = self.array - self.array[0]
+            x, y = points[:, 0], points[:, 1]
+            return float(abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2)
+
     @property
     def perimeter(self) -> float:
+        points = self.array
+        following = np.roll(points, -1, axis=0)
         if self.system == "GPS":
-            perimeter = 0
-            for i in range(len(self.coordinates)):
-                lat1, lon1 = self.coordinates[i].latitude, self.coordinates[i].longitude
-                lat2, lon2 = self.coordinates[(i + 1) % len(self.coordinates)].latitude, self.coordinates[(i + 1) % len(self.coordinates)].longitude
-                perimeter += haversine(lon1, lat1, lon2, lat2)
-            return perimeter
+            return float(haversine_array(points[:, 1], points[:, 0], following[:, 1], following[:, 0]).sum())
         else:
-            perimeter = 0
-            for i in range(len(self.coordinates)):
-                x1, y1 = self.coordinates[i].latitude, self.coordinates[i].longitude
-                x2, y2 = self.coordinates[(i + 1) % len(self.coordinates)].latitude, self.coordinates[(i + 1) % len(self.coordinates)].longitude
-                perimeter += math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
-            return perimeter
\ No newline at end of file
+            return float(np.hypot(*(following - points).T).sum())
@@ -0,0 +1,145 @@
+"""
+Opt-in instrumentation of the hot path.
+
+Code is annotated with spans and counters, which do nothing unless a Profiler is active in the
+current context:
+
+    with Profiler() as profiler:
+        final_contour, path_mapping = gps_poly.fill_paths_between_points(provider="osrm")
+    print(profiler.summary())
+    profiler.save_chrome_trace("trace.json")  # open in chrome://tracing or https://ui.perfetto.dev
+
+The active Profiler is held in a context variable, so that concurrent trials on threads each record
+their own spans, and asyncio tasks (e.g. routing requests) record into the profiler of their caller.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+_current = contextvars.ContextVar("stravart_profiler", default=None)
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter() - self.start, self.args)
+
+
+class Profiler:
+    """
+    Records the spans and counters of the code run while it is active (as a context manager).
+
+    :param max_events: Maximum number of spans kept for the Chrome trace, the stage totals of summary
+        keep counting beyond it.
+    """
+
+    def __init__(self, max_events=100000):
+        self.max_events = max_events
+        self.events = []
+        self.stages = {}
+        self.counters = {}
+
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_current.set(self))
+        return self
+
+    def __exit__(self, *exc):
+        _current.reset(self._tokens.pop())
+
+    def record(self, name, start, duration, args=None):
+        with self._lock:
+            count, total = self.stages.get(name, (0, 0.))
+            self.stages[name] = (count + 1, total + duration)
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, duration, threading.get_ident(), args))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Json-friendly dict of the count and total duration (seconds) of each stage, and of the counters."""
+        with self._lock:
+            stages = {name: {"count": count, "total": total} for name, (count, total) in self.stages.items()}
+            counters = dict(self.counters)
+        for name in ("cache_hits", "cache_misses"):
+            counters.setdefault(name, 0)
+        lookups = counters["cache_hits"] + counters["cache_misses"]
+        counters["cache_hit_rate"] = counters["cache_hits"] / lookups if lookups else 0.
+        return {"stages": stages, "counters": counters}
+
+    def chrome_trace(self):
+        """Spans as complete events of the Chrome trace event format, timestamps in microseconds."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        trace = [
+            {"name": name, "ph": "X", "ts": (start - self._origin) * 1e6, "dur": duration * 1e6, "pid": pid, "tid": tid,
+             **({"args": args} if args else {})}
+            for name, start, duration, tid, args in events
+        ]
+        end = max(((start - self._origin + duration) * 1e6 for _, start, duration, _, _ in events), default=0.)
+        trace.extend({"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}} for name, value in counters.items())
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def active():
+    """The Profiler of the current context, None when profiling is disabled."""
+    return _current.get()
+
+
+def span(name, **args):
+    """Context manager timing a block as the stage name, a shared no-op when profiling is disabled."""
+    profiler = _current.get()
+    if profiler is None:
+        return _NULL_SPAN
+    return _Span(profiler, name, args)
+
+
+def count(name, value=1):
+    """Add value to the counter name of the active Profiler, if any."""
+    profiler = _current.get()
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+def profiled(name):
+    """Decorator timing every call of a function as the stage name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _current.get()
+            if profiler is None:
+                return function(*args, **kwargs)
+            with _Span(profiler, name, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
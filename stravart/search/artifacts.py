@@ -0,0 +1,213 @@
+"""
+Compact storage of the routes of trials.
+
+Instead of the full Route and path_mapping objects, a trial only keeps in its user attrs the key of
+an artifact written to an ArtifactStore directory. An artifact holds the routed points quantized to
+integers (delta-encoded in a compressed .npz, or as encoded polylines in a .json), the offsets of each
+routed segment in that buffer and the exact endpoints of the directions, and is decoded back into
+Route objects only when read.
+"""
+from functools import cached_property
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from stravart.coordinates import Coordinates
+from stravart.directions import Direction, Route
+from stravart.polygone import Polygon
+
+FORMATS = ("npz", "polyline")
+
+
+def quantize(points, precision=6):
+    """(N, 2) float degrees to int64 multiples of 10 ** -precision degrees."""
+    return np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 10 ** precision).astype(np.int64)
+
+
+def dequantize(values, precision=6):
+    return np.asarray(values, dtype=np.float64).reshape(-1, 2) / 10 ** precision
+
+
+def _deltas(values):
+    """Row deltas of quantized values, as int32 when they fit (precision up to 7 on city routes), int64 otherwise."""
+    deltas = np.diff(values, axis=0, prepend=0)
+    info = np.iinfo(np.int32)
+    if deltas.size and (deltas.min() < info.min or deltas.max() > info.max):
+        return deltas
+    return deltas.astype(np.int32)
+
+
+def encode_polyline(points, precision=5):
+    """Encode (N, 2) (latitude, longitude) points with the Google encoded polyline algorithm."""
+    values = np.diff(quantize(points, precision), axis=0, prepend=0).ravel()
+    # Zigzag the signed deltas, then split them in 5-bit chunks, least significant first
+    values = np.where(values < 0, ~(values << 1), values << 1)
+    n_chunks = np.maximum(1, (np.floor(np.log2(np.maximum(values, 1))).astype(np.int64) // 5) + 1)
+    value_index = np.repeat(np.arange(len(values)), n_chunks)
+    chunk_index = np.arange(len(value_index)) - np.repeat(np.cumsum(n_chunks) - n_chunks, n_chunks)
+    chunks = (values[value_index] >> (5 * chunk_index)) & 0x1f
+    # Every chunk but the last of a value carries the continuation bit
+    chunks = chunks | np.where(chunk_index < n_chunks[value_index] - 1, 0x20, 0)
+    return (chunks + 63).astype(np.uint8).tobytes().decode("ascii")
+
+
+def decode_polyline(encoded, precision=5):
+    """Decode a Google encoded polyline into an (N, 2) array of (latitude, longitude) points."""
+    chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if not len(chunks):
+        return np.empty((0, 2))
+    last = (chunks & 0x20) == 0
+    value_index = np.concatenate([[0], np.cumsum(last)[:-1]])
+    starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    chunk_index = np.arange(len(chunks)) - starts[value_index]
+    values = np.add.reduceat((chunks & 0x1f) << (5 * chunk_index), starts)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+    return dequantize(np.cumsum(values.reshape(-1, 2), axis=0), precision)
+
+
+def _directions_arrays(path_mapping):
+    directions = list(path_mapping)
+    starts = np.array([direction.start.to_tuple() for direction in directions], dtype=np.float64).reshape(-1, 2)
+    ends = np.array([direction.end.to_tuple() for direction in directions], dtype=np.float64).reshape(-1, 2)
+    segments = [path_mapping[direction].array for direction in directions]
+    lengths = np.array([len(segment) for segment in segments], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    points = np.concatenate(segments) if segments else np.empty((0, 2))
+    return starts, ends, offsets, points
+
+
+class TrialArtifact:
+    """
+    Routes of one trial read from an ArtifactStore, decoded on first access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @cached_property
+    def _data(self):
+        if self.path.endswith(".npz"):
+            with np.load(self.path) as data:
+                precision = int(data["precision"])
+                return {
+                    "contour": dequantize(np.cumsum(data["contour"], axis=0, dtype=np.int64), precision),
+                    "points": dequantize(np.cumsum(data["points"], axis=0, dtype=np.int64), precision),
+                    "offsets": data["offsets"],
+                    "starts": data["starts"],
+                    "ends": data["ends"],
+                }
+        with open(self.path) as f:
+            data = json.load(f)
+        precision = data["precision"]
+        segments = [decode_polyline(segment, precision) for segment in data["segments"]]
+        return {
+            "contour": decode_polyline(data["contour"], precision),
+            "points": np.concatenate(segments) if segments else np.empty((0, 2)),
+            "offsets": np.concatenate([[0], np.cumsum([len(segment) for segment in segments])]).astype(np.int64),
+            "starts": np.array(data["starts"], dtype=np.float64).reshape(-1, 2),
+            "ends": np.array(data["ends"], dtype=np.float64).reshape(-1, 2),
+        }
+
+    @cached_property
+    def final_contour(self) -> Route:
+        return Route(self._data["contour"])
+
+    @cached_property
+    def path_mapping(self):
+        """Dict from Direction to the Route of that segment, as returned by fill_paths_between_points."""
+        data = self._data
+        points, offsets = data["points"], data["offsets"]
+        return {
+            Direction(Coordinates(*start), Coordinates(*end)): Route(points[offsets[k]:offsets[k + 1]])
+            for k, (start, end) in enumerate(zip(data["starts"].tolist(), data["ends"].tolist()))
+        }
+
+    def polygon(self) -> Polygon:
+        """The final contour as a GPS Polygon, closed if needed."""
+        points = self._data["contour"]
+        if len(points) and np.any(points[0] != points[-1]):
+            points = np.vstack([points, points[:1]])
+        return Polygon(points, system="GPS")
+
+
+class ArtifactStore:
+    """
+    Directory of trial routes, written once and addressed by the hash of their content.
+
+    :param path: Directory of the artifacts.
+    :param precision: Number of decimals of the stored coordinates (6 is about 0.1 meter). The endpoints of the
+        directions are kept exact, so that the decoded path_mapping has the same keys.
+    :param format: "npz" for delta-encoded int32 arrays (int64 beyond their range) in a compressed .npz, or "polyline" for a .json
+        of encoded polylines (precision of at most 5 decimals with the standard decoders).
+    """
+
+    def __init__(self, path, precision=6, format="npz"):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown artifact format {format}, expected one of {FORMATS}")
+        self.path = path
+        self.precision = precision
+        self.format = format
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key)
+
+    def put(self, final_contour, path_mapping):
+        """
+        Write the routes of a trial.
+        :return: Key of the artifact, to be stored in the trial user attrs.
+        """
+        starts, ends, offsets, points = _directions_arrays(path_mapping)
+        contour = quantize(final_contour.array, self.precision)
+        quantized = quantize(points, self.precision)
+        digest = hashlib.sha1()
+        for array in (contour, quantized, offsets, starts, ends):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        key = f"{digest.hexdigest()[:20]}.{'npz' if self.format == 'npz' else 'json'}"
+        if os.path.exists(self._file(key)):
+            return key
+
+        # Write then rename, so that concurrent readers never load a partial file. Threads of a process writing
+        # the same key each have their own temporary file
+        temporary = f"{self._file(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if self.format == "npz":
+            with open(temporary, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    contour=_deltas(contour),
+                    points=_deltas(quantized),
+                    offsets=offsets, starts=starts, ends=ends, precision=self.precision,
+                )
+        else:
+            segments = [points[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+            with open(temporary, "w") as f:
+                json.dump({
+                    "precision": self.precision,
+                    "contour": encode_polyline(final_contour.array, self.precision),
+                    "segments": [encode_polyline(segment, self.precision) for segment in segments],
+                    "starts": starts.tolist(),
+                    "ends": ends.tolist(),
+                }, f)
+        os.replace(temporary, self._file(key))
+        return key
+
+    def get(self, key):
+        """
+        Lazily decoded routes of an artifact.
+        :param key: Key returned by put, or a trial whose "artifact" user attr holds it.
+        :return: TrialArtifact.
+        """
+        if hasattr(key, "user_attrs"):
+            key = key.user_attrs["artifact"]
+        if not os.path.exists(self._file(key)):
+            raise KeyError(key)
+        return TrialArtifact(self._file(key))
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def __len__(self):
+        return sum(not name.endswith(".tmp") for name in os.listdir(self.path))
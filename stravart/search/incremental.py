@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from stravart.client import RoutingError
+from stravart.coordinates import Coordinates
+from stravart.directions import Direction, Route, route_directions
+from stravart.utils import close_points_mask
+
+
+class IncrementalEvaluator:
+    """
+    Route successive candidate polygons, only routing the segments that changed since previous evaluations.
+
+    Vertices are snapped to a grid (or to the nearest node of a StreetGraph) so that small perturbations of
+    the polygon map to the same segments. Each routed segment is kept with its filtered path, its raw
+    enclosed area and its bounding box, so that the diff_area loss of a new polygon is a sum over cached
+    segments plus the contributions of the newly routed ones.
+
+    :param provider: Map service provider, see Route.fill_paths_between_points.
+    :param mode: Mode of transportation.
+    :param snap_decimals: Vertices are rounded to this number of decimals (4 is about 10 meters).
+    :param graph: StreetGraph. Vertices are snapped to its nodes, and it routes the "local" provider.
+    :param cache: Optional SegmentCache consulted for new segments.
+    :param client: RoutingClient used for HTTP providers.
+    :param apply_filter: Boolean to apply filtering of close points.
+    :param min_distance: Minimum distance (in meters) for filtering.
+    :param max_segments: Number of routed segments kept in memory.
+    """
+
+    def __init__(self, provider="google", mode="walking", snap_decimals=4, graph=None, cache=None, client=None,
+                 apply_filter=True, min_distance=15, max_segments=20000):
+        self.provider = provider
+        self.mode = mode
+        self.snap_decimals = snap_decimals
+        self.graph = graph
+        self.cache = cache
+        self.client = client
+        self.apply_filter = apply_filter
+        self.min_distance = min_distance
+        self.max_segments = max_segments
+
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+        self.routed_segments = 0
+        self.reused_segments = 0
+
+    def snap(self, gps_poly):
+        """Snapped vertices of a polygon, as a (N, 2) array without consecutive duplicates."""
+        points = gps_poly.array
+        if self.graph is not None:
+            nodes = self.graph.nearest_nodes(points)
+            snapped = np.column_stack([self.graph.latitudes[nodes], self.graph.longitudes[nodes]])
+        else:
+            snapped = np.round(points, self.snap_decimals)
+        keep = np.ones(len(snapped), dtype=bool)
+        keep[1:] = np.any(snapped[1:] != snapped[:-1], axis=1)
+        return snapped[keep]
+
+    def _segment(self, route):
+        """Filtered route of a segment with its raw enclosed area and bounding box."""
+        points = route.array
+        if self.apply_filter:
+            points = points[close_points_mask(points, self.min_distance)]
+        if not len(points):
+            return Route(points), 0., np.full(2, np.inf), np.full(2, -np.inf)
+        # Shoelace on the closed segment, centered for numerical stability
+        centered = points - points[0]
+        x, y = centered[:, 0], centered[:, 1]
+        area = abs(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+        return Route(points), area, points.min(axis=0), points.max(axis=0)
+
+    def evaluate(self, gps_poly):
+        """
+        Route a GPS polygon, reusing every segment already routed.
+        :return: Tuple of (loss, final_contour, path_mapping), with loss the diff_area of the route.
+        """
+        snapped = self.snap(gps_poly)
+        vertices = [Coordinates(lat, lon) for lat, lon in snapped.tolist()]
+        directions = [Direction(vertices[i], vertices[i + 1]) for i in range(len(vertices) - 1)]
+
+        # Trials running on threads share the evaluator, only the routing itself runs outside the lock
+        segments = {}
+        with self._lock:
+            for direction in dict.fromkeys(directions):
+                if direction in self._segments:
+                    self._segments.move_to_end(direction)
+                    segments[direction] = self._segments[direction]
+        missing = [direction for direction in dict.fromkeys(directions) if direction not in segments]
+        if missing:
+            paths = route_directions(
+                missing, provider=self.provider, mode=self.mode, cache=self.cache, graph=self.graph, client=self.client
+            )
+            unrouted = [direction for direction in missing if paths[direction] is None]
+            if unrouted:
+                raise RoutingError(f"No path found for {len(unrouted)} of {len(missing)} new segments")
+            for direction in missing:
+                segments[direction] = self._segment(paths[direction])
+        with self._lock:
+            for direction in missing:
+                self._segments[direction] = segments[direction]
+            while len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+            self.routed_segments += len(missing)
+            self.reused_segments += len(segments) - len(missing)
+
+        # path_mapping holds each direction once, as in Route.fill_paths_between_points
+        path_mapping = {direction: segments[direction][0] for direction in directions}
+        stats = list(segments.values())
+        low = np.min([segment[2] for segment in stats], axis=0) if stats else np.zeros(2)
+        high = np.max([segment[3] for segment in stats], axis=0) if stats else np.zeros(2)
+        extent = high - low
+        extent[~(extent > 0)] = 1.
+        loss = float(sum(segment[1] for segment in stats) / (extent[0] * extent[1]))
+
+        final_contour = self._concatenate([path_mapping[direction] for direction in directions])
+        return loss, final_contour, path_mapping
+
+    def _concatenate(self, routes):
+        arrays = [route.array for route in routes if len(route)]
+        if not arrays:
+            return Route()
+        points = np.concatenate(arrays)
+        if self.apply_filter:
+            points = points[close_points_mask(points, self.min_distance)]
+        return Route(points)
+
+    def stats(self):
+        total = self.routed_segments + self.reused_segments
+        return {
+            "routed_segments": self.routed_segments,
+            "reused_segments": self.reused_segments,
+            "reuse_rate": self.reused_segments / total if total else 0.,
+            "cached_segments": len(self._segments),
+        }
@@ -1,9 +1,9 @@
 import numpy as np
 import cv2
-from scipy.spatial.distance import directed_hausdorff
-from sklearn.preprocessing import MinMaxScaler
+from scipy.spatial import cKDTree
+
+from stravart import profiling
 
-from stravart.polygone import Polygon
 
 def get_contour_from_points(points):
     """Convert a list of points to a contour format used by OpenCV."""
@@ -13,73 +13,213 @@ def compare_contours(contour1, contour2):
     """Compare two contours using OpenCV's shape matching."""
     return cv2.matchShapes(contour1, contour2, cv2.CONTOURS_MATCH_I3, 0)
 
+def as_points(polygon):
+    """(N, 2) float array of a Route, Polygon, Contour, array or list of points."""
+    if hasattr(polygon, "array"):
+        return polygon.array
+    if hasattr(polygon, "raw_contour"):
+        polygon = polygon.raw_contour
+    return np.asarray([tuple(point) for point in polygon] if isinstance(polygon, list) else polygon,
+                      dtype=np.float64).reshape(-1, 2)
+
 def hausdorff_distance(poly1, poly2):
     """
-    Calculate the Hausdorff Distance between two polygons.
+    Calculate the Hausdorff Distance between two polygons, with one KD-tree query per direction.
     
-    :param poly1: List of (latitude, longitude) tuples for the first polygon.
-    :param poly2: List of (latitude, longitude) tuples for the second polygon.
+    :param poly1: (N, 2) points of the first polygon, e.g. (latitude, longitude).
+    :param poly2: (M, 2) points of the second polygon.
     :return: Hausdorff distance.
     """
-    u = np.array(poly1)
-    v = np.array(poly2)
-    return max(directed_hausdorff(u, v)[0], directed_hausdorff(v, u)[0])
+    u = as_points(poly1)
+    v = as_points(poly2)
+    return max(cKDTree(v).query(u)[0].max(), cKDTree(u).query(v)[0].max())
 
+def frechet_distance(poly1, poly2):
+    """
+    Discrete Fréchet distance between two polylines, following both in order.
+    The coupling table is filled one anti-diagonal at a time, each as a single vectorized step.
+    """
+    u = as_points(poly1)
+    v = as_points(poly2)
+    n, m = len(u), len(v)
+    distances = np.hypot(*(u[:, None, :] - v[None, :, :]).transpose(2, 0, 1))
+    coupling = np.full((n, m), np.inf)
+    coupling[0, 0] = distances[0, 0]
+    for diagonal in range(1, n + m - 1):
+        i = np.arange(max(0, diagonal - m + 1), min(n, diagonal + 1))
+        j = diagonal - i
+        previous = np.full(len(i), np.inf)
+        has_up, has_left = i > 0, j > 0
+        previous[has_up] = coupling[i[has_up] - 1, j[has_up]]
+        previous[has_left] = np.minimum(previous[has_left], coupling[i[has_left], j[has_left] - 1])
+        both = has_up & has_left
+        previous[both] = np.minimum(previous[both], coupling[i[both] - 1, j[both] - 1])
+        coupling[i, j] = np.maximum(previous, distances[i, j])
+    return coupling[-1, -1]
 
-def diff_area(actual_bicycle_contour, path_mapping):
+def rasterized_iou(poly1, poly2, resolution=256):
+    """
+    Intersection over union of the areas enclosed by two polygons, rasterized with cv2.fillPoly
+    on a resolution x resolution grid covering both.
+    """
+    u = as_points(poly1)
+    v = as_points(poly2)
+    points = np.vstack([u, v])
+    low = points.min(axis=0)
+    extent = (points.max(axis=0) - low).max()
+    scale = (resolution - 1) / extent if extent > 0 else 1.
+    masks = []
+    for polygon in (u, v):
+        mask = np.zeros((resolution, resolution), dtype=np.uint8)
+        pixels = np.round((polygon - low) * scale).astype(np.int32).reshape(-1, 1, 2)
+        cv2.fillPoly(mask, [pixels], 1)
+        masks.append(mask.astype(bool))
+    union = np.count_nonzero(masks[0] | masks[1])
+    return np.count_nonzero(masks[0] & masks[1]) / union if union else 1.
 
-    scaler = MinMaxScaler()
-    scaler.fit(actual_bicycle_contour.to_folium_tuples())
+def resample(polygon, n_points, closed=True):
+    """
+    Resample a polygon to n_points points evenly spaced along its perimeter, starting at its first point.
+    :param closed: Account for the edge from the last point back to the first one.
+    """
+    points = as_points(polygon)
+    if closed and len(points) > 1 and not np.array_equal(points[0], points[-1]):
+        points = np.vstack([points, points[:1]])
+    lengths = np.concatenate([[0.], np.cumsum(np.hypot(*np.diff(points, axis=0).T))])
+    if lengths[-1] == 0:
+        return np.repeat(points[:1], n_points, axis=0)
+    targets = np.linspace(0., lengths[-1], n_points, endpoint=not closed)
+    return np.column_stack([np.interp(targets, lengths, points[:, k]) for k in range(2)])
+
+
+def contour_bounds(contour):
+    """
+    Min-max normalization bounds of a contour, as fitted by sklearn's MinMaxScaler.
+    :return: Tuple of (low, extent) arrays, constant axes get an extent of 1.
+    """
+    points = contour.array if hasattr(contour, "array") else np.asarray(contour, dtype=np.float64)
+    low = points.min(axis=0)
+    extent = points.max(axis=0) - low
+    extent[extent == 0] = 1.
+    return low, extent
 
-    total_area = 0.
-    segments = path_mapping.keys()
-    for segment in segments:
-        little_poly = path_mapping[segment]
-        little_poly.add_coordinate(little_poly[0])
-        little_poly = Polygon.from_route(little_poly, system="cartesian")
-        little_poly = scaler.transform(little_poly.to_folium_tuples())
-        little_poly = Polygon.from_list(little_poly, system="cartesian")
-        total_area += little_poly.area
 
+@profiling.profiled("metrics.segment_areas")
+def segment_areas(path_mapping, bounds):
+    """
+    Area enclosed by each routed segment and its chord, in normalized coordinates.
+
+    All segments are processed in one pass over their concatenated points: each point is
+    paired with the next one of its segment (wrapping to the segment start), and the shoelace
+    terms are summed per segment.
+    :param path_mapping: Dict from Direction to the Route of that segment.
+    :param bounds: Tuple of (low, extent) used to normalize coordinates, see contour_bounds.
+    :return: Array of the area of each segment, in path_mapping order.
+    """
+    low, extent = bounds
+    arrays = [route.array for route in path_mapping.values()]
+    lengths = np.array([len(array) for array in arrays], dtype=np.int64)
+    areas = np.zeros(len(arrays))
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return areas
+
+    points = (np.concatenate([array for array in arrays if len(array)]) - low) / extent
+    lengths = lengths[nonempty]
+    starts = np.cumsum(lengths) - lengths
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[following] - x[following] * y
+    areas[nonempty] = np.abs(np.add.reduceat(cross, starts)) / 2
+    return areas
+
+
+@profiling.profiled("metrics.diff_area")
+def diff_area(actual_bicycle_contour, path_mapping, bounds=None, return_contributions=False):
+    """
+    Total area between each routed segment and the straight segment it replaces, with coordinates
+    normalized by the bounds of the whole route. path_mapping is left untouched.
+    :param actual_bicycle_contour: Full routed contour, used to fit the normalization.
+    :param path_mapping: Dict from Direction to the Route of that segment.
+    :param bounds: Precomputed (low, extent) normalization, see contour_bounds.
+    :param return_contributions: Also return the per-segment areas.
+    :return: Total area, or a tuple of (total area, per-segment areas).
+    """
+    if bounds is None:
+        bounds = contour_bounds(actual_bicycle_contour)
+    contributions = segment_areas(path_mapping, bounds)
+    total_area = float(contributions.sum())
+    if return_contributions:
+        return total_area, contributions
     return total_area
 
 def calculate_angle(p1, p2, p3):
     """
     Calculate the angle formed by three points p1, p2, and p3.
-    The angle is at p2.
+    The angle is at p2. Points may be arrays of points, giving an array of angles.
     """
-    v1 = np.array(p1) - np.array(p2)
-    v2 = np.array(p3) - np.array(p2)
-    ang1 = np.arctan2(*v1[::-1])
-    ang2 = np.arctan2(*v2[::-1])
+    v1 = np.asarray(p1, dtype=np.float64) - np.asarray(p2, dtype=np.float64)
+    v2 = np.asarray(p3, dtype=np.float64) - np.asarray(p2, dtype=np.float64)
+    ang1 = np.arctan2(v1[..., 1], v1[..., 0])
+    ang2 = np.arctan2(v2[..., 1], v2[..., 0])
     angle = ang2 - ang1
     return np.degrees(angle)
 
 def get_angles(polygon):
     """
     Calculate angles for each vertex in the polygon.
+    :return: List of the angles in degrees, as computed by calculate_angle (not wrapped, in (-360, 360)).
     """
-    angles = []
-    n = len(polygon)
-    for i in range(n):
-        p1 = polygon[i - 1]
-        p2 = polygon[i]
-        p3 = polygon[(i + 1) % n]
-        angle = calculate_angle(p1, p2, p3)
-        angles.append(angle)
-    return angles
+    points = as_points(polygon)
+    return calculate_angle(np.roll(points, 1, axis=0), points, np.roll(points, -1, axis=0)).tolist()
+
+def turning_angles(polygon):
+    """Signed turning angle (degrees, in [-180, 180)) at each vertex of a closed polygon."""
+    points = as_points(polygon)
+    if len(points) > 1 and np.array_equal(points[0], points[-1]):
+        points = points[:-1]
+    edges = np.roll(points, -1, axis=0) - points
+    headings = np.arctan2(edges[:, 1], edges[:, 0])
+    turns = headings - np.roll(headings, 1)
+    return np.degrees((turns + np.pi) % (2 * np.pi) - np.pi)
 
-def compare_polygons(poly1, poly2, threshold=45):
+def compare_polygons(poly1, poly2, threshold=45, n_points=None, wrap=False):
     """
     Compare two polygons and return indices of poly2 where angles differ significantly.
-    CAREFUL THIS SUPPOSE THEY HAVE THE SAME NUMBER OF ANGLES AND HAVE SAME ORIENTATIONS
+    Polygons are supposed to have the same orientation. When their number of points differ (or when n_points
+    is given), both are first resampled to a common number of points along their perimeter and the indices
+    refer to the resampled poly2.
+    :param wrap: Wrap the angle differences to [-180, 180) before thresholding, so that e.g. angles of 350 and
+        -10 degrees match. By default differences are compared as is, as get_angles returns them.
     """
-    angles1 = get_angles(poly1)
-    angles2 = get_angles(poly2)
-    mismatched_indices = []
+    u = as_points(poly1)
+    v = as_points(poly2)
+    if n_points is None and len(u) != len(v):
+        n_points = max(len(u), len(v))
+    if n_points is not None:
+        u, v = resample(u, n_points), resample(v, n_points)
+    difference = np.asarray(get_angles(u)) - np.asarray(get_angles(v))
+    if wrap:
+        difference = (difference + 180) % 360 - 180
+    return np.flatnonzero(np.abs(difference) > threshold).tolist()
 
-    for i, (angle1, angle2) in enumerate(zip(angles1, angles2)):
-        if abs(angle1 - angle2) > threshold:
-            mismatched_indices.append(i)
-
-    return mismatched_indices
+@profiling.profiled("metrics.shape_distances")
+def shape_distances(poly1, poly2, n_points=128, resolution=256):
+    """
+    Shape similarity of two polygons after min-max scaling both on the bounds of poly1 and resampling them
+    to n_points, so that they are comparable across scales and vertex counts.
+    :return: Dict of the hausdorff and frechet distances (in units of the poly1 extent), the rasterized
+        IoU and the mean absolute turning angle difference (degrees).
+    """
+    low, extent = contour_bounds(as_points(poly1))
+    u = resample((as_points(poly1) - low) / extent, n_points)
+    v = resample((as_points(poly2) - low) / extent, n_points)
+    turns = (turning_angles(u) - turning_angles(v) + 180) % 360 - 180
+    return {
+        "hausdorff": hausdorff_distance(u, v),
+        "frechet": frechet_distance(u, v),
+        "iou": rasterized_iou(u, v, resolution=resolution),
+        "turning": float(np.abs(turns).mean()),
+    }
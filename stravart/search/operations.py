@@ -1,113 +1,216 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from typing import List
 import math
 from math import radians, cos, sin, asin, sqrt
 import numpy as np
 
+from stravart import profiling
 from stravart.coordinates import Coordinates
 from stravart.polygone import Polygon
 
+EARTH_RADIUS = 6371000  # meters
+
+
+def _as_vector(value):
+    """Turn Coordinates, tuples or arrays of (x, y) into a float array of shape (..., 2)."""
+    if isinstance(value, Coordinates):
+        return value.to_numpy_array()
+    return np.asarray(value, dtype=np.float64)
+
+
+def _eye(batch_shape):
+    return np.broadcast_to(np.eye(3), tuple(batch_shape) + (3, 3)).copy()
+
+
+def transform_points(points, matrix):
+    """Apply (..., 3, 3) homogeneous matrices to (..., N, 2) points."""
+    return points @ np.swapaxes(matrix[..., :2, :2], -1, -2) + matrix[..., None, :2, 2]
+
+
+def _equirectangular(origin):
+    """
+    Affine matrices of the local equirectangular projection around origin (..., 2) in degrees:
+    (latitude, longitude) to meters north and east of origin, and back.
+    """
+    scale = np.stack(
+        [np.full(origin.shape[:-1], EARTH_RADIUS * math.pi / 180),
+         EARTH_RADIUS * np.cos(np.radians(origin[..., 0])) * math.pi / 180],
+        axis=-1,
+    )
+    forward = _eye(origin.shape[:-1])
+    forward[..., 0, 0] = scale[..., 0]
+    forward[..., 1, 1] = scale[..., 1]
+    forward[..., :2, 2] = -origin * scale
+    inverse = _eye(origin.shape[:-1])
+    inverse[..., 0, 0] = 1 / scale[..., 0]
+    inverse[..., 1, 1] = 1 / scale[..., 1]
+    inverse[..., :2, 2] = origin
+    return forward, inverse, scale
+
+
+class AffineOperation:
+    """
+    Operation expressed as a 3x3 homogeneous matrix acting on (x, y) points.
+
+    Parameters may be scalars, or arrays of K values to describe K operations at once (see apply_batch).
+    GPS polygons are transformed in a local equirectangular frame (meters) centered on their centroid,
+    so that rotations and scalings preserve the shape on the ground.
+    """
+
+    def _matrix(self, points, scale):
+        """Matrix in a metric frame, given the (..., N, 2) points in that frame and the degrees to frame scale."""
+        raise NotImplementedError
+
+    def output_system(self, system):
+        return system
+
+    def matrix(self, points, system="cartesian"):
+        """
+        Homogeneous matrix of this operation for (..., N, 2) points expressed in system.
+        :return: Array of shape (..., 3, 3).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if system != "GPS":
+            return self._matrix(points, np.ones(2))
+        forward, inverse, scale = _equirectangular(points.mean(axis=-2))
+        local_matrix = self._matrix(transform_points(points, forward), scale)
+        return inverse @ local_matrix @ forward
+
+    def apply_batch(self, polygon: Polygon):
+        """
+        Apply the K operations described by array parameters to one polygon.
+        :return: Array of shape (K, N, 2) of the transformed vertices.
+        """
+        points = polygon.array
+        return transform_points(points, self.matrix(points, polygon.system))
+
+    @profiling.profiled("operations.apply")
+    def apply(self, polygon: Polygon):
+        transformed = self.apply_batch(polygon)
+        if transformed.ndim != 2:
+            raise ValueError("Operations with array parameters must be applied with apply_batch.")
+        # Keep the polygon exactly closed
+        transformed[-1] = transformed[0]
+        return Polygon(coordinates=transformed, system=self.output_system(polygon.system))
+
+
 @dataclass
-class Translation:
+class Compose(AffineOperation):
+    """Chain of operations fused in a single matrix, applied in order (the first operation is applied first)."""
+    operations: List[AffineOperation]
+
+    def matrix(self, points, system="cartesian"):
+        points = np.asarray(points, dtype=np.float64)
+        matrix = None
+        current = points
+        for operation in self.operations:
+            # Operations depending on the polygon (e.g. its centroid) see the points transformed so far
+            step = operation.matrix(current, system)
+            matrix = step if matrix is None else step @ matrix
+            system = operation.output_system(system)
+            current = transform_points(points, matrix)
+        return matrix if matrix is not None else _eye(())
+
+    def output_system(self, system):
+        for operation in self.operations:
+            system = operation.output_system(system)
+        return system
+
+
+def compose(*operations):
+    """Fuse operations into one, e.g. compose(Rotation(a), Scaling(s), Translation(v)) rotates, then scales, then translates."""
+    return Compose(operations=list(operations))
+
+
+@dataclass
+class Translation(AffineOperation):
     vector: Coordinates
-    
-    def apply(self, polygon: Polygon):
-        if polygon.system == "GPS":
-            raise NotImplementedError
-        else:
-            return Polygon(coordinates=[point - self.vector for point in polygon.coordinates], system=polygon.system)
+
+    def _matrix(self, points, scale):
+        vector = _as_vector(self.vector) * scale
+        matrix = _eye(np.broadcast_shapes(points.shape[:-2], vector.shape[:-1]))
+        matrix[..., :2, 2] = -vector
+        return matrix
+
+
 @dataclass
-class Scaling:
-    scale_factor: float    
-    
-    def apply(self, polygon: Polygon):
-        if polygon.system == "GPS":
-            raise NotImplementedError
-        else:
-            return Polygon(coordinates=[point * self.scale_factor for point in polygon.coordinates], system=polygon.system)
+class Scaling(AffineOperation):
+    scale_factor: float
+
+    def _matrix(self, points, scale):
+        factor = np.asarray(self.scale_factor, dtype=np.float64)
+        matrix = _eye(np.broadcast_shapes(points.shape[:-2], factor.shape))
+        matrix[..., 0, 0] = factor
+        matrix[..., 1, 1] = factor
+        return matrix
+
+
+def _about(linear, center):
+    """Matrix applying the (..., 2, 2) linear map around center (..., 2)."""
+    batch_shape = np.broadcast_shapes(linear.shape[:-2], center.shape[:-1])
+    matrix = _eye(batch_shape)
+    matrix[..., :2, :2] = linear
+    matrix[..., :2, 2] = center - (linear @ center[..., None])[..., 0]
+    return matrix
+
 
 @dataclass
-class RadialDistortion:
+class RadialDistortion(AffineOperation):
     distortion_factor: float
 
-    def apply(self, polygon: Polygon):
-        if polygon.system == "GPS":
-            raise NotImplementedError
-        else:
-            centroid = polygon.centroid
-            distorted_polygon = []
-
-            for point in polygon.coordinates:
-                vector = point.to_numpy_array() - centroid.to_numpy_array()
-                distorted_point = centroid.to_numpy_array() + vector * (1 + self.distortion_factor)
-                distorted_polygon.append(Coordinates.from_tuple(distorted_point))
+    def _matrix(self, points, scale):
+        factor = 1 + np.asarray(self.distortion_factor, dtype=np.float64)
+        linear = factor[..., None, None] * np.eye(2)
+        return _about(linear, points.mean(axis=-2))
 
-            return Polygon(coordinates=distorted_polygon, system=polygon.system)
 
 @dataclass
-class Rotation:
+class Rotation(AffineOperation):
     angle: float
-    
-    def apply(self, polygon: Polygon):
-        
-        centroid = polygon.centroid
-        angle_radians = math.radians(self.angle)
-        cos_angle = math.cos(angle_radians)
-        sin_angle = math.sin(angle_radians)
-        ox, oy = centroid.to_numpy_array()
-    
-        rotated_coords = []
-        for coord in polygon.coordinates:
-            x, y = coord.to_tuple()
-  
-            # Translate point to center
-            tx = x - ox
-            ty = y - oy
-
-            # Rotate point
-            rx = tx * cos_angle - ty * sin_angle
-            ry = tx * sin_angle + ty * cos_angle
-
-            # Translate point back
-            final_x = rx + ox
-            final_y = ry + oy
-
-            rotated_coords.append(Coordinates(final_x, final_y))
-    
-        return Polygon(coordinates=rotated_coords, system=polygon.system)
-    
+
+    def _matrix(self, points, scale):
+        angle_radians = np.radians(np.asarray(self.angle, dtype=np.float64))
+        cos_angle = np.cos(angle_radians)
+        sin_angle = np.sin(angle_radians)
+        linear = np.stack([np.stack([cos_angle, -sin_angle], -1), np.stack([sin_angle, cos_angle], -1)], -2)
+        return _about(linear, points.mean(axis=-2))
+
 
 @dataclass
-class Projection:
+class Projection(AffineOperation):
     center: Coordinates
     radius: float
     map_type : str = "GPS"
-    
-    def apply(self, polygon: Polygon):
-        # Calculate the centroid of the contour
-        centroid = polygon.centroid
-    
-        # Translate the contour to the origin
-        translated_poly = Translation(vector=centroid).apply(polygon) 
-    
+
+    def output_system(self, system):
+        return self.map_type
+
+    def matrix(self, points, system="cartesian"):
+        if system == "GPS":
+            raise NotImplementedError("Projection expects a cartesian polygon.")
+        return super().matrix(points, system)
+
+    def _matrix(self, points, scale):
+        # Translate the contour centroid to the origin
+        centroid = points.mean(axis=-2)
+
         # Scale the contour to fit within the map radius
-        max_distance = max(np.linalg.norm(point.to_numpy_array()) for point in polygon.coordinates)
-        if max_distance == 0:
+        max_distance = np.linalg.norm(points, axis=-1).max(axis=-1)
+        if np.any(max_distance == 0):
             raise ValueError("Degenerate Polygone, it's just zero!")
-        else:
-            scale_factor = self.radius / max_distance
-            scaled_poly = Scaling(scale_factor).apply(translated_poly)
-    
+        scale_factor = np.asarray(self.radius, dtype=np.float64) / max_distance
+
         # Invert coordinates before projecting to GPS. It's because Cartesian coordinates (x,y) corresponds to longitude, latitude.
-        inverted_coordinates = [Coordinates(coord.longitude, coord.latitude) for coord in scaled_poly.coordinates]
-        scaled_poly = Polygon(coordinates=inverted_coordinates)
-        
+        swap = np.array([[0., 1.], [1., 0.]])
+        linear = scale_factor[..., None, None] * swap
+
         # Translate the contour to the map center
-        center = Coordinates.from_tuple(self.center)
-        final_contour = Translation(vector=-center).apply(scaled_poly)
-        final_contour.system = self.map_type
-    
-        return final_contour
+        center = _as_vector(self.center)
+        batch_shape = np.broadcast_shapes(linear.shape[:-2], center.shape[:-1], centroid.shape[:-1])
+        matrix = _eye(batch_shape)
+        matrix[..., :2, :2] = linear
+        matrix[..., :2, 2] = center - (linear @ centroid[..., None])[..., 0]
+        return matrix
 
 #### OLD
 def rotate_coordinates(coords, angle_degrees, origin=(0, 0)):
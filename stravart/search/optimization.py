@@ -1,10 +1,51 @@
-from stravart.search.operations import Projection, Rotation
-from stravart.search.metrics import diff_area
+import os
 
+import numpy as np
+import optuna
 
-def generate_route(gps_poly):
-    final_contour, path_mapping = gps_poly.fill_paths_between_points()
+from stravart import profiling
+
+from stravart.client import RoutingError
+from stravart.directions import Direction, Route
+from stravart.search.operations import Projection, Rotation, compose
+from stravart.search.metrics import diff_area, contour_bounds, segment_areas
+from stravart.search.space import CityGrid
+from stravart.simplification import simplify_route
+
+
+def generate_route(gps_poly, cache=None, provider="google", graph=None, client=None):
+    final_contour, path_mapping = gps_poly.fill_paths_between_points(provider=provider, cache=cache, graph=graph, client=client)
     return final_contour, path_mapping
+
+def generate_route_with_pruning(trial, gps_poly, chunk_size=10, cache=None, provider="google", graph=None, client=None):
+    """
+    Route gps_poly chunk by chunk, reporting after each chunk the loss of the segments routed so far,
+    extrapolated to all segments, and prune the trial when the pruner of the study decides so (e.g. optuna's
+    MedianPruner, comparing the reported losses of the trials at the same step).
+    The partial loss is normalized by the bounds of the projected polygon and the routed points, while the
+    final loss uses the filtered route and its own bounds: it estimates the final loss without bounding it,
+    so that pruning is a heuristic.
+    :return: Same (final_contour, path_mapping) as generate_route.
+    """
+    points = gps_poly.coordinates
+    directions = [Direction(points[i], points[i + 1]) for i in range(len(points) - 1)]
+
+    paths = {}
+    for step, start in enumerate(range(0, len(directions), chunk_size)):
+        chunk = Route(gps_poly.array[start:start + chunk_size + 1])
+        _, chunk_mapping = chunk.fill_paths_between_points(
+            provider=provider, apply_filter=False, cache=cache, graph=graph, client=client
+        )
+        paths.update(chunk_mapping)
+
+        bounds = contour_bounds(np.vstack([gps_poly.array] + [route.array for route in paths.values() if len(route)]))
+        # Losses of cumulated segments would only grow, which optuna pruners (using the best step) cannot compare
+        partial_loss = float(segment_areas(paths, bounds).sum()) * len(directions) / len(paths)
+        trial.report(partial_loss, step)
+        if trial.should_prune():
+            raise optuna.TrialPruned(f"Pruned at step {step} with partial loss {partial_loss}")
+
+    return Route._assemble_paths(directions, paths)
     
 def test_operation(operation, map_center, radius, poly):
     new_poly = operation.apply(poly)
@@ -16,43 +57,113 @@ def test_operation(operation, map_center, radius, poly):
     return diff_area(final_contour, path_mapping)
     
 def generate_grid(lat_start, lat_end, lon_start, lon_end, lat_points, lon_points):
-    lat_step = (lat_end - lat_start) / (lat_points - 1)
-    lon_step = (lon_end - lon_start) / (lon_points - 1)
-
-    grid = []
-    for i in range(lat_points):
-        for j in range(lon_points):
-            lat = lat_start + i * lat_step
-            lon = lon_start + j * lon_step
-            grid.append((lat, lon))
-    
-    return grid
+    """List of the (latitude, longitude) centers of a lat_points x lon_points grid, see CityGrid for its structured form."""
+    return list(CityGrid.from_bbox(lat_start, lat_end, lon_start, lon_end, lat_points, lon_points))
+
+# (low, high, step) of the discrete rotation angles (degrees) and radii (degrees) explored
+ANGLE_RANGE = (-10, 10, 5)
+RADIUS_RANGE = (0.01, 0.1, 0.005)
 
 def define_search_space(trial, city_grid):
-    angle = trial.suggest_float('rot_angle', -10, 10, step=5)
+    angle = trial.suggest_float('rot_angle', *ANGLE_RANGE[:2], step=ANGLE_RANGE[2])
 
-    # Randomly select a map center from city_grid
-    map_center_idx = trial.suggest_int('map_center_idx', 0, len(city_grid) - 1)
-    map_center = city_grid[map_center_idx]
+    if isinstance(city_grid, CityGrid):
+        # Structured (row, column) center, so that close values are close places
+        map_center_idx, map_center = city_grid.suggest(trial)
+        trial.set_user_attr("map_center_idx", map_center_idx)
+    else:
+        # Randomly select a map center from city_grid
+        map_center_idx = trial.suggest_int('map_center_idx', 0, len(city_grid) - 1)
+        map_center = city_grid[map_center_idx]
 
     # Use discrete increments for radius
-    radius = trial.suggest_float('radius', 0.01, 0.1, step= 0.005)
+    radius = trial.suggest_float('radius', *RADIUS_RANGE[:2], step=RADIUS_RANGE[2])
 
     return angle, map_center, radius
 
-def objective(trial, poly, city_grid):
-    angle, map_center, radius = define_search_space(trial,city_grid=city_grid)
+def objective(trial, poly, city_grid, cache=None, provider="google", graph=None, client=None, prune=False, serializable_attrs=False, evaluator=None,
+              profile=False, trace_dir=None, artifacts=None, simplify_tolerance=None):
+    """
+    Optuna objective: rotate and project poly on the map, route it and return its diff_area loss.
+    :param prune: Route by chunks and let the pruner of the study stop the trial on its partial losses,
+        see generate_route_with_pruning.
+    :param serializable_attrs: Store the routes as json-friendly lists in the trial user attrs,
+        as required by RDB and journal storages.
+    :param evaluator: IncrementalEvaluator reusing the segments routed by previous trials, it then
+        replaces the provider, cache, graph, client and prune options.
+    :param profile: Record the duration of each stage, the requests and the cache hits of the trial
+        in its "profile" user attr, see stravart.profiling.
+    :param trace_dir: Also write the Chrome trace of the trial to trace_dir/trial_<number>.json (implies profile).
+    :param artifacts: ArtifactStore the routes are written to, only their key being stored in the "artifact"
+        user attr (see ArtifactStore.get), instead of the routes themselves.
+    :param simplify_tolerance: Simplify the routed contour and each routed segment with Douglas-Peucker (tolerance
+        in meters) before computing the loss and storing them, see stravart.simplification. The loss is then
+        computed by diff_area, also with an evaluator.
+    """
+    kwargs = dict(cache=cache, provider=provider, graph=graph, client=client, prune=prune,
+                  serializable_attrs=serializable_attrs, evaluator=evaluator, artifacts=artifacts,
+                  simplify_tolerance=simplify_tolerance)
+    if not (profile or trace_dir):
+        return _run_trial(trial, poly, city_grid, **kwargs)
+
+    profiler = profiling.Profiler()
+    try:
+        with profiler, profiling.span("trial", number=trial.number):
+            return _run_trial(trial, poly, city_grid, **kwargs)
+    finally:
+        # Also kept for pruned and failed trials
+        trial.set_user_attr('profile', profiler.summary())
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+            profiler.save_chrome_trace(os.path.join(trace_dir, f"trial_{trial.number}.json"))
 
-    # Apply the operation and projection
-    new_poly = Rotation(angle).apply(poly)
+def _run_trial(trial, poly, city_grid, cache, provider, graph, client, prune, serializable_attrs, evaluator, artifacts,
+               simplify_tolerance):
+    with profiling.span("trial.search_space"):
+        angle, map_center, radius = define_search_space(trial,city_grid=city_grid)
+
+    # Apply the operation and projection as a single fused transform
     projection = Projection(center=map_center, radius=radius, map_type="GPS")
-    gps_poly = projection.apply(new_poly)
+    gps_poly = compose(Rotation(angle), projection).apply(poly)
 
     # Generate route and calculate loss
-    final_contour, path_mapping = generate_route(gps_poly)
-    loss = diff_area(final_contour, path_mapping)
+    with profiling.span("trial.routing"):
+        try:
+            if evaluator is not None:
+                loss, final_contour, path_mapping = evaluator.evaluate(gps_poly)
+            elif prune:
+                final_contour, path_mapping = generate_route_with_pruning(
+                    trial, gps_poly, cache=cache, provider=provider, graph=graph, client=client
+                )
+            else:
+                final_contour, path_mapping = generate_route(gps_poly, cache=cache, provider=provider, graph=graph, client=client)
+        except RoutingError as error:
+            # Unroutable projections (e.g. across disconnected streets) are pruned, the study goes on
+            trial.set_user_attr('routing_error', str(error))
+            raise optuna.TrialPruned(str(error)) from error
+    if simplify_tolerance:
+        # The segments are simplified too, so that the loss is the one of the simplified route, with or without evaluator
+        with profiling.span("trial.simplify"):
+            final_contour = simplify_route(final_contour, simplify_tolerance)
+            path_mapping = {direction: simplify_route(route, simplify_tolerance) for direction, route in path_mapping.items()}
+    if evaluator is None or simplify_tolerance:
+        loss = diff_area(final_contour, path_mapping)
 
-    trial.set_user_attr('final_contour', final_contour)
-    trial.set_user_attr('path_mapping', path_mapping)
+    with profiling.span("trial.user_attrs"):
+        if artifacts is not None:
+            trial.set_user_attr('artifact', artifacts.put(final_contour, path_mapping))
+        elif serializable_attrs:
+            trial.set_user_attr('final_contour', final_contour.array.tolist())
+            trial.set_user_attr('path_mapping', [
+                {'start': direction.start.to_tuple(), 'end': direction.end.to_tuple(), 'path': route.array.tolist()}
+                for direction, route in path_mapping.items()
+            ])
+        else:
+            trial.set_user_attr('final_contour', final_contour)
+            trial.set_user_attr('path_mapping', path_mapping)
+        if cache is not None:
+            trial.set_user_attr('cache_stats', cache.stats())
+        if evaluator is not None:
+            trial.set_user_attr('evaluator_stats', evaluator.stats())
 
     return loss
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+Headless Optuna study runner.
+
+Trials run concurrently on threads or processes against a shared on-disk storage, so a study can be
+resumed or extended by running the same command again:
+
+    stravart-study --image img/dog.jpg --storage studies/dog.db --n-trials 200 --n-workers 8
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import optuna
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
+
+from stravart.polygone import Polygon
+from stravart.search.artifacts import ArtifactStore
+from stravart.search.incremental import IncrementalEvaluator
+from stravart.search.optimization import objective
+from stravart.search.space import CityGrid
+
+# Trials counted against n_trials, enqueued (WAITING) trials are still to be run
+STARTED_STATES = (TrialState.RUNNING, TrialState.COMPLETE, TrialState.PRUNED, TrialState.FAIL)
+
+# Paris
+DEFAULT_BBOX = (48.8156, 48.9022, 2.2241, 2.4699)
+
+
+def create_storage(storage):
+    """
+    Build an Optuna storage from a path or url: sqlite files (.db, .sqlite) and database urls
+    give an RDB storage, any other path a journal file storage.
+    """
+    if "://" in storage:
+        return optuna.storages.RDBStorage(storage, heartbeat_interval=60, grace_period=120)
+    directory = os.path.dirname(os.path.abspath(storage))
+    os.makedirs(directory, exist_ok=True)
+    if storage.endswith((".db", ".sqlite", ".sqlite3")):
+        return optuna.storages.RDBStorage(f"sqlite:///{storage}", heartbeat_interval=60, grace_period=120)
+    return optuna.storages.JournalStorage(optuna.storages.JournalFileStorage(storage))
+
+
+def load_polygon(image=None, polygon=None):
+    """Load the cartesian polygon to draw, either from an image contour or from a json list of [x, y] points."""
+    if image is not None:
+        from stravart.contours.extraction import ContourExtractor
+
+        contour = ContourExtractor(image).get_best_contour()
+        contour.close()
+        return Polygon.from_list(coordinates_list=contour.raw_contour, system="cartesian")
+    with open(polygon) as f:
+        points = json.load(f)
+    if points[0] != points[-1]:
+        points.append(points[0])
+    return Polygon.from_list(coordinates_list=points, system="cartesian")
+
+
+def create_pruner(prune=True):
+    """
+    Pruner of the partial losses reported by generate_route_with_pruning: a trial is stopped when its partial
+    loss is worse than the median of the previous trials at the same step.
+    """
+    if not prune:
+        return optuna.pruners.NopPruner()
+    return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+
+
+def _optimize(storage, study_name, n_trials, objective_kwargs, poly, city_grid, n_jobs=1):
+    """Run trials on one worker until the study holds n_trials started trials, whatever their outcome."""
+    from stravart.cache import SegmentCache
+    from stravart.graph import StreetGraph
+
+    storage = create_storage(storage)
+    study = optuna.load_study(study_name=study_name, storage=storage, pruner=create_pruner(objective_kwargs.get("prune")))
+    if len(study.get_trials(deepcopy=False, states=STARTED_STATES)) >= n_trials:
+        return
+
+    objective_kwargs = dict(objective_kwargs)
+    cache_path = objective_kwargs.pop("cache_path", None)
+    graph_path = objective_kwargs.pop("graph_path", None)
+    cache = SegmentCache(path=cache_path) if cache_path else None
+    graph = StreetGraph.load(graph_path) if graph_path else None
+    artifacts_path = objective_kwargs.pop("artifacts_path", None)
+    if artifacts_path:
+        objective_kwargs["artifacts"] = ArtifactStore(artifacts_path)
+    if objective_kwargs.pop("incremental", False):
+        # One evaluator per worker, shared by the trials of its threads
+        objective_kwargs["evaluator"] = IncrementalEvaluator(
+            provider=objective_kwargs["provider"], graph=graph, cache=cache
+        )
+
+    try:
+        study.optimize(
+            partial(objective, poly=poly, city_grid=city_grid, cache=cache, graph=graph, serializable_attrs=True, **objective_kwargs),
+            n_trials=None,
+            n_jobs=n_jobs,
+            callbacks=[MaxTrialsCallback(n_trials, states=STARTED_STATES)],
+            catch=(Exception,),
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def _enqueue_prescreened(study, poly, city_grid, n_trials, candidates_per_trial, graph_path, road_index_path, seed):
+    from stravart.graph import StreetGraph
+    from stravart.snapping import RoadIndex
+    from stravart.search.surrogate import SurrogateScreener, enqueue_screened
+
+    if road_index_path is not None:
+        index = RoadIndex.load(road_index_path)
+    elif graph_path is not None:
+        index = StreetGraph.load(graph_path)
+    else:
+        raise ValueError("Prescreening needs a road index or a street graph.")
+    remaining = n_trials - len(study.get_trials(deepcopy=False))
+    if remaining > 0:
+        enqueue_screened(study, SurrogateScreener(index), poly, city_grid, remaining, candidates_per_trial, seed=seed)
+
+
+def run_study(poly, city_grid, storage, study_name="stravart", n_trials=200, n_workers=4, executor="thread",
+              provider="google", cache_path=None, graph_path=None, prune=True, seed=None, incremental=False,
+              prescreen=None, road_index_path=None, profile=False, trace_dir=None, artifacts_path=None,
+              simplify_tolerance=None):
+    """
+    Run a study with n_workers concurrent trials against a shared storage, resuming it if it exists.
+    :param storage: Path of the storage file (sqlite or journal) or database url.
+    :param n_trials: Total number of trials of the study, including the ones of previous runs.
+    :param executor: "thread" to run trials on threads of this process, "process" to run one
+        worker process per trial slot (each with its own segment cache connection and graph).
+    :param provider: Routing provider, see Route.fill_paths_between_points.
+    :param cache_path: Optional SQLite file of the SegmentCache shared by all workers.
+    :param graph_path: StreetGraph file for the "local" provider.
+    :param prune: Route trials by chunks and prune the ones whose partial loss is worse than the median, see create_pruner.
+    :param incremental: Route trials with an IncrementalEvaluator per worker, only routing the segments
+        not routed by previous trials of the worker (replaces pruning).
+    :param prescreen: If set, the trials to run are first chosen by a SurrogateScreener among prescreen
+        candidates per trial, only the best ones being routed.
+    :param road_index_path: RoadIndex file (.npz, .geojson or Overpass .json) of the prescreen, the street
+        graph of graph_path is used if None.
+    :param profile: Record the stage durations, requests and cache hits of each trial in its "profile" user attr.
+    :param trace_dir: Also write the Chrome trace of each trial to this directory (implies profile).
+    :param artifacts_path: Directory of an ArtifactStore the routes of the trials are written to, only their
+        key being stored in the study. The routes are stored as json lists in the study if None.
+    :param simplify_tolerance: Simplify the routed contours (tolerance in meters) before computing their loss.
+    :return: The Optuna study.
+    """
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=create_storage(storage),
+        direction="minimize",
+        sampler=optuna.samplers.TPESampler(seed=seed),
+        pruner=create_pruner(prune),
+        load_if_exists=True,
+    )
+    if prescreen:
+        _enqueue_prescreened(study, poly, city_grid, n_trials, prescreen, graph_path, road_index_path, seed)
+    objective_kwargs = {"provider": provider, "prune": prune, "cache_path": cache_path, "graph_path": graph_path,
+                        "incremental": incremental, "profile": profile, "trace_dir": trace_dir,
+                        "artifacts_path": artifacts_path, "simplify_tolerance": simplify_tolerance}
+    run = partial(_optimize, storage, study_name, n_trials, objective_kwargs, poly, city_grid)
+
+    if executor == "thread":
+        run(n_jobs=n_workers)
+    elif executor == "process":
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for future in [pool.submit(run) for _ in range(n_workers)]:
+                future.result()
+    else:
+        raise ValueError(f"Unknown executor {executor}")
+
+    return optuna.load_study(study_name=study_name, storage=create_storage(storage))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a StravArt route search study.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--image", help="Image whose best contour is drawn.")
+    source.add_argument("--polygon", help="Json file of the [x, y] points of the polygon to draw.")
+    parser.add_argument("--storage", default="studies/stravart.log", help="Storage file (sqlite .db or journal) or database url.")
+    parser.add_argument("--study-name", default="stravart")
+    parser.add_argument("--n-trials", type=int, default=200, help="Total number of trials of the study.")
+    parser.add_argument("--n-workers", type=int, default=4)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--provider", choices=["google", "mapbox", "osrm", "local"], default="google")
+    parser.add_argument("--graph", help="StreetGraph file of the local provider.")
+    parser.add_argument("--cache", help="SQLite file of the segment cache.")
+    parser.add_argument("--bbox", type=float, nargs=4, default=DEFAULT_BBOX,
+                        metavar=("LAT_START", "LAT_END", "LON_START", "LON_END"))
+    parser.add_argument("--area", help="GeoJSON Polygon of the city area, the map centers are only drawn inside it (replaces --bbox).")
+    parser.add_argument("--grid-size", type=int, default=10)
+    parser.add_argument("--no-prune", action="store_true", help="Route every trial fully.")
+    parser.add_argument("--incremental", action="store_true", help="Only route the segments changed since previous trials.")
+    parser.add_argument("--prescreen", type=int, metavar="N",
+                        help="Only route the best trials of a road distance surrogate, out of N candidates per trial.")
+    parser.add_argument("--road-index", help="RoadIndex file of the prescreen (defaults to the street graph).")
+    parser.add_argument("--profile", action="store_true", help="Record a timing breakdown of each trial in its user attrs.")
+    parser.add_argument("--trace-dir", help="Write the Chrome trace of each trial to this directory.")
+    parser.add_argument("--artifacts", default="studies/artifacts",
+                        help="Directory the routes of the trials are written to, the study only keeping their key.")
+    parser.add_argument("--simplify", type=float, metavar="METERS", help="Simplify the routed contours with this tolerance.")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    poly = load_polygon(image=args.image, polygon=args.polygon)
+    if args.area is not None:
+        city_grid = CityGrid.from_geojson(args.area, args.grid_size, args.grid_size)
+    else:
+        city_grid = CityGrid.from_bbox(*args.bbox, args.grid_size, args.grid_size)
+    study = run_study(
+        poly, city_grid, args.storage,
+        study_name=args.study_name,
+        n_trials=args.n_trials,
+        n_workers=args.n_workers,
+        executor=args.executor,
+        provider=args.provider,
+        cache_path=args.cache,
+        graph_path=args.graph,
+        prune=not args.no_prune,
+        seed=args.seed,
+        incremental=args.incremental,
+        prescreen=args.prescreen,
+        road_index_path=args.road_index,
+        profile=args.profile,
+        trace_dir=args.trace_dir,
+        artifacts_path=args.artifacts,
+        simplify_tolerance=args.simplify,
+    )
+    best_trial = study.best_trial
+    print(json.dumps({"best_value": best_trial.value, "best_params": best_trial.params,
+                      "map_center": city_grid[best_trial.user_attrs["map_center_idx"]]}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import json
+from dataclasses import dataclass
+
+import numpy as np
+from matplotlib.path import Path
+from scipy.spatial import cKDTree
+
+from stravart.search.operations import Projection, Rotation, compose, transform_points
+
+
+@dataclass
+class CityGrid:
+    """
+    Regular grid of candidate map centers over a city area.
+
+    It behaves like the list of (latitude, longitude) tuples built by generate_grid (len, indexing, iteration)
+    over the cells inside the area, in row-major order, and additionally exposes the (row, column) structure
+    of the grid so that samplers can exploit the locality of neighboring centers.
+
+    :param latitudes: Latitude of each grid row.
+    :param longitudes: Longitude of each grid column.
+    :param mask: (rows, columns) boolean array of the cells inside the area, all of them if None.
+    """
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    mask: np.ndarray = None
+
+    def __post_init__(self):
+        self.latitudes = np.asarray(self.latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(self.longitudes, dtype=np.float64)
+        shape = (len(self.latitudes), len(self.longitudes))
+        self.mask = np.ones(shape, dtype=bool) if self.mask is None else np.asarray(self.mask, dtype=bool)
+        if self.mask.shape != shape:
+            raise ValueError(f"Mask of shape {self.mask.shape} does not match the grid shape {shape}.")
+        if not self.mask.any():
+            raise ValueError("No grid cell inside the area.")
+
+        self.rows, self.columns = np.nonzero(self.mask)
+        self.centers = np.column_stack([self.latitudes[self.rows], self.longitudes[self.columns]])
+        # Flat index of the area cell nearest to each cell of the grid, so that any (row, column) maps to a center
+        _, nearest = cKDTree(np.column_stack([self.rows, self.columns])).query(np.argwhere(np.ones(shape)))
+        self._nearest = nearest.reshape(shape)
+        self.road_density = None
+
+    @classmethod
+    def from_bbox(cls, lat_start, lat_end, lon_start, lon_end, lat_points, lon_points):
+        """Grid of lat_points x lon_points centers spanning a bounding box, bounds included."""
+        return cls(np.linspace(lat_start, lat_end, lat_points), np.linspace(lon_start, lon_end, lon_points))
+
+    @classmethod
+    def from_polygon(cls, area, lat_points, lon_points):
+        """
+        Grid over the bounding box of an area, keeping only the cells inside it.
+        :param area: (N, 2) array-like of the (latitude, longitude) vertices of the area, or a GPS Polygon.
+        """
+        vertices = area.array if hasattr(area, "array") else np.asarray(area, dtype=np.float64)
+        (lat_start, lon_start), (lat_end, lon_end) = vertices.min(axis=0), vertices.max(axis=0)
+        latitudes = np.linspace(lat_start, lat_end, lat_points)
+        longitudes = np.linspace(lon_start, lon_end, lon_points)
+        lat_grid, lon_grid = np.meshgrid(latitudes, longitudes, indexing="ij")
+        inside = Path(vertices).contains_points(np.column_stack([lat_grid.ravel(), lon_grid.ravel()]))
+        return cls(latitudes, longitudes, inside.reshape(lat_grid.shape))
+
+    @classmethod
+    def from_geojson(cls, path, lat_points, lon_points):
+        """Grid over the first Polygon (outer ring) of a GeoJSON file, see from_polygon."""
+        with open(path) as f:
+            data = json.load(f)
+        features = data.get("features", [data])
+        for feature in features:
+            geometry = feature.get("geometry", feature)
+            if geometry.get("type") == "Polygon":
+                ring = geometry["coordinates"][0]
+            elif geometry.get("type") == "MultiPolygon":
+                ring = geometry["coordinates"][0][0]
+            else:
+                continue
+            # GeoJSON stores [longitude, latitude]
+            return cls.from_polygon([(lat, lon) for lon, lat, *_ in ring], lat_points, lon_points)
+        raise ValueError(f"No Polygon feature in {path}.")
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __getitem__(self, index):
+        latitude, longitude = self.centers[index]
+        return (float(latitude), float(longitude))
+
+    def __iter__(self):
+        return iter(map(tuple, self.centers.tolist()))
+
+    def __array__(self, dtype=None):
+        return self.centers if dtype is None else self.centers.astype(dtype)
+
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    def index(self, row, column):
+        """Flat index of the center of a grid cell, the nearest cell inside the area if it is outside."""
+        return int(self._nearest[row, column])
+
+    def params(self, index):
+        """Trial parameters selecting the center of flat index, see suggest."""
+        return {"map_center_row": int(self.rows[index]), "map_center_column": int(self.columns[index])}
+
+    def suggest(self, trial):
+        """
+        Suggest a map center as a (row, column) pair of integers: unlike a flat index, neighboring values
+        are neighboring places, which samplers such as TPE can exploit.
+        :return: Tuple of the flat index of the center and its (latitude, longitude).
+        """
+        row = trial.suggest_int("map_center_row", 0, self.shape[0] - 1)
+        column = trial.suggest_int("map_center_column", 0, self.shape[1] - 1)
+        index = self.index(row, column)
+        return index, self[index]
+
+    def compute_road_density(self, index, radius=500):
+        """
+        Road length (meters) around each center, from the segments of a RoadIndex (or StreetGraph) within radius meters.
+        The result is also kept in road_density.
+        """
+        from stravart.graph import StreetGraph
+        from stravart.snapping import RoadIndex
+
+        if isinstance(index, StreetGraph):
+            index = RoadIndex.from_graph(index)
+        self.road_density = index.length_within(self.centers, radius)
+        return self.road_density
+
+    @staticmethod
+    def shape_bounds(poly, radii, angles=(0.,)):
+        """
+        Bounding box of the cartesian polygon poly rotated by each angle and projected at each radius,
+        as (latitude, longitude) offsets from the map center, in degrees.
+        :return: (A, R, 2, 2) array of the [low, high] corners.
+        """
+        angles = np.asarray(angles, dtype=np.float64)[:, None]
+        radii = np.asarray(radii, dtype=np.float64)[None, :]
+        operation = compose(Rotation(angles), Projection(center=np.zeros(2), radius=radii))
+        points = transform_points(poly.array, operation.matrix(poly.array, poly.system))
+        return np.stack([points.min(axis=-2), points.max(axis=-2)], axis=-2)
+
+    def fits(self, poly, radii, angles=(0.,)):
+        """
+        (M, A, R) boolean array of whether poly rotated by each angle and projected at each center and radius
+        stays within the bounding box of the grid.
+        """
+        bounds = self.shape_bounds(poly, radii, angles)
+        area = np.array([[self.latitudes.min(), self.longitudes.min()], [self.latitudes.max(), self.longitudes.max()]])
+        # Room around each center, compared with the offsets of the corners
+        low = (area[0] - self.centers)[:, None, None, :]
+        high = (area[1] - self.centers)[:, None, None, :]
+        return np.all((bounds[None, ..., 0, :] >= low) & (bounds[None, ..., 1, :] <= high), axis=-1)
@@ -0,0 +1,101 @@
+import numpy as np
+
+from stravart.search.metrics import resample
+from stravart.search.operations import Projection, Rotation, compose, transform_points
+from stravart.search.optimization import ANGLE_RANGE, RADIUS_RANGE
+from stravart.search.space import CityGrid
+
+
+def _steps(low, high, step):
+    return np.round(low + step * np.arange(round((high - low) / step) + 1), 10)
+
+
+def candidate_grid(city_grid):
+    """
+    Every (rot_angle, map_center_idx, radius) of the search space of define_search_space.
+    :return: Dict of three aligned arrays, keyed by the trial parameter names.
+    """
+    angles, centers, radii = np.meshgrid(
+        _steps(*ANGLE_RANGE), np.arange(len(city_grid)), _steps(*RADIUS_RANGE), indexing="ij"
+    )
+    return {"rot_angle": angles.ravel(), "map_center_idx": centers.ravel(), "radius": radii.ravel()}
+
+
+def _center_params(city_grid, index):
+    """Trial parameters selecting the center of flat index, as suggested by define_search_space."""
+    if isinstance(city_grid, CityGrid):
+        return city_grid.params(index)
+    return {"map_center_idx": int(index)}
+
+
+class SurrogateScreener:
+    """
+    Cheap surrogate of the route loss: the mean distance (meters) from points sampled evenly along the
+    projected polygon to the nearest road. Projections landing on parks, water or sparse areas score badly
+    and can be discarded before paying for their routing.
+
+    :param index: RoadIndex of the city_grid area (a StreetGraph is converted with RoadIndex.from_graph).
+    :param samples: Number of points sampled along the polygon perimeter.
+    :param batch_size: Number of candidates projected and snapped at once.
+    """
+
+    def __init__(self, index, samples=64, batch_size=2048):
+        from stravart.graph import StreetGraph
+        from stravart.snapping import RoadIndex
+
+        self.index = RoadIndex.from_graph(index) if isinstance(index, StreetGraph) else index
+        self.samples = samples
+        self.batch_size = batch_size
+
+    def score(self, poly, city_grid, angles, center_indices, radii):
+        """
+        Surrogate loss of K candidate projections of the cartesian polygon poly.
+        :return: Array of K mean distances to the nearest road, in meters.
+        """
+        # Sample along the cartesian polygon, then map the samples with the matrices fitted on its vertices
+        sampled = resample(poly.array, self.samples)
+        centers = np.asarray(city_grid, dtype=np.float64)[np.asarray(center_indices)]
+        angles, radii = np.asarray(angles, dtype=np.float64), np.asarray(radii, dtype=np.float64)
+        scores = np.empty(len(angles))
+        for start in range(0, len(angles), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            operation = compose(Rotation(angles[batch]), Projection(center=centers[batch], radius=radii[batch]))
+            points = transform_points(sampled, operation.matrix(poly.array, poly.system))
+            _, distances = self.index.snap(points.reshape(-1, 2))
+            scores[batch] = distances.reshape(len(points), -1).mean(axis=1)
+        return scores
+
+    def screen(self, poly, city_grid, top_k, n_candidates=None, seed=None):
+        """
+        Score n_candidates parameter sets drawn from the search space (all of them if None or larger
+        than the space) and keep the top_k best.
+        :return: List of (params, score) sorted by increasing score, params being trial parameter dicts.
+        """
+        candidates = candidate_grid(city_grid)
+        size = len(candidates["rot_angle"])
+        if n_candidates is not None and n_candidates < size:
+            chosen = np.random.default_rng(seed).choice(size, n_candidates, replace=False)
+            candidates = {name: values[chosen] for name, values in candidates.items()}
+        scores = self.score(poly, city_grid, candidates["rot_angle"], candidates["map_center_idx"], candidates["radius"])
+        best = np.argsort(scores, kind="stable")[:top_k]
+        return [
+            ({
+                "rot_angle": float(candidates["rot_angle"][i]),
+                **_center_params(city_grid, candidates["map_center_idx"][i]),
+                "radius": float(candidates["radius"][i]),
+            }, float(scores[i]))
+            for i in best
+        ]
+
+
+def enqueue_screened(study, screener, poly, city_grid, n_trials, candidates_per_trial=200, seed=None):
+    """
+    Enqueue in study the n_trials best candidates of the surrogate, out of n_trials * candidates_per_trial
+    candidates, so that they are the next trials routed. Their surrogate score is kept as the
+    "surrogate_score" user attr.
+    :return: Number of trials enqueued.
+    """
+    screened = screener.screen(poly, city_grid, top_k=n_trials, n_candidates=n_trials * candidates_per_trial, seed=seed)
+    for params, score in screened:
+        study.enqueue_trial(params, user_attrs={"surrogate_score": score}, skip_if_exists=True)
+    return len(screened)
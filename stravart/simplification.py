@@ -0,0 +1,147 @@
+"""
+Simplification of GPS polylines with tolerances in meters.
+
+Points are projected on a local equirectangular plane (meters around their mean latitude), accurate
+well below a meter at the scale of a city route.
+
+- Douglas-Peucker keeps every dropped point within tolerance meters of the simplified polyline.
+- Visvalingam-Whyatt repeatedly drops the point of smallest triangle area with its neighbors, while that
+  area is below tolerance ** 2 square meters. It removes small zigzags first and keeps the overall shape
+  smoother at high reductions.
+"""
+import heapq
+
+import numpy as np
+
+from stravart.graph import EARTH_RADIUS
+
+
+def to_plane(points):
+    """(N, 2) (latitude, longitude) degrees to (N, 2) (x east, y north) meters on a local equirectangular plane."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    lat0 = np.radians(points[:, 0].mean()) if len(points) else 0.
+    radians = np.radians(points)
+    return EARTH_RADIUS * np.column_stack([radians[:, 1] * np.cos(lat0), radians[:, 0]])
+
+
+def _segment_distances(xy, starts, ends, indices):
+    """Distances from the points xy[indices] to the segments from xy[starts] to xy[ends] (aligned arrays)."""
+    a, b = xy[starts], xy[ends]
+    direction = b - a
+    length = np.einsum("ij,ij->i", direction, direction)
+    offset = xy[indices] - a
+    t = np.clip(np.einsum("ij,ij->i", offset, direction) / np.where(length == 0, 1., length), 0., 1.)
+    return np.hypot(*(offset - t[:, None] * direction).T)
+
+
+def douglas_peucker_mask(points, tolerance):
+    """
+    Mask of the points kept by the Douglas-Peucker algorithm: every dropped point is within tolerance
+    meters of the simplified polyline. The first and last points are always kept.
+    """
+    xy = to_plane(points)
+    keep = np.zeros(len(xy), dtype=bool)
+    if len(xy) < 3:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+    # Every pending (start, end) range is split at once, so each pass is vectorized over the whole polyline.
+    # A closed polyline has a null chord, it is split at its farthest point from the start.
+    starts, ends = np.array([0]), np.array([len(xy) - 1])
+    while len(starts):
+        sizes = ends - starts - 1
+        starts, ends, sizes = starts[sizes > 0], ends[sizes > 0], sizes[sizes > 0]
+        if not len(starts):
+            break
+        group = np.repeat(np.arange(len(starts)), sizes)
+        group_starts = np.cumsum(sizes) - sizes
+        indices = starts[group] + 1 + np.arange(len(group)) - group_starts[group]
+        distances = _segment_distances(xy, starts[group], ends[group], indices)
+        # Farthest point of each range: the first reaching the range maximum
+        maxima = np.maximum.reduceat(distances, group_starts)
+        candidates = np.flatnonzero(distances == maxima[group])
+        split_at = np.full(len(starts), len(indices))
+        np.minimum.at(split_at, group[candidates], candidates)
+        split = maxima > tolerance
+        splits = indices[split_at[split]]
+        keep[splits] = True
+        starts, ends = np.concatenate([starts[split], splits]), np.concatenate([splits, ends[split]])
+    return keep
+
+
+def visvalingam_whyatt_mask(points, tolerance):
+    """
+    Mask of the points kept by the Visvalingam-Whyatt algorithm, dropping points while the smallest
+    effective area is below tolerance ** 2 square meters. The first and last points are always kept.
+    """
+    xy = to_plane(points)
+    n = len(xy)
+    if n < 3:
+        return np.ones(n, dtype=bool)
+    threshold = tolerance ** 2
+    # Initial areas of all inner points at once, then a heap with lazy deletion of outdated areas
+    a, b, c = xy[:-2], xy[1:-1], xy[2:]
+    areas = np.full(n, np.inf)
+    areas[1:-1] = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) / 2
+    candidates = np.flatnonzero(areas < threshold)
+    heap = list(zip(areas[candidates].tolist(), candidates.tolist()))
+    heapq.heapify(heap)
+
+    # The linked list of remaining points is updated one removal at a time, on plain lists
+    x, y = xy[:, 0].tolist(), xy[:, 1].tolist()
+    areas = areas.tolist()
+    previous, following = list(range(-1, n - 1)), list(range(1, n + 1))
+    keep = [True] * n
+    while heap:
+        area, i = heapq.heappop(heap)
+        if not keep[i] or area != areas[i]:
+            continue
+        keep[i] = False
+        before, after = previous[i], following[i]
+        following[before], previous[after] = after, before
+        # The area of a neighbor never drops below the one just removed, so that removals are in increasing order
+        for j in (before, after):
+            if 0 < j < n - 1:
+                k, m = previous[j], following[j]
+                neighbor_area = abs((x[j] - x[k]) * (y[m] - y[k]) - (x[m] - x[k]) * (y[j] - y[k])) / 2
+                areas[j] = max(neighbor_area, area)
+                if areas[j] < threshold:
+                    heapq.heappush(heap, (areas[j], j))
+    return np.array(keep)
+
+
+def visvalingam_whyatt(points, tolerance):
+    """Simplify an (N, 2) array of (latitude, longitude) with the Visvalingam-Whyatt algorithm, see visvalingam_whyatt_mask."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[visvalingam_whyatt_mask(points, tolerance)]
+
+
+METHODS = {"douglas_peucker": douglas_peucker_mask, "visvalingam_whyatt": visvalingam_whyatt_mask}
+
+
+def simplify(points, tolerance, method="douglas_peucker"):
+    """
+    Simplify an (N, 2) array of (latitude, longitude) with a tolerance in meters.
+    :param method: "douglas_peucker" or "visvalingam_whyatt".
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown simplification method {method}, expected one of {sorted(METHODS)}")
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[METHODS[method](points, tolerance)]
+
+
+def simplify_route(route, tolerance, method="douglas_peucker"):
+    """Simplified copy of a Route (or Polygon, keeping its system), see simplify."""
+    from stravart.directions import Route
+    from stravart.polygone import Polygon
+
+    points = simplify(route.array, tolerance, method)
+    if isinstance(route, Polygon):
+        return Polygon(points, system=route.system)
+    return Route(points)
+
+
+def douglas_peucker(points, tolerance):
+    """Simplify an (N, 2) array of (latitude, longitude) with the Douglas-Peucker algorithm, see douglas_peucker_mask."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[douglas_peucker_mask(points, tolerance)]
@@ -0,0 +1,244 @@
+import json
+import math
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .coordinates import OVERPASS_URL
+from .graph import EARTH_RADIUS
+
+
+def is_bicycle_way(tags):
+    """Same selection of ways as the Overpass query of Coordinates.overpass_request."""
+    highway = tags.get("highway")
+    bicycle = tags.get("bicycle")
+    if highway == "cycleway" or bicycle in ("designated", "yes"):
+        return True
+    return highway in ("path", "service", "residential") and bicycle != "no"
+
+
+def overpass_bbox_request(bbox):
+    """
+    Overpass query parameters of every bicycle friendly way of a bounding box, with their geometry.
+    :param bbox: Tuple of (south, west, north, east) in degrees.
+    """
+    south, west, north, east = bbox
+    box = f"{south},{west},{north},{east}"
+    overpass_query = f"""
+    [out:json][timeout:180];
+    (
+    way({box})["highway"="cycleway"];
+    way({box})["bicycle"="designated"];
+    way({box})["bicycle"="yes"];
+    way({box})["highway"="path"]["bicycle"!="no"];
+    way({box})["highway"="footway"]["bicycle"="yes"];
+    way({box})["highway"="service"]["bicycle"!="no"];
+    way({box})["highway"="residential"]["bicycle"!="no"];
+    );
+    out geom;
+    """
+    return {'data': overpass_query}
+
+
+@dataclass
+class RoadIndex:
+    """
+    Spatial index over road segments, snapping points to the nearest point of any segment.
+
+    Segments are projected on a local equirectangular plane (in meters) around the index center, split so
+    that none is longer than max_segment_length, and their midpoints are indexed in a KD-tree. A point then
+    only needs to be projected on the segments whose midpoint is within its distance to the nearest one
+    plus half of max_segment_length.
+
+    :param starts: (M, 2) array of the (latitude, longitude) start of each segment.
+    :param ends: (M, 2) array of the (latitude, longitude) end of each segment.
+    :param max_segment_length: Segments longer than this (in meters) are split.
+    """
+    starts: np.ndarray
+    ends: np.ndarray
+    max_segment_length: float = 50.
+
+    def __post_init__(self):
+        self.starts = np.asarray(self.starts, dtype=np.float64).reshape(-1, 2)
+        self.ends = np.asarray(self.ends, dtype=np.float64).reshape(-1, 2)
+        if not len(self.starts):
+            raise ValueError("No road segment to build the index from.")
+        self._origin = np.vstack([self.starts, self.ends]).mean(axis=0)
+        a, b = self._to_plane(self.starts), self._to_plane(self.ends)
+
+        # Split long segments in equal pieces, so that midpoints are never far from any point of their segment
+        pieces = np.maximum(1, np.ceil(np.hypot(*(b - a).T) / self.max_segment_length)).astype(np.int64)
+        segment = np.repeat(np.arange(len(a)), pieces)
+        offset = np.arange(len(segment)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t0 = (offset / pieces[segment])[:, None]
+        t1 = ((offset + 1) / pieces[segment])[:, None]
+        direction = b[segment] - a[segment]
+        self._a = a[segment] + t0 * direction
+        self._b = a[segment] + t1 * direction
+        self._lengths = np.hypot(*(self._b - self._a).T)
+        self._radius = self._lengths.max() / 2
+        self._tree = cKDTree((self._a + self._b) / 2)
+
+    def __len__(self):
+        return len(self._a)
+
+    def length_within(self, points, radius):
+        """
+        Road length (meters) within radius meters of each point: the summed length of the segment pieces whose
+        midpoint is within radius, accurate up to half of max_segment_length at the boundary.
+        :param points: (N, 2) array of (latitude, longitude).
+        :return: (N,) array of lengths.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        neighbors = self._tree.query_ball_point(self._to_plane(points), radius)
+        counts = np.array([len(pieces) for pieces in neighbors], dtype=np.int64)
+        if not counts.sum():
+            return np.zeros(len(points))
+        owner = np.repeat(np.arange(len(points)), counts)
+        return np.bincount(owner, weights=self._lengths[np.concatenate(neighbors).astype(np.int64)], minlength=len(points))
+
+    def _to_plane(self, points):
+        lat0, lon0 = np.radians(self._origin)
+        lat, lon = np.radians(points[:, 0]), np.radians(points[:, 1])
+        return EARTH_RADIUS * np.column_stack([(lon - lon0) * math.cos(lat0), lat - lat0])
+
+    def _from_plane(self, xy):
+        lat0, lon0 = np.radians(self._origin)
+        lat = lat0 + xy[:, 1] / EARTH_RADIUS
+        lon = lon0 + xy[:, 0] / (EARTH_RADIUS * math.cos(lat0))
+        return np.degrees(np.column_stack([lat, lon]))
+
+    @classmethod
+    def from_polylines(cls, polylines, **kwargs):
+        """Build an index from polylines of (latitude, longitude) points."""
+        polylines = [np.asarray(line, dtype=np.float64) for line in polylines if len(line) > 1]
+        if not polylines:
+            raise ValueError("No polyline with at least two points to build the index from.")
+        starts = np.vstack([line[:-1] for line in polylines])
+        ends = np.vstack([line[1:] for line in polylines])
+        return cls(starts, ends, **kwargs)
+
+    @classmethod
+    def from_graph(cls, graph, **kwargs):
+        """Build an index from the edges of a StreetGraph, each undirected edge once."""
+        src = np.repeat(np.arange(len(graph)), np.diff(graph.indptr))
+        dst = graph.indices
+        keep = src < dst
+        nodes = np.column_stack([graph.latitudes, graph.longitudes])
+        return cls(nodes[src[keep]], nodes[dst[keep]], **kwargs)
+
+    @classmethod
+    def from_geojson(cls, path, **kwargs):
+        """Build an index from the LineString / MultiLineString features of a GeoJSON file."""
+        with open(path) as f:
+            data = json.load(f)
+        polylines = []
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") == "LineString":
+                lines = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiLineString":
+                lines = geometry["coordinates"]
+            else:
+                continue
+            # GeoJSON stores [longitude, latitude]
+            polylines.extend([[(lat, lon) for lon, lat, *_ in line] for line in lines])
+        return cls.from_polylines(polylines, **kwargs)
+
+    @classmethod
+    def from_overpass(cls, data, bicycle_only=True, **kwargs):
+        """
+        Build an index from an Overpass API answer (a dict, or the path of its json file), either with way
+        geometries ("out geom") or with separate nodes and ways ("(._;>;); out;").
+        :param bicycle_only: Only keep the ways selected by the bicycle query (see is_bicycle_way).
+        """
+        if not isinstance(data, dict):
+            with open(data) as f:
+                data = json.load(f)
+        elements = data.get("elements", [])
+        nodes = {e["id"]: (e["lat"], e["lon"]) for e in elements if e.get("type") == "node"}
+        polylines = []
+        for element in elements:
+            if element.get("type") != "way":
+                continue
+            if bicycle_only and not is_bicycle_way(element.get("tags", {})):
+                continue
+            if "geometry" in element:
+                polylines.append([(p["lat"], p["lon"]) for p in element["geometry"]])
+            else:
+                polylines.append([nodes[n] for n in element.get("nodes", []) if n in nodes])
+        return cls.from_polylines(polylines, **kwargs)
+
+    @classmethod
+    def fetch(cls, bbox, client=None, **kwargs):
+        """
+        Build an index from a single Overpass request covering a bounding box.
+        :param bbox: Tuple of (south, west, north, east) in degrees.
+        :param client: RoutingClient used for the request, the default shared one if None.
+        """
+        from .client import get_default_client
+
+        client = client if client is not None else get_default_client()
+        data = client.run(client.get_json("overpass", OVERPASS_URL, params=overpass_bbox_request(bbox)))
+        return cls.from_overpass(data, **kwargs)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with RoadIndex.save, or build it from a .geojson or Overpass .json file."""
+        path = str(path)
+        if path.endswith(".geojson"):
+            return cls.from_geojson(path)
+        if path.endswith(".json"):
+            return cls.from_overpass(path)
+        with np.load(path) as data:
+            return cls(data["starts"], data["ends"], float(data["max_segment_length"]))
+
+    def save(self, path):
+        """Save the segments to a compressed .npz file."""
+        np.savez_compressed(
+            path, starts=self.starts, ends=self.ends, max_segment_length=self.max_segment_length
+        )
+
+    def snap(self, points, max_distance=None, k=8):
+        """
+        Snap (latitude, longitude) points to the nearest point of the road segments.
+        :param points: (N, 2) array-like of (latitude, longitude).
+        :param max_distance: Points farther than this (in meters) from every road get NaN coordinates.
+        :param k: Number of nearest segment midpoints first looked at for each point.
+        :return: Tuple of the (N, 2) snapped points and the (N,) snapping distances in meters.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        xy = self._to_plane(points)
+        snapped = np.empty_like(xy)
+        distance = np.empty(len(xy))
+        todo = np.arange(len(xy))
+        k = min(k, len(self))
+        while len(todo):
+            midpoint_distances, candidates = self._tree.query(xy[todo], k=k)
+            midpoint_distances = midpoint_distances.reshape(len(todo), k)
+            projected, distances = self._project(xy[todo][:, None, :], candidates.reshape(len(todo), k))
+            best = np.argmin(distances, axis=1)
+            rows = np.arange(len(todo))
+            snapped[todo], distance[todo] = projected[rows, best], distances[rows, best]
+
+            # Exact once every other segment is known to be farther: their midpoints are beyond the k-th one,
+            # otherwise look at more midpoints for these points
+            if k == len(self):
+                break
+            todo = todo[distance[todo] + self._radius > midpoint_distances[:, -1]]
+            k = min(4 * k, len(self))
+
+        snapped = self._from_plane(snapped)
+        if max_distance is not None:
+            snapped[distance > max_distance] = np.nan
+        return snapped, distance
+
+    def _project(self, xy, segments):
+        """Closest points of segments (any index array) to the points xy broadcast against them."""
+        a, b = self._a[segments], self._b[segments]
+        ab = b - a
+        length2 = np.einsum("...i,...i->...", ab, ab)
+        t = np.einsum("...i,...i->...", xy - a, ab) / np.where(length2 > 0, length2, 1.)
+        projected = a + np.clip(t, 0., 1.)[..., None] * ab
+        return projected, np.hypot(*np.moveaxis(xy - projected, -1, 0))
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+from stravart.coordinates import Coordinates
+from stravart.directions import Direction, Route
+from stravart.search.artifacts import ArtifactStore
+
+
+@pytest.mark.parametrize("precision", [5, 6, 8, 9])
+def test_artifact_round_trip(tmp_path, precision):
+    points = np.array([[48.8612345678, 2.3512345678], [48.8623456789, 2.3623456789], [48.8634567891, 2.3434567891]])
+    path_mapping = {Direction(Coordinates(*points[0]), Coordinates(*points[-1])): Route(points)}
+    store = ArtifactStore(str(tmp_path), precision=precision)
+    artifact = store.get(store.put(Route(points), path_mapping))
+    np.testing.assert_allclose(artifact.final_contour.array, points, atol=10. ** -precision)
+    np.testing.assert_allclose(next(iter(artifact.path_mapping.values())).array, points, atol=10. ** -precision)
@@ -0,0 +1,34 @@
+import sqlite3
+
+from stravart.cache import SegmentCache
+from stravart.coordinates import Coordinates
+from stravart.directions import Direction, Route
+
+
+def accessed(path, cache, direction):
+    with sqlite3.connect(path) as connection:
+        return connection.execute(
+            "SELECT accessed FROM segments WHERE key = ?", (cache.key(direction, "osrm", "walking"),)
+        ).fetchone()[0]
+
+
+def test_disk_hits_buffer_access_times(tmp_path):
+    path = str(tmp_path / "segments.sqlite")
+    direction = Direction(Coordinates(48.86, 2.35), Coordinates(48.87, 2.36))
+    SegmentCache(path=path).set(direction, "osrm", "walking", Route.from_list([(48.86, 2.35), (48.87, 2.36)]))
+    written = accessed(path, SegmentCache(), direction)
+
+    # A new cache only finds the segment on disk
+    cache = SegmentCache(path=path, max_memory_entries=0, access_batch=3)
+    for _ in range(2):
+        assert cache.get(direction, "osrm", "walking") is not None
+    assert cache.disk_hits == 2
+    assert accessed(path, cache, direction) == written
+
+    assert cache.get(direction, "osrm", "walking") is not None
+    first_batch = accessed(path, cache, direction)
+    assert first_batch > written
+
+    cache.get(direction, "osrm", "walking")
+    cache.close()
+    assert accessed(path, cache, direction) > first_batch
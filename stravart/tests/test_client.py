@@ -0,0 +1,51 @@
+import pytest
+
+from stravart.cache import SegmentCache
+from stravart.client import RoutingClient, RoutingError
+from stravart.coordinates import Coordinates
+from stravart.directions import Direction, route_directions
+
+
+class FakeGoogleClient(RoutingClient):
+    """Answers google requests locally: OK with a straight route, except for the listed destinations."""
+
+    def __init__(self, statuses):
+        super().__init__(rate_limits={"google": None})
+        self.statuses = statuses
+
+    async def get_json(self, provider, url, params=None, semaphore=None):
+        status = self.statuses.get(params["destination"], "OK")
+        if status == "HTTP":
+            raise RoutingError("google request failed with status 500")
+        if status != "OK":
+            return {"status": status, "routes": []}
+        start, end = (tuple(map(float, params[key].split(","))) for key in ("origin", "destination"))
+        step = {"start_location": {"lat": start[0], "lng": start[1]}}
+        return {"status": "OK", "routes": [{"legs": [{"steps": [step]}]}]}
+
+
+@pytest.fixture
+def directions():
+    points = [Coordinates(48.86, 2.35 + 0.01 * k) for k in range(4)]
+    return [Direction(start, end) for start, end in zip(points[:-1], points[1:])]
+
+
+def test_route_many_collects_failures(directions):
+    _, params = directions[1].request("google", "walking")
+    with FakeGoogleClient({params["destination"]: "HTTP"}) as client:
+        results = client.route_many_sync(directions, return_exceptions=True)
+        assert isinstance(results[1], RoutingError)
+        assert all(len(results[k]) for k in (0, 2))
+        with pytest.raises(RoutingError):
+            client.route_many_sync(directions)
+
+
+def test_google_error_status(directions):
+    _, params = directions[2].request("google", "walking")
+    cache = SegmentCache()
+    with FakeGoogleClient({params["destination"]: "ZERO_RESULTS"}) as client:
+        with pytest.raises(RoutingError, match="ZERO_RESULTS"):
+            route_directions(directions, cache=cache, client=client)
+    # The segments routed before the error are kept
+    assert cache.get(directions[0], "google", "walking") is not None
+    assert cache.get(directions[2], "google", "walking") is None
@@ -0,0 +1,50 @@
+import optuna
+import pytest
+
+from stravart.client import RoutingError
+from stravart.directions import Route
+from stravart.graph import StreetGraph
+from stravart.polygone import Polygon
+from stravart.search.optimization import objective
+
+
+@pytest.fixture
+def disconnected_graph():
+    # Two streets without any shared point, 1km apart
+    return StreetGraph.from_polylines([
+        [(48.860, 2.350), (48.861, 2.350), (48.862, 2.350)],
+        [(48.860, 2.364), (48.861, 2.364), (48.862, 2.364)],
+    ])
+
+
+def test_local_route_connected(disconnected_graph):
+    route = Route.from_list([(48.860, 2.350), (48.862, 2.350)])
+    final_contour, path_mapping = route.fill_paths_between_points(provider="local", graph=disconnected_graph, apply_filter=False)
+    assert len(final_contour) == 3
+    assert len(path_mapping) == 1
+
+
+def test_local_route_unreachable(disconnected_graph):
+    route = Route.from_list([(48.860, 2.350), (48.862, 2.364)])
+    with pytest.raises(RoutingError):
+        route.fill_paths_between_points(provider="local", graph=disconnected_graph)
+
+
+def test_local_route_detour():
+    # U-shaped street: its ends are 100m apart, but about 1km apart by road
+    graph = StreetGraph.from_polylines([[(48.860, 2.350), (48.8645, 2.350), (48.8645, 2.35136), (48.860, 2.35136)]])
+    start, end = (48.860, 2.350), (48.860, 2.35136)
+    assert graph.shortest_paths([start], [end]) == [graph.shortest_path(start, end)]
+    final_contour, _ = Route.from_list([start, end]).fill_paths_between_points(provider="local", graph=graph, apply_filter=False)
+    assert len(final_contour) == 4
+
+
+def test_unreachable_trial_is_pruned(disconnected_graph):
+    poly = Polygon.from_list([(-1, -1), (1, -1), (1, 1), (-1, 1), (-1, -1)], system="cartesian")
+    study = optuna.create_study(direction="minimize", sampler=optuna.samplers.RandomSampler(seed=0))
+    study.optimize(
+        lambda trial: objective(trial, poly=poly, city_grid=[(48.861, 2.357)], provider="local", graph=disconnected_graph),
+        n_trials=2,
+    )
+    assert all(trial.state == optuna.trial.TrialState.PRUNED for trial in study.trials)
+    assert all("routing_error" in trial.user_attrs for trial in study.trials)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from stravart.search.metrics import compare_polygons, get_angles
+
+
+def baseline_compare_polygons(poly1, poly2, threshold=45):
+    """compare_polygons as it was, with one calculate_angle call per vertex."""
+    def angles(polygon):
+        result = []
+        for i in range(len(polygon)):
+            v1 = np.array(polygon[i - 1]) - np.array(polygon[i])
+            v2 = np.array(polygon[(i + 1) % len(polygon)]) - np.array(polygon[i])
+            result.append(np.degrees(np.arctan2(*v2[::-1]) - np.arctan2(*v1[::-1])))
+        return result
+
+    return [i for i, (a, b) in enumerate(zip(angles(poly1), angles(poly2))) if abs(a - b) > threshold]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_compare_polygons_equal_lengths(seed):
+    rng = np.random.default_rng(seed)
+    poly1, poly2 = rng.uniform(size=(2, 30, 2)).tolist()
+    assert compare_polygons(poly1, poly2) == baseline_compare_polygons(poly1, poly2)
+    assert isinstance(get_angles(poly1), list)
+
+
+def test_compare_polygons_wrap():
+    # Same corners, the angle of the first vertex is 270 degrees in one and -90 degrees in the other
+    square = [(0, 0), (1, 0), (1, 1), (0, 1)]
+    rotated = [(0, 1), (0, 0), (1, 0), (1, 1)]
+    assert compare_polygons(square, rotated) != []
+    assert compare_polygons(square, rotated, wrap=True) == []
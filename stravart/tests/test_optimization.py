@@ -0,0 +1,24 @@
+import numpy as np
+import optuna
+
+from stravart.graph import StreetGraph
+from stravart.polygone import Polygon
+from stravart.search.incremental import IncrementalEvaluator
+from stravart.search.metrics import diff_area
+from stravart.search.optimization import objective
+
+
+def test_simplified_loss(tmp_path):
+    graph = StreetGraph.grid((48.86, 2.35), size=6000, spacing=100)
+    angles = np.linspace(0, 2 * np.pi, 30, endpoint=False)
+    points = np.column_stack([np.cos(angles), np.sin(angles)]) * (1 + 0.3 * np.sin(5 * angles))[:, None]
+    poly = Polygon.from_list(np.vstack([points, points[:1]]).tolist(), system="cartesian")
+    for evaluator in (None, IncrementalEvaluator(provider="local", graph=graph)):
+        study = optuna.create_study(direction="minimize", sampler=optuna.samplers.RandomSampler(seed=0))
+        study.optimize(lambda trial: objective(trial, poly=poly, city_grid=[(48.86, 2.35)], provider="local", graph=graph,
+                                               evaluator=evaluator, simplify_tolerance=20), n_trials=2)
+        for trial in study.trials:
+            final_contour, path_mapping = trial.user_attrs["final_contour"], trial.user_attrs["path_mapping"]
+            assert trial.value == diff_area(final_contour, path_mapping)
+            # Collinear points along the grid streets are dropped from every segment
+            assert all(len(route) <= 4 for route in path_mapping.values())
@@ -0,0 +1,15 @@
+import numpy as np
+
+from stravart.snapping import RoadIndex
+
+
+def test_length_within_short_segments():
+    # 2km straight street, either in one segment or in 7m segments, centered on the query point
+    line = np.column_stack([np.full(287, 48.86), np.linspace(2.3365, 2.3635, 287)])
+    long_segment = RoadIndex.from_polylines([line[[0, -1]]])
+    short_segments = RoadIndex.from_polylines([line])
+    center = [(48.86, 2.35)]
+    expected = 1000.
+    for index in (long_segment, short_segments):
+        assert abs(index.length_within(center, 500)[0] - expected) <= index.max_segment_length
+    assert RoadIndex.from_polylines([line]).length_within([(48.0, 2.0)], 500)[0] == 0.
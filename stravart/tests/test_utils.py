@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from stravart.utils import haversine, order_coordinates_by_nearest_neighbors
+
+
+def scan_order(coordinates):
+    """Reference greedy tour, scanning every remaining point with the haversine distance."""
+    remaining = list(coordinates)
+    ordered = [remaining.pop(0)]
+    while remaining:
+        last = ordered[-1]
+        index = min(range(len(remaining)), key=lambda i: haversine(last[0], last[1], remaining[i][0], remaining[i][1]))
+        ordered.append(remaining.pop(index))
+    return ordered
+
+
+def test_nearest_neighbors_ties():
+    coordinates = [(2.301, 48.801), (2.301, 48.802), (2.302, 48.802), (2.301, 48.801), (2.302, 48.801), (2.3, 48.801)]
+    assert order_coordinates_by_nearest_neighbors(list(coordinates)) == scan_order(coordinates)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_nearest_neighbors_lattice(seed):
+    rng = np.random.default_rng(seed)
+    points = np.round(rng.integers(0, 5, size=(40, 2)) * 0.001 + [2.3, 48.8], 6)
+    coordinates = [tuple(point) for point in points.tolist()]
+    assert order_coordinates_by_nearest_neighbors(coordinates) == scan_order(coordinates)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_two_opt_keeps_start(seed):
+    rng = np.random.default_rng(seed)
+    coordinates = [tuple(point) for point in (rng.uniform(size=(60, 2)) * 0.05 + [2.3, 48.8]).tolist()]
+    result = order_coordinates_by_nearest_neighbors(coordinates, two_opt=True)
+    assert result[0] == coordinates[0]
+    assert sorted(result) == sorted(coordinates)
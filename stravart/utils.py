@@ -1,8 +1,17 @@
-import gpxpy
-import gpxpy.gpx
 import os
 import matplotlib.pyplot as plt
+import numpy as np
 from math import radians, sin, cos, asin, sqrt
+from scipy.spatial import cKDTree
+
+# Slack of the chord distances within which neighbors are compared with the haversine distance
+_TIE_RELATIVE, _TIE_ABSOLUTE = 1e-9, 1e-12
+
+def to_unit_xyz(latitudes, longitudes):
+    """Map degrees to points on the unit sphere, so that euclidean nearest neighbors are great circle ones."""
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
 
 def are_collinear(p1, p2, p3):
     """
@@ -22,41 +31,139 @@ def are_collinear(p1, p2, p3):
 
 def simplify_coordinates(coordinates):
     """
-    Simplify a list of coordinates by removing collinear points.
+    Simplify a list of coordinates by removing exactly collinear points, see stravart.simplification
+    for GPS routes and tolerances in meters.
+    """
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return list(coordinates)
+    a, b, c = points[:-2], points[1:-1], points[2:]
+    # Cross product of each triple, zero when its points are collinear
+    cross = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])
+    keep = np.concatenate([[True], cross != 0, [True]])
+    return [coordinates[i] for i in np.flatnonzero(keep)]
+
+def nearest_neighbor_order(latitudes, longitudes, start=0):
+    """
+    Greedy nearest neighbor tour of points: starting from start, always go to the closest unvisited point.
+    Neighbors are searched in a KD-tree of the points on the unit sphere, rebuilt on the unvisited points
+    once most of them are visited. The closest neighbors of the KD-tree are compared with the haversine
+    distance, ties going to the lowest index, so that the tour is the one of a scan of all the points.
+    :return: Array of the indices of the points in tour order.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    xyz = to_unit_xyz(latitudes, longitudes)
+    lats, lons = latitudes.tolist(), longitudes.tolist()
+    n = len(xyz)
+    order = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return order
+    visited = np.zeros(n, dtype=bool)
+    remaining = np.arange(n)
+    tree = cKDTree(xyz)
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        left = n - step - 1
+        if left == 0:
+            break
+        if left < len(remaining) // 4:
+            # Most indexed points are visited, index the unvisited ones only
+            remaining = np.flatnonzero(~visited)
+            tree = cKDTree(xyz[remaining])
+        k = min(8, len(remaining))
+        while True:
+            distances, neighbors = tree.query(xyz[current], k=k)
+            distances, neighbors = np.atleast_1d(distances), remaining[np.atleast_1d(neighbors)]
+            unvisited = ~visited[neighbors]
+            if unvisited.any():
+                threshold = distances[unvisited].min() * (1 + _TIE_RELATIVE) + _TIE_ABSOLUTE
+                # Neighbors beyond the k-th could be as close as the closest one found
+                if k == len(remaining) or distances[-1] > threshold:
+                    break
+            k = min(4 * k, len(remaining))
+        # Chord and haversine distances round differently, near ties are decided as by a haversine scan
+        candidates = neighbors[unvisited & (distances <= threshold)].tolist()
+        current = min(candidates, key=lambda i: (haversine(lons[current], lats[current], lons[i], lats[i]), i))
+    return order
+
+
+def two_opt_order(latitudes, longitudes, order, neighbors=8, max_passes=10):
+    """
+    Shorten an open tour with 2-opt moves: reverse the part of the tour between two edges when
+    reconnecting their ends is shorter. The tour keeps its first point. Only the moves creating an edge to one of the neighbors
+    nearest points of a point are tried, so that a pass is linear in the number of points.
+    :param order: Indices of the points in tour order, left untouched.
+    :return: Array of the indices of the points in the improved tour order.
     """
-    simplified = [coordinates[0]]
-    for i in range(1, len(coordinates) - 1):
-        if not are_collinear(coordinates[i - 1], coordinates[i], coordinates[i + 1]):
-            simplified.append(coordinates[i])
-    simplified.append(coordinates[-1])
-    return simplified
+    xyz = to_unit_xyz(np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64))
+    order = np.array(order, dtype=np.int64)
+    n = len(order)
+    if n < 4:
+        return order
+    _, candidates = cKDTree(xyz).query(xyz, k=min(neighbors + 1, n))
+    candidates = candidates[:, 1:].tolist()
+    points = xyz.tolist()
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+
+    def distance(i, j):
+        (x1, y1, z1), (x2, y2, z2) = points[i], points[j]
+        return ((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            a, b = order[i], order[i + 1]
+            for c in candidates[a]:
+                j = position[c]
+                if j > i + 1:
+                    # Edges (a, b) and (c, d) become (a, c) and (b, d), d being absent at the end of the tour
+                    d = order[j + 1] if j + 1 < n else None
+                    gain = distance(a, b) - distance(a, c)
+                    if d is not None:
+                        gain += distance(c, d) - distance(b, d)
+                    if gain > 1e-15:
+                        order[i + 1:j + 1] = order[i + 1:j + 1][::-1].copy()
+                        position[order[i + 1:j + 1]] = np.arange(i + 1, j + 1)
+                        improved = True
+                        break
+                elif 0 < j < i - 1:
+                    # Edges (e, c) and (a, b) become (e, a) and (c, b) when reversing the tour from c to a,
+                    # the first point of the tour is never moved
+                    e = order[j - 1]
+                    gain = distance(a, b) - distance(c, b) + distance(e, c) - distance(e, a)
+                    if gain > 1e-15:
+                        order[j:i + 1] = order[j:i + 1][::-1].copy()
+                        position[order[j:i + 1]] = np.arange(j, i + 1)
+                        improved = True
+                        break
+        if not improved:
+            break
+    return order
+
 
-def order_coordinates_by_nearest_neighbors(coordinates):
+def order_coordinates_by_nearest_neighbors(coordinates, two_opt=False, max_passes=10):
     """
-    Order a list of coordinates by nearest neighbors.
+    Order a list of coordinates by nearest neighbors, starting from the first one.
 
     Args:
-    coordinates (list): List of tuples (longitude, latitude).
+    coordinates (list): List of tuples (longitude, latitude), left untouched.
+    two_opt (bool): Shorten the greedy tour with 2-opt moves, see two_opt_order.
+    max_passes (int): Maximum number of 2-opt passes over the tour.
 
     Returns:
     list: Ordered list of coordinates.
     """
-    if not coordinates:
+    if not len(coordinates):
         return []
-
-    ordered_coords = [coordinates.pop(0)]  # Start with the first point and remove it from the list
-
-    while coordinates:
-        last_coord = ordered_coords[-1]
-        # Find the nearest neighbor
-        nearest_neighbor, nn_index = min(
-            ((coord, idx) for idx, coord in enumerate(coordinates)),
-            key=lambda item: haversine(last_coord[0], last_coord[1], item[0][0], item[0][1])
-        )
-        ordered_coords.append(nearest_neighbor)
-        del coordinates[nn_index]  # Remove the nearest neighbor from the list
-
-    return ordered_coords
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    order = nearest_neighbor_order(points[:, 1], points[:, 0])
+    if two_opt:
+        order = two_opt_order(points[:, 1], points[:, 0], order, max_passes=max_passes)
+    return [coordinates[i] for i in order]
 
 def haversine(lon1, lat1, lon2, lat2):
     """
@@ -74,16 +181,33 @@ def haversine(lon1, lat1, lon2, lat2):
     r = 6371 # Radius of earth in kilometers
     return c * r
 
+def haversine_array(lon1, lat1, lon2, lat2):
+    """
+    Vectorized haversine: great circle distances in kilometers between arrays of points
+    (specified in decimal degrees).
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+    r = 6371 # Radius of earth in kilometers
+    return c * r
+
+def close_points_mask(points, min_distance):
+    """
+    Mask of the points to keep when dropping every point closer than min_distance (meters)
+    to the point preceding it. The first point is always kept.
+    :param points: (N, 2) array of (latitude, longitude).
+    """
+    keep = np.ones(len(points), dtype=bool)
+    if len(points) > 1:
+        distances = haversine_array(points[:-1, 1], points[:-1, 0], points[1:, 1], points[1:, 0]) * 1000
+        keep[1:] = distances >= min_distance
+    return keep
+
 def create_gpx_file(coordinates_list, filename, output_dir="../routes/"):
-    gpx = gpxpy.gpx.GPX()
-    track = gpxpy.gpx.GPXTrack()
-    gpx.tracks.append(track)
-    segment = gpxpy.gpx.GPXTrackSegment()
-    track.segments.append(segment)
-
-    for coord in coordinates_list:
-        segment.points.append(gpxpy.gpx.GPXTrackPoint(coord[0], coord[1]))
-    
+    """Write one route to a GPX file, see stravart.export to write many routes at once."""
+    from stravart.export import GPXWriter
+
     full_path = os.path.abspath(os.path.join(output_dir, filename))
-    with open(full_path, 'w') as f:
-        f.write(gpx.to_xml())
\ No newline at end of file
+    with GPXWriter(full_path) as writer:
+        writer.write(coordinates_list, name=os.path.splitext(filename)[0])
\ No newline at end of file
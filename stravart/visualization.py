@@ -6,9 +6,16 @@ from adjustText import adjust_text
 
 from stravart.directions import Route
 from stravart.contours.contours import Contour
+from stravart.simplification import simplify_route
+
+def plot_route(map_center, route: Route, contour = True, points = True, simplify_tolerance=None, simplify_method="douglas_peucker"):
+    """
+    Folium map of a route.
+    :param simplify_tolerance: If set, the route is simplified (tolerance in meters) before being drawn.
+    """
+    if simplify_tolerance:
+        route = simplify_route(route, simplify_tolerance, simplify_method)
 
-def plot_route(map_center, route: Route, contour = True, points = True):
-    
     m = folium.Map(location=map_center, zoom_start=15)
     
     if points: